@@ -2,15 +2,19 @@
 import os
 import re
 import csv
+import atexit
+import hashlib
 import shutil
-import subprocess
-import unicodedata
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 
 import pandas as pd
 
+from saf.conversion import ConversionPool
+from saf.conversion_cache import ConversionCache
+from saf.crosswalk import CAREER_FIELDS, compile_crosswalk, norm_text
+
 
 # =========================
 # CONFIG
@@ -30,6 +34,12 @@ SOFFICE_FALLBACK_PATHS = [
     r"C:\Program Files\LibreOffice\program\soffice.exe",
     r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
 ]
+# Perfiles aislados de LibreOffice (uno por worker) para no chocar con el perfil del usuario.
+SOFFICE_PROFILE_ROOT = BASE_DIR / "soffice_profiles"
+SOFFICE_WORKERS = 1
+# Cache de PDFs convertidos (compartida con la web si apunta a la misma carpeta).
+CONVERSION_CACHE_ROOT = BASE_DIR / "conversion_cache"
+CONVERSION_CACHE_MAX_MB = 2048
 
 # Si quieres subir Turnitin al repositorio (muchas U no lo publican)
 INCLUDE_TURNITIN = True
@@ -55,29 +65,10 @@ IMPORT_TARGETS = [
     ("PSICOLOGIA", "20.500.14441/109"),
 ]
 
-DEFAULT_METADATA_LANGUAGE = "es"
-LANGUAGE_EXCLUDED_QUALIFIERS = {"dni", "uri", "date"}
-URI_VALUE_PREFIXES = ("http://", "https://", "hdl:")
-FORCED_LANGUAGE_FIELDS = {
-    ("dc", "rights", "uri"),
-    ("renati", "advisor", "orcid"),
-    ("renati", "type", ""),
-    ("renati", "level", ""),
-    ("dc", "subject", "ocde"),
-}
-MetadataEntry = Tuple[str, str, str, str, str]
-
 
 # =========================
 # UTILS
 # =========================
-def norm_text(s: str) -> str:
-    s = (s or "").strip().upper()
-    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-
 def extract_nro_from_folder(folder_name: str) -> Optional[int]:
     """
     extrae el nro desde el prefijo: '001 ...' o '001_...' o '1 ...'
@@ -129,6 +120,14 @@ def resolve_soffice_binary() -> Optional[str]:
     return None
 
 
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def list_files_recursive(root: Path) -> List[Path]:
     return [p for p in root.rglob("*") if p.is_file()]
 
@@ -166,163 +165,46 @@ def pick_main_thesis_file(candidates: List[Path]) -> Optional[Path]:
     return max(candidates, key=lambda p: p.stat().st_size)
 
 
-def convert_docx_to_pdf(docx_path: Path, out_pdf_path: Path) -> Tuple[bool, str]:
-    """
-    Convierte con LibreOffice headless.
-    """
-    soffice = resolve_soffice_binary()
-    if not soffice:
-        return False, (
-            "No se encontro 'soffice'. Instala LibreOffice o configura SOFFICE_PATH "
-            "(ejemplo: C:\\Program Files\\LibreOffice\\program\\soffice.exe)."
-        )
+_CONVERSION_POOL: Optional[ConversionPool] = None
 
-    out_dir = out_pdf_path.parent
-    ensure_dir(out_dir)
-
-    cmd = [
-        soffice,
-        "--headless",
-        "--nologo",
-        "--nofirststartwizard",
-        "--convert-to",
-        "pdf",
-        "--outdir",
-        str(out_dir),
-        str(docx_path),
-    ]
-    try:
-        res = subprocess.run(cmd, capture_output=True, text=True, timeout=180)
-        if res.returncode != 0:
-            return False, f"LibreOffice error: {res.stderr.strip() or res.stdout.strip()}"
-        # LibreOffice genera nombre basado en docx
-        generated = out_dir / (docx_path.stem + ".pdf")
-        if not generated.exists():
-            return False, "No se encontrÃ³ el PDF generado por LibreOffice."
-        # renombrar a out_pdf_path (tesis.pdf)
-        if generated != out_pdf_path:
-            if out_pdf_path.exists():
-                out_pdf_path.unlink()
-            generated.rename(out_pdf_path)
-        return True, "OK"
-    except FileNotFoundError:
-        return False, f"No se pudo ejecutar soffice en: {soffice}"
-    except subprocess.TimeoutExpired:
-        return False, "Timeout convirtiendo DOCX a PDF."
-    except Exception as e:
-        return False, f"ExcepciÃ³n convertiendo DOCX: {e}"
-
-
-def infer_metadata_language(schema: str, element: str, qualifier: str, value: str) -> str:
-    schema_norm = (schema or "").strip().lower()
-    qualifier_norm = (qualifier or "").strip().lower()
-    element_norm = (element or "").strip().lower()
-    value_norm = (value or "").strip().lower()
-    if not value_norm:
-        return ""
-    if (schema_norm, element_norm, qualifier_norm) in FORCED_LANGUAGE_FIELDS:
-        return DEFAULT_METADATA_LANGUAGE
-    if element_norm == "date":
-        return ""
-    if qualifier_norm in LANGUAGE_EXCLUDED_QUALIFIERS:
-        return ""
-    if value_norm.startswith(URI_VALUE_PREFIXES):
-        return ""
-    return DEFAULT_METADATA_LANGUAGE
-
-
-def make_metadata_entry(
-    schema: str,
-    element: str,
-    qualifier: str,
-    value: str,
-    language: Optional[str] = None,
-) -> MetadataEntry:
-    val = ("" if value is None else str(value)).strip()
-    lang = infer_metadata_language(schema, element, qualifier, val) if language is None else (language or "").strip()
-    return (schema, element, qualifier, lang, val)
-
-
-def normalize_integer_like(value: str) -> str:
-    text = ("" if value is None else str(value)).strip()
-    if re.fullmatch(r"\d+\.0+", text):
-        return text.split(".", 1)[0]
-    return text
-
-
-def split_subjects(keywords: str) -> List[str]:
-    text = (keywords or "").strip()
-    if not text:
-        return []
-
-    if ";" in text or "|" in text or "\n" in text:
-        raw_parts = re.split(r"[;\|\n]+", text)
-    elif "," in text:
-        raw_parts = text.split(",")
-    else:
-        raw_parts = [text]
 
-    subjects: List[str] = []
-    seen = set()
-    for raw in raw_parts:
-        term = raw.strip(" \t\r\n,;.")
-        if not term:
-            continue
-        key = norm_text(term)
-        if key in seen:
-            continue
-        seen.add(key)
-        subjects.append(term)
-    return subjects
-
-
-def write_dublin_core_xml(out_path: Path, metadata: List[MetadataEntry]):
+def get_conversion_pool() -> Optional[ConversionPool]:
     """
-    Escribe SOLO los campos dc en dublin_core.xml.
-    metadata: lista de (schema, element, qualifier, language, value)
+    Pool de LibreOffice con perfil aislado (y soffice residente) reutilizado en toda la corrida.
     """
-    dc_items = [(s, e, q, l, v) for s, e, q, l, v in metadata if s == "dc"]
-    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<dublin_core>']
-    for _, element, qualifier, language, value in dc_items:
-        value = (value or "").strip()
-        if not value:
-            continue
-        q_attr = f' qualifier="{qualifier}"' if qualifier else ""
-        l_attr = f' language="{language}"' if language else ""
-        lines.append(f'  <dcvalue element="{element}"{q_attr}{l_attr}>{escape_xml(value)}</dcvalue>')
-    lines.append("</dublin_core>")
-    out_path.write_text("\n".join(lines), encoding="utf-8")
+    global _CONVERSION_POOL
+    if _CONVERSION_POOL is None:
+        soffice = resolve_soffice_binary()
+        if not soffice:
+            return None
+        _CONVERSION_POOL = ConversionPool(soffice, size=SOFFICE_WORKERS, profile_root=SOFFICE_PROFILE_ROOT)
+        atexit.register(_CONVERSION_POOL.shutdown)
+    return _CONVERSION_POOL
 
 
-def write_metadata_schema_xml(out_dir: Path, schema: str, metadata: List[MetadataEntry]):
+def convert_docx_to_pdf(docx_path: Path, out_pdf_path: Path) -> Tuple[bool, str]:
     """
-    Escribe metadata_<schema>.xml para esquemas distintos a dc (renati, thesis, etc.).
-    DSpace SAF requiere archivos separados por cada schema no-dc.
+    Convierte con LibreOffice headless.
     """
-    items = [(s, e, q, l, v) for s, e, q, l, v in metadata if s == schema]
-    if not items:
-        return
-    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<dublin_core schema="{schema}">']
-    for _, element, qualifier, language, value in items:
-        value = (value or "").strip()
-        if not value:
-            continue
-        q_attr = f' qualifier="{qualifier}"' if qualifier else ""
-        l_attr = f' language="{language}"' if language else ""
-        lines.append(f'  <dcvalue element="{element}"{q_attr}{l_attr}>{escape_xml(value)}</dcvalue>')
-    lines.append("</dublin_core>")
-    out_path = out_dir / f"metadata_{schema}.xml"
-    out_path.write_text("\n".join(lines), encoding="utf-8")
-
+    pool = get_conversion_pool()
+    if not pool:
+        return False, (
+            "No se encontro 'soffice'. Instala LibreOffice o configura SOFFICE_PATH "
+            "(ejemplo: C:\\Program Files\\LibreOffice\\program\\soffice.exe)."
+        )
 
-def escape_xml(s: str) -> str:
-    return (
-        s.replace("&", "&amp;")
-         .replace("<", "&lt;")
-         .replace(">", "&gt;")
-         .replace('"', "&quot;")
-         .replace("'", "&apos;")
-    )
+    ensure_dir(out_pdf_path.parent)
+    cache = ConversionCache(CONVERSION_CACHE_ROOT, max_bytes=CONVERSION_CACHE_MAX_MB * 1024 * 1024)
+    sha = sha256_file(docx_path)
+    cached = cache.get(sha, pool.version)
+    if cached:
+        shutil.copyfile(cached, out_pdf_path)
+        return True, "OK (cache)"
+    ok, msg = pool.convert(docx_path, out_pdf_path)
+    if not ok:
+        return False, f"LibreOffice error: {msg}"
+    cache.put(sha, pool.version, out_pdf_path)
+    return True, "OK"
 
 
 def write_contents_file(out_path: Path, files: List[str]):
@@ -745,6 +627,23 @@ def generate_import_bats(out_dir: Path):
         todo_path.write_bytes(render_importar_todo_bat(existing).encode("ascii"))
 
 
+def row_crosswalk_values(row: Dict[str, str], keywords: str) -> Dict[str, str]:
+    """Columnas de la plantilla Excel -> campos del crosswalk (saf.crosswalk)."""
+    values = {
+        "title": str(row.get("TITULO", "")).strip(),
+        "advisor": str(row.get("ASESOR_APELLIDOS_NOMBRES", "")).strip(),
+        "advisor_dni": row.get("ASESOR_DNI", ""),
+        "advisor_orcid": str(row.get("ASESOR_ORCID", "")).strip(),
+        "abstract": str(row.get("RESUMEN", "")).strip(),
+        "keywords": keywords,
+    }
+    for idx in [1, 2, 3]:
+        values[f"author{idx}"] = str(row.get(f"AUTOR{idx}_APELLIDOS_NOMBRES", "")).strip()
+        values[f"author{idx}_dni"] = row.get(f"AUTOR{idx}_DNI", "")
+        values[f"juror{idx}"] = str(row.get(f"JURADO{idx}_APELLIDOS_NOMBRES", "")).strip()
+    return values
+
+
 # =========================
 # LOAD INPUTS
 # =========================
@@ -817,6 +716,7 @@ def main():
 
     ensure_dir(OUT_SAF_ROOT)
 
+    crosswalk = compile_crosswalk({"year": str(datetime.now().year)})
     report = []
     for row in rows:
         nro = row["NRO"]
@@ -895,87 +795,21 @@ def main():
             shutil.copy2(LICENSE_FILE, item_dir / LICENSE_FILE.name)
             has_license = True
 
-        # Build dublin_core.xml metadata
-        md: List[MetadataEntry] = []
-
-        def add_md(schema: str, element: str, qualifier: str, value: str, language: Optional[str] = None):
-            md.append(make_metadata_entry(schema, element, qualifier, value, language))
-
-        # Core dc
-        add_md("dc", "title", "", str(row.get("TITULO", "")).strip())
-        add_md("dc", "date", "issued", row.get("FECHA_ISSUED", ""))
-        add_md("dc", "language", "iso", "spa")
-        add_md("dc", "format", "", "application/pdf")
-        add_md("dc", "type", "", "info:eu-repo/semantics/bachelorThesis")
-        add_md("dc", "rights", "", "info:eu-repo/semantics/openAccess")
-
-        # Authors (hasta 3)
-        for idx in [1,2,3]:
-            a = str(row.get(f"AUTOR{idx}_APELLIDOS_NOMBRES", "")).strip()
-            if a:
-                add_md("dc", "contributor", "author", a)
-            dni = normalize_integer_like(row.get(f"AUTOR{idx}_DNI", ""))
-            if dni:
-                add_md("renati", "author", "dni", dni)
-
-        # Advisor
-        adv = str(row.get("ASESOR_APELLIDOS_NOMBRES","")).strip()
-        if adv:
-            add_md("dc", "contributor", "advisor", adv)
-        adv_dni = normalize_integer_like(row.get("ASESOR_DNI",""))
-        if adv_dni:
-            add_md("renati", "advisor", "dni", adv_dni)
-        orcid = str(row.get("ASESOR_ORCID","")).strip()
-        if orcid:
-            add_md("renati", "advisor", "orcid", orcid)
-
-        # Jurados como renati.juror (cada uno por separado)
-        for jkey in ["JURADO1_APELLIDOS_NOMBRES", "JURADO2_APELLIDOS_NOMBRES", "JURADO3_APELLIDOS_NOMBRES"]:
-            jval = str(row.get(jkey, "")).strip()
-            if jval:
-                add_md("renati", "juror", "", jval)
-
-        # Resumen/keywords
-        resumen = str(row.get("RESUMEN","")).strip()
-        if resumen:
-            add_md("dc", "description", "abstract", resumen)
+        # Metadata via the shared crosswalk (career blocks rendered once per carrera)
         keywords = ""
         for key_name in ["KEYWORDS (separar con ';')", "KEYWORDS", "PALABRAS_CLAVE", "SUBJECT", "SUBJECTS"]:
             candidate = str(row.get(key_name, "")).strip()
             if candidate:
                 keywords = candidate
                 break
-        if keywords:
-            for subject in split_subjects(keywords):
-                add_md("dc", "subject", "", subject)
-
-        # Campos fijos RENATI/DC
-        add_md("renati", "type", "", "https://purl.org/pe-repo/renati/type#tesis")
-        add_md("dc", "type", "version", "info:eu-repo/semantics/publishedVersion")
-        add_md("dc", "publisher", "", "Universidad Autónoma de Ica")
-        add_md("dc", "publisher", "country", "PE")
-        add_md("dc", "rights", "uri", "https://creativecommons.org/licenses/by/4.0")
-
-        # Degree + RENATI + OCDE (from career_map if present)
-        if cmap.get("thesis_degree_name"):
-            add_md("thesis", "degree", "name", cmap["thesis_degree_name"])
-        if cmap.get("thesis_degree_discipline"):
-            add_md("thesis", "degree", "discipline", cmap["thesis_degree_discipline"])
-        if cmap.get("thesis_degree_grantor"):
-            add_md("thesis", "degree", "grantor", cmap["thesis_degree_grantor"])
-        if cmap.get("renati_level"):
-            add_md("renati", "level", "", cmap["renati_level"])
-        if cmap.get("renati_discipline"):
-            add_md("renati", "discipline", "", cmap["renati_discipline"])
-        if cmap.get("ocde_url"):
-            add_md("dc", "subject", "ocde", cmap["ocde_url"])
-
-        # Write SAF files (split by schema)
-        write_dublin_core_xml(item_dir / "dublin_core.xml", md)
-        # Schemas no-dc van en archivos separados: metadata_renati.xml, metadata_thesis.xml
-        extra_schemas = sorted(set(s for s, _, _, _, _ in md if s != "dc"))
-        for schema in extra_schemas:
-            write_metadata_schema_xml(item_dir, schema, md)
+        rendered = crosswalk.render(
+            row_crosswalk_values(row, keywords),
+            career={name: cmap.get(name, "") for name in CAREER_FIELDS},
+            career_key=carrera_norm,
+        )
+        # dublin_core.xml + metadata_<schema>.xml (renati, thesis): DSpace SAF requiere un archivo por schema no-dc.
+        for file_name, data in rendered.files.items():
+            (item_dir / file_name).write_bytes(data)
 
         # contents: licencia + tesis primaria + adjuntos
         contents_list = []
@@ -17,8 +17,8 @@ class ThesisRecordAdmin(admin.ModelAdmin):
 
 @admin.register(ThesisFile)
 class ThesisFileAdmin(admin.ModelAdmin):
-    list_display = ("record", "file_type", "original_name", "size_bytes", "created_at")
-    list_filter = ("file_type",)
+    list_display = ("record", "file_type", "original_name", "size_bytes", "conversion_status", "created_at")
+    list_filter = ("file_type", "conversion_status")
     search_fields = ("original_name", "record__titulo")
 
 
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:18
+
+import registry.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0007_alter_thesisrecord_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thesisfile',
+            name='conversion_detail',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='thesisfile',
+            name='conversion_status',
+            field=models.CharField(blank=True, choices=[('', 'No aplica'), ('PENDING', 'En cola'), ('RUNNING', 'Convirtiendo'), ('OK', 'PDF listo'), ('ERROR', 'Error de conversión')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='thesisfile',
+            name='converted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='thesisfile',
+            name='converted_pdf',
+            field=models.FileField(blank=True, upload_to=registry.models.thesis_file_converted_upload_to),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import os
 import uuid
+from pathlib import Path
 from django.conf import settings
 from django.db import models, transaction
 from django.utils import timezone
@@ -234,6 +235,10 @@ class ThesisRecord(models.Model):
         self.save(update_fields=["status", "approved_by", "approved_at", "updated_at"])
 
 
+def thesis_file_converted_upload_to(instance, filename):
+    return f"records/{instance.record_id}/tesis_docx_pdf_{uuid.uuid4().hex}.pdf"
+
+
 class ThesisFile(models.Model):
     TYPE_TESIS_DOCX = "tesis_docx"
     TYPE_TESIS_PDF = "tesis_pdf"
@@ -245,6 +250,18 @@ class ThesisFile(models.Model):
         (TYPE_FORMULARIO, "Formulario"),
         (TYPE_TURNITIN, "Turnitin"),
     ]
+    CONVERSION_NONE = ""
+    CONVERSION_PENDING = "PENDING"
+    CONVERSION_RUNNING = "RUNNING"
+    CONVERSION_OK = "OK"
+    CONVERSION_ERROR = "ERROR"
+    CONVERSION_CHOICES = [
+        (CONVERSION_NONE, "No aplica"),
+        (CONVERSION_PENDING, "En cola"),
+        (CONVERSION_RUNNING, "Convirtiendo"),
+        (CONVERSION_OK, "PDF listo"),
+        (CONVERSION_ERROR, "Error de conversión"),
+    ]
 
     record = models.ForeignKey(ThesisRecord, on_delete=models.CASCADE, related_name="files")
     file_type = models.CharField(max_length=20, choices=FILE_TYPES)
@@ -254,6 +271,11 @@ class ThesisFile(models.Model):
     size_bytes = models.BigIntegerField(default=0)
     sha256 = models.CharField(max_length=64, blank=True)
     file = models.FileField(upload_to=thesis_file_upload_to)
+    # PDF derivado (solo tesis DOCX), convertido por saf_worker (trabajo CONVERT) al subir el archivo.
+    converted_pdf = models.FileField(upload_to=thesis_file_converted_upload_to, blank=True)
+    conversion_status = models.CharField(max_length=20, choices=CONVERSION_CHOICES, blank=True, default=CONVERSION_NONE)
+    conversion_detail = models.TextField(blank=True)
+    converted_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -263,6 +285,19 @@ class ThesisFile(models.Model):
     def __str__(self):
         return f"{self.record.nro:03d} {self.file_type} {self.original_name}"
 
+    @property
+    def converted_pdf_path(self):
+        """Absolute path of the derived PDF when the conversion finished and the file is on disk."""
+        if self.conversion_status != self.CONVERSION_OK or not self.converted_pdf:
+            return None
+        path = Path(self.converted_pdf.path)
+        return path if path.exists() else None
+
+    def delete_stored_files(self):
+        self.file.delete(save=False)
+        if self.converted_pdf:
+            self.converted_pdf.delete(save=False)
+
     def save(self, *args, **kwargs):
         if self.file and not self.original_name:
             self.original_name = os.path.basename(self.file.name)
@@ -190,6 +190,8 @@ def groups_audit_bulk_view(request, group_id: int):
     )
     comment = comment or default_comment
 
+    from saf.jobs import enqueue_staging
+
     updated = 0
     skipped_not_in_audit = []
     skipped_validation = []
@@ -209,6 +211,7 @@ def groups_audit_bulk_view(request, group_id: int):
                 user=request.user,
                 comment=comment,
             )
+            enqueue_staging(record, request.user)
         else:
             record.mark_observed()
             AuditEvent.objects.create(
@@ -419,12 +422,17 @@ def records_upload_file_view(request, record_id: int):
 
     if file_type in [ThesisFile.TYPE_TESIS_DOCX, ThesisFile.TYPE_TESIS_PDF]:
         for old in record.files.filter(file_type=file_type):
-            old.file.delete(save=False)
+            old.delete_stored_files()
             old.delete()
 
     obj = ThesisFile(record=record, file_type=file_type, original_name=in_file.name, file=in_file)
     obj.save()
     populate_file_metadata(obj)
+    if file_type == ThesisFile.TYPE_TESIS_DOCX:
+        # Convert now (saf_worker, CONVERT job) so generation only has to copy the PDF.
+        from saf.jobs import enqueue_conversion
+
+        enqueue_conversion(obj, request.user)
     messages.success(request, f"Archivo {in_file.name} cargado.")
     return redirect("registry:records_detail", record_id=record.id)
 
@@ -439,7 +447,7 @@ def records_delete_file_view(request, record_id: int, file_id: int):
 
     file_obj = get_object_or_404(ThesisFile, pk=file_id, record=record)
     file_name = file_obj.original_name
-    file_obj.file.delete(save=False)
+    file_obj.delete_stored_files()
     file_obj.delete()
     messages.success(request, f"Archivo eliminado: {file_name}")
     return redirect("registry:records_detail", record_id=record.id)
@@ -504,6 +512,10 @@ def records_approve_view(request, record_id: int):
         user=request.user,
         comment=comment or "Aprobado para lote SAF.",
     )
+    # The approved content is frozen: the SAF worker can build its item before the group is generated.
+    from saf.jobs import enqueue_staging
+
+    enqueue_staging(record, request.user)
     if record.group_id:
         record.group.recompute_status(save=True)
     messages.success(request, "Registro aprobado.")
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from saf.models import SafBatch, SafBatchItem
+from saf.models import SafBatch, SafBatchItem, SafJob
 
 
 class SafBatchItemInline(admin.TabularInline):
@@ -21,4 +21,11 @@ class SafBatchItemAdmin(admin.ModelAdmin):
     list_display = ("batch", "record", "result", "item_folder_name")
     list_filter = ("result",)
 
+
+@admin.register(SafJob)
+class SafJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "batch", "thesis_file", "status", "attempts", "worker_id", "heartbeat_at", "created_at")
+    list_filter = ("kind", "status")
+    readonly_fields = ("worker_id", "lease_expires_at", "heartbeat_at", "started_at", "finished_at")
+
 # Register your models here.
@@ -0,0 +1,577 @@
+"""
+Archive engine for SAF packages.
+
+Members are the same ``(arcname, source)`` pairs used by ``saf.writers``. Each member gets
+its own compression method: formats that are already compressed (PDF, images, office
+files) are stored, text (XML, CSV, scripts, ``contents``) is deflated, and anything else
+is decided from the entropy of a small sample. Large deflated members are compressed in a
+process pool when one is given; the ZIP itself is written by ``ZipArchiveWriter`` (Zip64
+aware) from the already computed CRC/sizes, so the writer lock is only held for copying.
+
+``TarArchiveWriter`` produces ``.tar`` or ``.tar.gz``; the gzip variant is compressed in
+parallel chunks (a multi-member gzip stream, readable by any gzip/tar tool).
+
+Like ``saf.conversion`` this module does not import Django.
+"""
+import gzip
+import io
+import math
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+from saf.writers import SafMember
+
+ARCHIVE_FORMATS = {"zip": ".zip", "tar": ".tar", "tar.gz": ".tar.gz"}
+COMPRESSION_POLICIES = ("auto", "deflate", "store")
+
+STORE_EXTENSIONS = {
+    ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods",
+}
+DEFLATE_EXTENSIONS = {".xml", ".txt", ".csv", ".bat", ".ps1", ".json", ".map", ".html", ".log", ""}
+ENTROPY_SAMPLE_BYTES = 64 * 1024
+# Bits per byte above which deflate gains too little to be worth the CPU.
+ENTROPY_STORE_THRESHOLD = 7.5
+PARALLEL_MIN_BYTES = 1024 * 1024
+COPY_BUFFER = 1024 * 1024
+GZIP_CHUNK_BYTES = 16 * 1024 * 1024
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+
+def archive_suffix(fmt: str) -> str:
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Formato de archivo no soportado: {fmt}")
+    return ARCHIVE_FORMATS[fmt]
+
+
+def sample_entropy(data: bytes) -> float:
+    """Shannon entropy in bits per byte (0..8)."""
+    if not data:
+        return 0.0
+    counts = [0] * 256
+    for b in data:
+        counts[b] += 1
+    total = len(data)
+    return -sum(c / total * math.log2(c / total) for c in counts if c)
+
+
+def _read_sample(source: Union[Path, bytes]) -> bytes:
+    if isinstance(source, bytes):
+        return source[:ENTROPY_SAMPLE_BYTES]
+    with open(source, "rb") as f:
+        return f.read(ENTROPY_SAMPLE_BYTES)
+
+
+def choose_method(arcname: str, source: Union[Path, bytes], policy: str = "auto") -> int:
+    if policy == "store":
+        return ZIP_STORED
+    if policy == "deflate":
+        return ZIP_DEFLATED
+    ext = os.path.splitext(arcname.rsplit("/", 1)[-1])[1].lower()
+    if ext in STORE_EXTENSIONS:
+        return ZIP_STORED
+    if ext in DEFLATE_EXTENSIONS:
+        return ZIP_DEFLATED
+    if sample_entropy(_read_sample(source)) >= ENTROPY_STORE_THRESHOLD:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def _crc_file(path: Path) -> Tuple[int, int]:
+    crc = 0
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_BUFFER)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    return crc, size
+
+
+def _deflate_file(src: str, spool_dir: str, level: int) -> Tuple[int, int, int, str]:
+    """Raw-deflate ``src`` into a spool file. Module level so it can run in a process pool."""
+    comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    fd, spool = tempfile.mkstemp(dir=spool_dir, suffix=".deflate")
+    with os.fdopen(fd, "wb") as out, open(src, "rb") as f:
+        while True:
+            chunk = f.read(COPY_BUFFER)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            out.write(comp.compress(chunk))
+        out.write(comp.flush())
+        csize = out.tell()
+    return crc, size, csize, spool
+
+
+def _deflate_bytes(data: bytes, level: int) -> bytes:
+    comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return comp.compress(data) + comp.flush()
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    year = max(1980, t.tm_year)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+@dataclass
+class PreparedMember:
+    """A member with CRC and sizes already known; exactly one of the payload fields is set."""
+
+    arcname: str
+    method: int
+    crc: int
+    size: int
+    csize: int
+    mtime: float
+    mode: int = 0o644
+    data: Optional[bytes] = None
+    source: Optional[Path] = None
+    spool: Optional[Path] = None
+    raw: Optional[Tuple[Path, int]] = None  # (archive, offset of the compressed data)
+
+    def iter_payload(self):
+        if self.data is not None:
+            yield self.data
+            return
+        if self.raw is not None:
+            path, offset = self.raw
+            remaining = self.csize
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while remaining:
+                    chunk = f.read(min(COPY_BUFFER, remaining))
+                    if not chunk:
+                        raise IOError(f"Archivo truncado: {path}")
+                    remaining -= len(chunk)
+                    yield chunk
+            return
+        with open(self.spool or self.source, "rb") as f:
+            while True:
+                chunk = f.read(COPY_BUFFER)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def _copy_range(src, dst, length: int):
+    while length > 0:
+        chunk = src.read(min(COPY_BUFFER, length))
+        if not chunk:
+            raise EOFError("Archivo truncado al copiar sus miembros.")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+class ZipArchiveWriter:
+    """
+    Writes a ZIP from ``(arcname, source)`` members.
+
+    The archive is written to ``<name>.part`` next to it and moved over ``path`` on close, so
+    ``path`` always holds a complete archive (the previous one until then), even when the
+    process dies mid-write or a download is reading it. With ``update=True`` the entries of
+    the existing archive are kept: its member data is copied to the ``.part`` file, new
+    members are appended after it and a new directory is written on close. Replaced/removed
+    members become dead bytes (``dead_bytes``) until the archive is compacted with
+    ``rewrite_archive_members``.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        policy: str = "auto",
+        level: int = 6,
+        executor: Optional[Executor] = None,
+        update: bool = False,
+    ):
+        if policy not in COMPRESSION_POLICIES:
+            raise ValueError(f"Politica de compresion no soportada: {policy}")
+        self.path = Path(path)
+        self.policy = policy
+        self.level = level
+        self.executor = executor
+        self.dead_bytes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, Tuple[PreparedMember, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if update and self.path.exists():
+            # Raises BadZipFile for a damaged archive; callers rebuild from scratch then.
+            with ZipFile(self.path, "r") as zf:
+                for info in zf.infolist():
+                    member = PreparedMember(
+                        info.filename, info.compress_type, info.CRC, info.file_size, info.compress_size,
+                        time.mktime(info.date_time + (0, 0, -1)), mode=(info.external_attr >> 16) & 0o7777 or 0o644,
+                    )
+                    self._entries[info.filename] = (member, info.header_offset)
+                start_dir = zf.start_dir
+        else:
+            start_dir = 0
+        self._part_path = self.path.with_name(self.path.name + ".part")
+        self._fp = open(self._part_path, "wb")
+        if start_dir:
+            with open(self.path, "rb") as src:
+                _copy_range(src, self._fp, start_dir)
+        self._spool_dir = tempfile.mkdtemp(prefix=".spool_", dir=self.path.parent)
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def _drop(self, name: str):
+        member, _ = self._entries.pop(name)
+        self.dead_bytes += 30 + len(name.encode("utf-8")) + member.csize
+
+    def remove_members(self, predicate) -> int:
+        with self._lock:
+            names = [n for n in self._entries if predicate(n)]
+            for n in names:
+                self._drop(n)
+            return len(names)
+
+    # --- preparation (outside the lock, in the caller thread or the process pool)
+
+    def prepare(self, members: Iterable[SafMember]) -> List[PreparedMember]:
+        prepared: List[PreparedMember] = []
+        pending = []
+        for arcname, source in members:
+            if isinstance(source, bytes):
+                method = choose_method(arcname, source, self.policy)
+                data = _deflate_bytes(source, self.level) if method == ZIP_DEFLATED else source
+                prepared.append(
+                    PreparedMember(arcname, method, zlib.crc32(source), len(source), len(data), time.time(), data=data)
+                )
+                continue
+            source = Path(source)
+            st = source.stat()
+            method = choose_method(arcname, source, self.policy)
+            member = PreparedMember(arcname, method, 0, st.st_size, st.st_size, st.st_mtime, mode=st.st_mode & 0o7777)
+            if method == ZIP_STORED:
+                member.crc, member.size = _crc_file(source)
+                member.csize = member.size
+                member.source = source
+            elif self.executor is not None and st.st_size >= PARALLEL_MIN_BYTES:
+                pending.append((member, self.executor.submit(_deflate_file, str(source), self._spool_dir, self.level)))
+            else:
+                member.crc, member.size, member.csize, spool = _deflate_file(str(source), self._spool_dir, self.level)
+                member.spool = Path(spool)
+            prepared.append(member)
+        for member, fut in pending:
+            member.crc, member.size, member.csize, spool = fut.result()
+            member.spool = Path(spool)
+        return prepared
+
+    # --- raw writing (under the lock)
+
+    def _local_header(self, m: PreparedMember) -> bytes:
+        name = m.arcname.encode("utf-8")
+        flags = 0 if m.arcname.isascii() else 0x800
+        dostime, dosdate = _dos_datetime(m.mtime)
+        extra = b""
+        size, csize, version = m.size, m.csize, 20
+        if m.size >= ZIP64_LIMIT or m.csize >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQQ", 1, 16, m.size, m.csize)
+            size = csize = ZIP64_LIMIT
+            version = 45
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, version, flags, m.method, dostime, dosdate,
+            m.crc, csize, size, len(name), len(extra),
+        ) + name + extra
+
+    def _central_header(self, m: PreparedMember, offset: int) -> bytes:
+        name = m.arcname.encode("utf-8")
+        flags = 0 if m.arcname.isascii() else 0x800
+        dostime, dosdate = _dos_datetime(m.mtime)
+        zip64_fields = []
+        size, csize, header_offset = m.size, m.csize, offset
+        if m.size >= ZIP64_LIMIT:
+            zip64_fields.append(m.size)
+            size = ZIP64_LIMIT
+        if m.csize >= ZIP64_LIMIT:
+            zip64_fields.append(m.csize)
+            csize = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            header_offset = ZIP64_LIMIT
+        extra = b""
+        version = 20
+        if zip64_fields:
+            extra = struct.pack(f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields)
+            version = 45
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, flags, m.method, dostime, dosdate,
+            m.crc, csize, size, len(name), len(extra), 0, 0, 0, (0o100000 | m.mode) << 16, header_offset,
+        ) + name + extra
+
+    def _append(self, m: PreparedMember):
+        offset = self._fp.tell()
+        self._fp.write(self._local_header(m))
+        for chunk in m.iter_payload():
+            self._fp.write(chunk)
+        if m.spool is not None:
+            os.unlink(m.spool)
+            m.spool = None
+        m.data = None
+        if m.arcname in self._entries:
+            self._drop(m.arcname)
+        self._entries[m.arcname] = (m, offset)
+
+    def write_prepared(self, prepared: Iterable[PreparedMember], replace_prefix: str = ""):
+        with self._lock:
+            if replace_prefix:
+                for n in [n for n in self._entries if n.startswith(replace_prefix)]:
+                    self._drop(n)
+            for m in prepared:
+                self._append(m)
+
+    def write_members(self, members: Iterable[SafMember], replace_prefix: str = ""):
+        """Append ``members``; with ``replace_prefix`` existing members under it are dropped first."""
+        self.write_prepared(self.prepare(members), replace_prefix)
+
+    def close(self):
+        with self._lock:
+            if self._fp.closed:
+                return
+            cd_offset = self._fp.tell()
+            for m, offset in self._entries.values():
+                self._fp.write(self._central_header(m, offset))
+            cd_size = self._fp.tell() - cd_offset
+            count = len(self._entries)
+            if count >= ZIP64_COUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+                eocd64_offset = self._fp.tell()
+                self._fp.write(
+                    struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, (3 << 8) | 45, 45, 0, 0, count, count, cd_size, cd_offset)
+                )
+                self._fp.write(struct.pack("<IIQI", 0x07064B50, 0, eocd64_offset, 1))
+            self._fp.write(
+                struct.pack(
+                    "<IHHHHIIH", 0x06054B50, 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+                    min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0,
+                )
+            )
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._fp.close()
+            os.replace(self._part_path, self.path)
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+
+def _gzip_chunk(src: str, offset: int, length: int, level: int) -> bytes:
+    with open(src, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def parallel_gzip(src: Path, dst: Path, level: int = 6, executor: Optional[Executor] = None):
+    """Gzip ``src`` into ``dst`` as independent members compressed in parallel."""
+    size = Path(src).stat().st_size
+    offsets = list(range(0, size, GZIP_CHUNK_BYTES)) or [0]
+    args = [(str(src), off, GZIP_CHUNK_BYTES, level) for off in offsets]
+    with open(dst, "wb") as out:
+        if executor is None or len(offsets) == 1:
+            for a in args:
+                out.write(_gzip_chunk(*a))
+        else:
+            # Bounded window keeps at most a few compressed chunks in memory.
+            window = []
+            for a in args:
+                window.append(executor.submit(_gzip_chunk, *a))
+                if len(window) >= 8:
+                    out.write(window.pop(0).result())
+            for fut in window:
+                out.write(fut.result())
+
+
+class TarArchiveWriter:
+    def __init__(self, path: Path, compress: bool = False, level: int = 6, executor: Optional[Executor] = None):
+        self.path = Path(path)
+        self.compress = compress
+        self.level = level
+        self.executor = executor
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tar_path = self.path.with_name(self.path.name + ".tmp.tar") if compress else self.path
+        self._tar = tarfile.open(self._tar_path, "w", format=tarfile.PAX_FORMAT)
+        self._lock = threading.Lock()
+
+    def write_members(self, members: Iterable[SafMember], replace_prefix: str = ""):
+        # Tar archives are always written from scratch, so there is nothing to replace.
+        with self._lock:
+            for arcname, source in members:
+                if isinstance(source, bytes):
+                    info = tarfile.TarInfo(arcname)
+                    info.size = len(source)
+                    info.mtime = int(time.time())
+                    info.mode = 0o644
+                    self._tar.addfile(info, io.BytesIO(source))
+                else:
+                    info = self._tar.gettarinfo(str(source), arcname)
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    with open(source, "rb") as f:
+                        self._tar.addfile(info, f)
+
+    def write_tarinfo(self, info: tarfile.TarInfo, fileobj=None):
+        with self._lock:
+            self._tar.addfile(info, fileobj)
+
+    def close(self):
+        with self._lock:
+            if self._tar.closed:
+                return
+            self._tar.close()
+            if self.compress:
+                try:
+                    parallel_gzip(self._tar_path, self.path, self.level, self.executor)
+                finally:
+                    os.unlink(self._tar_path)
+
+
+def open_archive(
+    path: Path,
+    fmt: str = "zip",
+    policy: str = "auto",
+    level: int = 6,
+    executor: Optional[Executor] = None,
+    update: bool = False,
+):
+    if fmt == "zip":
+        return ZipArchiveWriter(path, policy=policy, level=level, executor=executor, update=update)
+    if fmt in ("tar", "tar.gz"):
+        return TarArchiveWriter(path, compress=(fmt == "tar.gz"), level=level, executor=executor)
+    raise ValueError(f"Formato de archivo no soportado: {fmt}")
+
+
+def archive_format_of(path: Path) -> str:
+    name = Path(path).name.lower()
+    if name.endswith(".tar.gz"):
+        return "tar.gz"
+    if name.endswith(".tar"):
+        return "tar"
+    return "zip"
+
+
+def archive_member_names(path: Path) -> List[str]:
+    if archive_format_of(path) == "zip":
+        with ZipFile(path, "r") as zf:
+            return zf.namelist()
+    with tarfile.open(path, "r:*") as tf:
+        return tf.getnames()
+
+
+def _zip_data_offset(fp, header_offset: int) -> int:
+    fp.seek(header_offset)
+    header = fp.read(30)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return header_offset + 30 + name_len + extra_len
+
+
+def _raw_member(path: Path, raw_fp, info, arcname: str = "") -> PreparedMember:
+    # Copied as raw compressed bytes: no decompression, no CRC pass.
+    return PreparedMember(
+        arcname or info.filename, info.compress_type, info.CRC, info.file_size, info.compress_size,
+        time.mktime(info.date_time + (0, 0, -1)), mode=(info.external_attr >> 16) & 0o7777 or 0o644,
+        raw=(path, _zip_data_offset(raw_fp, info.header_offset)),
+    )
+
+
+def _rewrite_zip(path: Path, replacements: Dict[str, bytes], tmp_path: Path, policy: str, level: int):
+    writer = ZipArchiveWriter(tmp_path, policy=policy, level=level)
+    try:
+        with ZipFile(path, "r") as src, open(path, "rb") as raw_fp:
+            for info in src.infolist():
+                if info.filename in replacements:
+                    continue
+                writer.write_prepared([_raw_member(path, raw_fp, info)])
+        writer.write_members(replacements.items())
+    finally:
+        writer.close()
+
+
+def zip_member_sizes(path: Path) -> Dict[str, int]:
+    """Bytes each member takes in the ZIP (local header + compressed data), keyed by name."""
+    with ZipFile(path, "r") as zf:
+        return {info.filename: 30 + len(info.filename.encode("utf-8")) + info.compress_size for info in zf.infolist()}
+
+
+def copy_zip_members(
+    src: Path,
+    dst: Path,
+    renames: Iterable[Tuple[str, str]],
+    extra: Iterable[SafMember] = (),
+    policy: str = "auto",
+    level: int = 6,
+):
+    """
+    Write ``dst`` with the ``(name, new_name)`` members of ``src`` copied as raw compressed
+    bytes, followed by ``extra``. Used to cut a package into parts without recompressing.
+    """
+    src, dst = Path(src), Path(dst)
+    tmp_path = dst.with_name(dst.name + ".tmp")
+    writer = ZipArchiveWriter(tmp_path, policy=policy, level=level)
+    try:
+        with ZipFile(src, "r") as zf, open(src, "rb") as raw_fp:
+            for name, new_name in renames:
+                writer.write_prepared([_raw_member(src, raw_fp, zf.getinfo(name), new_name)])
+        writer.write_members(extra)
+        writer.close()
+        os.replace(tmp_path, dst)
+    finally:
+        writer.close()
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _rewrite_tar(path: Path, replacements: Dict[str, bytes], tmp_path: Path, fmt: str, level: int, executor):
+    writer = TarArchiveWriter(tmp_path, compress=(fmt == "tar.gz"), level=level, executor=executor)
+    try:
+        with tarfile.open(path, "r:*") as src:
+            for info in src:
+                if info.name in replacements:
+                    continue
+                writer.write_tarinfo(info, src.extractfile(info) if info.isfile() else None)
+        writer.write_members(replacements.items())
+    finally:
+        writer.close()
+
+
+def rewrite_archive_members(
+    path: Path,
+    replacements: Dict[str, bytes],
+    policy: str = "auto",
+    level: int = 6,
+    executor: Optional[Executor] = None,
+):
+    """Replace/add ``replacements`` in an existing archive, copying everything else as is."""
+    path = Path(path)
+    fmt = archive_format_of(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        if fmt == "zip":
+            _rewrite_zip(path, replacements, tmp_path, policy, level)
+        else:
+            _rewrite_tar(path, replacements, tmp_path, fmt, level, executor)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,278 @@
+"""
+Pool of LibreOffice workers for DOCX -> PDF conversion.
+
+Each worker owns an isolated ``-env:UserInstallation`` profile, so concurrent conversions
+never clash on the shared user profile. In resident mode a worker keeps a headless soffice
+running on its profile; conversion requests started with the same profile are handed to
+that warm instance through LibreOffice's single-instance IPC instead of paying the full
+startup. Workers are restarted (fresh profile) after a crash or a timeout.
+
+``ProcessLimits`` starts soffice at a lower priority (nice, ionice), optionally pinned to
+some CPUs and with an address-space limit, so conversions do not starve the web server. The
+limits are applied by prefixing the command with ``nice``/``ionice``/``taskset``/``prlimit``,
+each of which execs the next, so soffice keeps the pid (and session) of the launched process.
+
+This module does not import Django so ``build_saf.py`` can use it as well.
+"""
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+DEFAULT_TIMEOUT = 180
+RESIDENT_STARTUP_SECONDS = 20
+IONICE_CLASSES = {"": None, "best-effort": ["-c", "2", "-n", "7"], "idle": ["-c", "3"]}
+
+
+@dataclass
+class ProcessLimits:
+    nice: int = 0
+    # "", "best-effort" (lowest level) or "idle".
+    ionice: str = ""
+    cpus: Tuple[int, ...] = ()
+    memory_mb: int = 0
+
+    def __post_init__(self):
+        if self.ionice not in IONICE_CLASSES:
+            raise ValueError(f"Clase ionice no soportada: {self.ionice}")
+
+    def prefix(self, which: Callable[[str], Optional[str]] = shutil.which) -> List[str]:
+        """
+        Wrapper commands that apply the limits and exec soffice (``nice``, ``ionice``,
+        ``taskset``, ``prlimit``). A limit whose tool is missing is skipped; on Windows only
+        the priority class applies (see ``_popen_kwargs``).
+        """
+        if os.name == "nt":
+            return []
+        tools = []
+        if self.nice > 0:
+            tools.append(("nice", ["-n", str(self.nice)]))
+        if IONICE_CLASSES[self.ionice]:
+            tools.append(("ionice", IONICE_CLASSES[self.ionice]))
+        if self.cpus:
+            tools.append(("taskset", ["-c", ",".join(str(c) for c in self.cpus)]))
+        if self.memory_mb > 0:
+            tools.append(("prlimit", [f"--as={self.memory_mb * 1024 * 1024}", "--"]))
+        prefix = []
+        for name, args in tools:
+            path = which(name)
+            if path:
+                prefix += [path, *args]
+        return prefix
+
+    def wrap(self, cmd: List[str]) -> List[str]:
+        return [*self.prefix(), *cmd]
+
+
+def _popen_kwargs(limits: Optional[ProcessLimits] = None) -> dict:
+    # New process group/session so a timeout can kill soffice.bin and not only the launcher.
+    if os.name == "nt":
+        flags = subprocess.CREATE_NEW_PROCESS_GROUP
+        if limits is not None and limits.nice > 0:
+            flags |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        return {"creationflags": flags}
+    # No preexec_fn: it is unsafe with threads (the pool converts from several). POSIX limits are
+    # applied by the wrapper commands of ``ProcessLimits.wrap`` instead.
+    return {"start_new_session": True}
+
+
+def _kill_tree(proc: subprocess.Popen):
+    if proc.poll() is not None:
+        return
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(proc.pid)], capture_output=True, timeout=30)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:  # noqa: BLE001
+        proc.kill()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+class SofficeWorker:
+    def __init__(
+        self,
+        soffice: str,
+        profile_dir: Path,
+        timeout: int = DEFAULT_TIMEOUT,
+        resident: bool = True,
+        limits: Optional[ProcessLimits] = None,
+    ):
+        self.soffice = soffice
+        self.profile_dir = Path(profile_dir)
+        self.timeout = timeout
+        self.resident = resident
+        self.limits = limits
+        self.conversions = 0
+        self.restarts = 0
+        self._proc: Optional[subprocess.Popen] = None
+
+    @property
+    def profile_arg(self) -> str:
+        return f"-env:UserInstallation={self.profile_dir.resolve().as_uri()}"
+
+    def _base_cmd(self) -> List[str]:
+        cmd = [self.soffice, self.profile_arg, "--headless", "--nologo", "--nofirststartwizard", "--norestore"]
+        return self.limits.wrap(cmd) if self.limits else cmd
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        if not self.resident or self.is_alive():
+            return
+        cmd = self._base_cmd() + ["--invisible", "--nodefault", f"--accept=pipe,name=saf_{os.getpid()}_{id(self)};urp;"]
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_popen_kwargs(self.limits))
+        # The first start creates the profile; wait until it exists so the handoff finds the instance.
+        deadline = time.monotonic() + RESIDENT_STARTUP_SECONDS
+        while time.monotonic() < deadline and self.is_alive():
+            if (self.profile_dir / "user").exists():
+                break
+            time.sleep(0.2)
+
+    def stop(self):
+        if self._proc is not None:
+            _kill_tree(self._proc)
+        self._proc = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        # A crashed instance may leave a lock or a corrupt profile behind.
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.start()
+
+    def _run(self, cmd: List[str]) -> Tuple[int, str]:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            **_popen_kwargs(self.limits),
+        )
+        try:
+            out, err = proc.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            _kill_tree(proc)
+            raise
+        return proc.returncode, (err or "").strip() or (out or "").strip()
+
+    def convert(self, docx_path: Path, out_pdf_path: Path) -> Tuple[bool, str]:
+        if self.resident and not self.is_alive():
+            if self._proc is not None:
+                self.restart()
+            else:
+                self.start()
+        out_dir = out_pdf_path.parent
+        out_dir.mkdir(parents=True, exist_ok=True)
+        generated = out_dir / f"{docx_path.stem}.pdf"
+        cmd = self._base_cmd() + ["--convert-to", "pdf", "--outdir", str(out_dir), str(docx_path)]
+        try:
+            code, output = self._run(cmd)
+            if code == 0 and not generated.exists() and self.resident:
+                # Handoff to the resident instance failed: fall back to one-shot runs on this profile.
+                self.stop()
+                self.resident = False
+                code, output = self._run(cmd)
+        except subprocess.TimeoutExpired:
+            self.restart()
+            return False, "Timeout en conversión DOCX->PDF"
+        except Exception as exc:  # noqa: BLE001
+            self.restart()
+            return False, str(exc)
+        if code != 0:
+            if self.resident and not self.is_alive():
+                self.restart()
+            return False, output or "Error de LibreOffice"
+        if not generated.exists():
+            return False, "LibreOffice no generó PDF."
+        if generated != out_pdf_path:
+            if out_pdf_path.exists():
+                out_pdf_path.unlink()
+            generated.rename(out_pdf_path)
+        self.conversions += 1
+        return True, "OK"
+
+
+class ConversionPool:
+    """Dispatches conversions to whichever worker is free; blocks while all are busy."""
+
+    def __init__(
+        self,
+        soffice: str,
+        size: int,
+        profile_root: Path,
+        timeout: int = DEFAULT_TIMEOUT,
+        resident: bool = True,
+        limits: Optional[ProcessLimits] = None,
+    ):
+        self.soffice = soffice
+        self.size = max(1, int(size or 1))
+        self.profile_root = Path(profile_root)
+        self.workers = [
+            SofficeWorker(soffice, self.profile_root / f"worker_{i}", timeout=timeout, resident=resident, limits=limits)
+            for i in range(self.size)
+        ]
+        self._idle: "queue.Queue[SofficeWorker]" = queue.Queue()
+        for w in self.workers:
+            self._idle.put(w)
+        self._version: Optional[str] = None
+        self._probe_ok = ""
+        self._lock = threading.Lock()
+
+    def convert(self, docx_path: Path, out_pdf_path: Path) -> Tuple[bool, str]:
+        worker = self._idle.get()
+        try:
+            return worker.convert(Path(docx_path), Path(out_pdf_path))
+        finally:
+            self._idle.put(worker)
+
+    @property
+    def version(self) -> str:
+        """
+        Converter identity used to key derived PDFs.
+
+        Built from the binary path, size and mtime so it changes on upgrades without
+        paying a LibreOffice startup just to ask ``--version``.
+        """
+        with self._lock:
+            if self._version is None:
+                try:
+                    st = Path(self.soffice).stat()
+                    self._version = f"{Path(self.soffice).resolve()}:{st.st_size}:{int(st.st_mtime)}"
+                except OSError:
+                    self._version = str(self.soffice)
+            return self._version
+
+    def probe(self, timeout: int = 60) -> Tuple[bool, str]:
+        """Run ``soffice --version`` once (preflight); a successful answer is remembered."""
+        with self._lock:
+            if self._probe_ok:
+                return True, self._probe_ok
+        try:
+            proc = subprocess.run([self.soffice, "--version"], capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False, f"soffice no respondió en {timeout} s."
+        except OSError as exc:
+            return False, str(exc)
+        output = (proc.stdout or "").strip() or (proc.stderr or "").strip()
+        if proc.returncode != 0:
+            return False, output or f"soffice terminó con código {proc.returncode}."
+        with self._lock:
+            self._probe_ok = output or "OK"
+        return True, self._probe_ok
+
+    def shutdown(self):
+        for w in self.workers:
+            w.stop()
+
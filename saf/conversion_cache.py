@@ -0,0 +1,138 @@
+"""
+Content-addressed cache of DOCX -> PDF conversions.
+
+Entries are keyed by the source sha256 plus the converter version, so the same DOCX bytes
+are converted once per LibreOffice version no matter how many batches include them.
+Eviction is size based LRU: hits refresh the entry mtime and the oldest entries go first.
+The cache size is measured once and then tracked per insert, so the cache folder is only
+scanned again when the estimate goes over the limit. An entry may be evicted at any time by
+another conversion: readers take their own link to it with ``fetch``.
+
+Like ``saf.conversion`` this module does not import Django.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+CACHE_SUFFIX = ".pdf"
+
+
+class ConversionCache:
+    def __init__(self, root: Path, max_bytes: int = 0):
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_bytes or 0))
+        self._lock = threading.Lock()
+        # Bytes in the cache as far as this process knows (None: not measured yet).
+        self._bytes: Optional[int] = None
+
+    @staticmethod
+    def make_key(source_sha256: str, converter_version: str) -> str:
+        version_tag = hashlib.sha256((converter_version or "").encode("utf-8")).hexdigest()[:12]
+        return f"{source_sha256.lower()}-{version_tag}"
+
+    def path_for(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}{CACHE_SUFFIX}"
+
+    def get(self, source_sha256: str, converter_version: str) -> Optional[Path]:
+        path = self.path_for(self.make_key(source_sha256, converter_version))
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def fetch(self, source_sha256: str, converter_version: str, dst: Path) -> bool:
+        """Hardlink (or copy) the cached PDF to ``dst``; False on a miss or when it was just evicted."""
+        path = self.get(source_sha256, converter_version)
+        if path is None:
+            return False
+        dst = Path(dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if dst.exists():
+                dst.unlink()
+            try:
+                os.link(path, dst)
+            except OSError:
+                shutil.copyfile(path, dst)
+        except OSError:
+            return False
+        return True
+
+    def put(self, source_sha256: str, converter_version: str, pdf_path: Path) -> Path:
+        path = self.path_for(self.make_key(source_sha256, converter_version))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(pdf_path, tmp_name)
+            os.replace(tmp_name, path)
+        finally:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+        if self.max_bytes:
+            with self._lock:
+                if self._bytes is None:
+                    self._bytes = sum(size for _, size, _ in self.entries())
+                else:
+                    self._bytes += path.stat().st_size - replaced
+                over = self._bytes > self.max_bytes
+            if over:
+                self.prune(self.max_bytes, keep=path)
+        return path
+
+    def entries(self) -> List[Tuple[Path, int, float]]:
+        out = []
+        if not self.root.exists():
+            return out
+        for p in self.root.glob(f"*/*{CACHE_SUFFIX}"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            out.append((p, st.st_size, st.st_mtime))
+        return out
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return {
+            "root": str(self.root),
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "oldest": min((m for _, _, m in entries), default=None),
+            "newest": max((m for _, _, m in entries), default=None),
+        }
+
+    def prune(self, max_bytes: Optional[int] = None, keep: Optional[Path] = None) -> Tuple[int, int]:
+        """Evict least recently used entries until the cache fits ``max_bytes``. Returns (removed, freed)."""
+        limit = self.max_bytes if max_bytes is None else max(0, int(max_bytes))
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            removed = freed = 0
+            for path, size, _ in entries:
+                if total <= limit:
+                    break
+                if keep is not None and path == keep:
+                    continue
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+                freed += size
+            self._bytes = total
+            return removed, freed
+
+    def clear(self) -> Tuple[int, int]:
+        return self.prune(0)
@@ -0,0 +1,434 @@
+"""
+Metadata crosswalk for SAF items (DSpace ``dublin_core.xml`` / ``metadata_<schema>.xml``).
+
+``CROSSWALK`` declares every field once, in output order, with where its value comes from:
+
+- ``const``: fixed value (publisher, rights, types...).
+- ``param``: value fixed for a whole run (e.g. ``year``).
+- ``career``: value of the career configuration (``CareerConfig`` / ``career_map.csv``).
+- ``record`` / ``integer`` / ``subjects``: value of the record, optionally normalized as an
+  integer (DNI) or split into subjects.
+
+``compile_crosswalk`` turns it into a ``Crosswalk`` once per run: fixed fields are rendered
+to XML lines up front, career blocks are rendered the first time a career is seen and then
+reused, and only the record fields are rendered per item. Rendered items can be kept in a
+``RenderCache`` keyed by the caller (the web app uses the record ``updated_at``).
+
+Sources are plain mappings, so this module serves both the web app and ``build_saf.py``;
+like ``saf.archive`` it does not import Django.
+"""
+import re
+import threading
+import unicodedata
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import IO, Dict, Hashable, List, Mapping, Optional, Tuple
+
+MetadataEntry = Tuple[str, str, str, str, str]
+
+DEFAULT_METADATA_LANGUAGE = "es"
+LANGUAGE_EXCLUDED_QUALIFIERS = {"dni", "uri", "date"}
+FORCED_LANGUAGE_FIELDS = {
+    ("dc", "rights", "uri"),
+    ("renati", "advisor", "orcid"),
+    ("renati", "type", ""),
+    ("renati", "level", ""),
+    ("dc", "subject", "ocde"),
+}
+URI_VALUE_PREFIXES = ("http://", "https://", "hdl:")
+RENDER_CACHE_SIZE = 4096
+
+
+def _fold_table() -> Dict[int, str]:
+    # Accented Latin letters -> base letter; anything outside the table takes the NFD path.
+    table = {}
+    for code in range(0xC0, 0x250):
+        folded = "".join(c for c in unicodedata.normalize("NFD", chr(code)) if unicodedata.category(c) != "Mn")
+        if folded != chr(code):
+            table[code] = folded
+    return table
+
+
+FOLD_TABLE = _fold_table()
+XML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&apos;"})
+
+
+@lru_cache(maxsize=16384)
+def norm_text(s: str) -> str:
+    s = (s or "").strip().upper().translate(FOLD_TABLE)
+    if not s.isascii():
+        s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    return " ".join(s.split())
+
+
+def escape_xml(s: str) -> str:
+    return s.translate(XML_ESCAPE_TABLE)
+
+
+def infer_metadata_language(schema: str, element: str, qualifier: str, value: str) -> str:
+    schema_norm = (schema or "").strip().lower()
+    qualifier_norm = (qualifier or "").strip().lower()
+    element_norm = (element or "").strip().lower()
+    value_norm = (value or "").strip().lower()
+    if not value_norm:
+        return ""
+    if (schema_norm, element_norm, qualifier_norm) in FORCED_LANGUAGE_FIELDS:
+        return DEFAULT_METADATA_LANGUAGE
+    if element_norm == "date":
+        return ""
+    if qualifier_norm in LANGUAGE_EXCLUDED_QUALIFIERS:
+        return ""
+    if value_norm.startswith(URI_VALUE_PREFIXES):
+        return ""
+    return DEFAULT_METADATA_LANGUAGE
+
+
+def make_metadata_entry(
+    schema: str,
+    element: str,
+    qualifier: str,
+    value: str,
+    language: Optional[str] = None,
+) -> MetadataEntry:
+    val = ("" if value is None else str(value)).strip()
+    lang = infer_metadata_language(schema, element, qualifier, val) if language is None else (language or "").strip()
+    return (schema, element, qualifier, lang, val)
+
+
+def normalize_integer_like(value: str) -> str:
+    text = ("" if value is None else str(value)).strip()
+    if re.fullmatch(r"\d+\.0+", text):
+        return text.split(".", 1)[0]
+    return text
+
+
+def split_subjects(text: str) -> List[str]:
+    raw = (text or "").strip()
+    if not raw:
+        return []
+    if ";" in raw or "|" in raw or "\n" in raw:
+        parts = re.split(r"[;\|\n]+", raw)
+    elif "," in raw:
+        parts = raw.split(",")
+    else:
+        parts = [raw]
+    out: List[str] = []
+    seen = set()
+    for p in parts:
+        term = p.strip(" \t\r\n,;.")
+        if not term:
+            continue
+        key = norm_text(term)
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(term)
+    return out
+
+
+def render_dcvalue(entry: MetadataEntry) -> Optional[str]:
+    _, element, qualifier, language, value = entry
+    value = (value or "").strip()
+    if not value:
+        return None
+    q_attr = f' qualifier="{qualifier}"' if qualifier else ""
+    l_attr = f' language="{language}"' if language else ""
+    return f'  <dcvalue element="{element}"{q_attr}{l_attr}>{escape_xml(value)}</dcvalue>'
+
+
+def _schema_document(schema: str, lines: List[str]) -> str:
+    root = "<dublin_core>" if schema == "dc" else f'<dublin_core schema="{schema}">'
+    return "\n".join(['<?xml version="1.0" encoding="UTF-8"?>', root, *lines, "</dublin_core>"])
+
+
+def metadata_filename(schema: str) -> str:
+    return "dublin_core.xml" if schema == "dc" else f"metadata_{schema}.xml"
+
+
+def render_metadata_files(metadata: List[MetadataEntry]) -> Dict[str, str]:
+    """``{filename: xml}`` for every schema present in ``metadata`` (dc always)."""
+    lines: Dict[str, List[str]] = {"dc": []}
+    for entry in metadata:
+        bucket = lines.setdefault(entry[0], [])
+        line = render_dcvalue(entry)
+        if line is not None:
+            bucket.append(line)
+    return {
+        metadata_filename(schema): _schema_document(schema, schema_lines)
+        for schema, schema_lines in sorted(lines.items(), key=lambda kv: (kv[0] != "dc", kv[0]))
+    }
+
+
+@dataclass(frozen=True)
+class FieldSpec:
+    schema: str
+    element: str
+    qualifier: str
+    kind: str
+    source: str
+    required: bool = False
+
+    @property
+    def level(self) -> str:
+        return {"const": "static", "param": "static", "career": "career"}.get(self.kind, "record")
+
+
+CROSSWALK: Tuple[FieldSpec, ...] = (
+    FieldSpec("dc", "title", "", "record", "title", required=True),
+    FieldSpec("dc", "date", "issued", "param", "year", required=True),
+    FieldSpec("dc", "language", "iso", "const", "spa"),
+    FieldSpec("dc", "format", "", "const", "application/pdf"),
+    FieldSpec("dc", "type", "", "const", "info:eu-repo/semantics/bachelorThesis"),
+    FieldSpec("dc", "rights", "", "const", "info:eu-repo/semantics/openAccess"),
+    FieldSpec("dc", "contributor", "author", "record", "author1"),
+    FieldSpec("renati", "author", "dni", "integer", "author1_dni"),
+    FieldSpec("dc", "contributor", "author", "record", "author2"),
+    FieldSpec("renati", "author", "dni", "integer", "author2_dni"),
+    FieldSpec("dc", "contributor", "author", "record", "author3"),
+    FieldSpec("renati", "author", "dni", "integer", "author3_dni"),
+    FieldSpec("dc", "contributor", "advisor", "record", "advisor"),
+    FieldSpec("renati", "advisor", "dni", "integer", "advisor_dni"),
+    FieldSpec("renati", "advisor", "orcid", "record", "advisor_orcid"),
+    FieldSpec("renati", "juror", "", "record", "juror1"),
+    FieldSpec("renati", "juror", "", "record", "juror2"),
+    FieldSpec("renati", "juror", "", "record", "juror3"),
+    FieldSpec("dc", "description", "abstract", "record", "abstract"),
+    FieldSpec("dc", "subject", "", "subjects", "keywords"),
+    FieldSpec("renati", "type", "", "const", "https://purl.org/pe-repo/renati/type#tesis"),
+    FieldSpec("dc", "type", "version", "const", "info:eu-repo/semantics/publishedVersion"),
+    FieldSpec("dc", "publisher", "", "const", "Universidad Autónoma de Ica"),
+    FieldSpec("dc", "publisher", "country", "const", "PE"),
+    FieldSpec("dc", "rights", "uri", "const", "https://creativecommons.org/licenses/by/4.0"),
+    FieldSpec("thesis", "degree", "name", "career", "thesis_degree_name"),
+    FieldSpec("thesis", "degree", "discipline", "career", "thesis_degree_discipline"),
+    FieldSpec("thesis", "degree", "grantor", "career", "thesis_degree_grantor"),
+    FieldSpec("renati", "level", "", "career", "renati_level"),
+    FieldSpec("renati", "discipline", "", "career", "renati_discipline"),
+    FieldSpec("dc", "subject", "ocde", "career", "ocde_url"),
+)
+CAREER_FIELDS = tuple(spec.source for spec in CROSSWALK if spec.kind == "career")
+
+
+@dataclass
+class _Block:
+    """Consecutive fields of one level; ``lines`` holds the rendered XML lines per schema."""
+
+    level: str
+    specs: List[FieldSpec] = field(default_factory=list)
+    entries: List[MetadataEntry] = field(default_factory=list)
+    lines: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def _raw_values(spec: FieldSpec, values: Mapping[str, object], params: Mapping[str, str]) -> List[object]:
+    if spec.kind == "const":
+        return [spec.source]
+    if spec.kind == "param":
+        return [params.get(spec.source, "")]
+    if spec.kind == "subjects":
+        return split_subjects(str(values.get(spec.source) or ""))
+    if spec.kind == "integer":
+        return [normalize_integer_like(values.get(spec.source) or "")]
+    return [values.get(spec.source) or ""]
+
+
+@lru_cache(maxsize=None)
+def _field_plan(spec: FieldSpec) -> Tuple[Optional[str], str]:
+    """Language when it does not depend on the value (``None`` otherwise) and the opening tag."""
+    if (spec.schema, spec.element, spec.qualifier) in FORCED_LANGUAGE_FIELDS:
+        language = DEFAULT_METADATA_LANGUAGE
+    elif spec.element == "date" or spec.qualifier in LANGUAGE_EXCLUDED_QUALIFIERS:
+        language = ""
+    else:
+        language = None
+    q_attr = f' qualifier="{spec.qualifier}"' if spec.qualifier else ""
+    return language, f'  <dcvalue element="{spec.element}"{q_attr}'
+
+
+def _render_block(level: str, specs: List[FieldSpec], values: Mapping[str, object], params: Mapping[str, str]) -> _Block:
+    # Same entries and lines as make_metadata_entry + render_dcvalue, without re-deriving per value.
+    block = _Block(level, specs)
+    for spec in specs:
+        language, head = _field_plan(spec)
+        for raw in _raw_values(spec, values, params):
+            value = ("" if raw is None else str(raw)).strip()
+            if not value:
+                if spec.required:
+                    block.entries.append((spec.schema, spec.element, spec.qualifier, "", ""))
+                    block.lines.setdefault(spec.schema, [])
+                continue
+            lang = language
+            if lang is None:
+                lang = "" if value.lower().startswith(URI_VALUE_PREFIXES) else DEFAULT_METADATA_LANGUAGE
+            block.entries.append((spec.schema, spec.element, spec.qualifier, lang, value))
+            l_attr = f' language="{lang}"' if lang else ""
+            block.lines.setdefault(spec.schema, []).append(f"{head}{l_attr}>{escape_xml(value)}</dcvalue>")
+    return block
+
+
+@dataclass
+class RenderedMetadata:
+    entries: List[MetadataEntry]
+    files: Dict[str, bytes]
+
+
+class RenderCache:
+    """Bounded LRU of rendered items, shared by threads."""
+
+    def __init__(self, size: int = RENDER_CACHE_SIZE):
+        self.size = size
+        self._items: "OrderedDict[Hashable, RenderedMetadata]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[RenderedMetadata]:
+        with self._lock:
+            found = self._items.get(key)
+            if found is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return found
+
+    def put(self, key: Hashable, value: RenderedMetadata):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+class Crosswalk:
+    def __init__(self, specs: Tuple[FieldSpec, ...], params: Mapping[str, str], cache: Optional[RenderCache] = None):
+        self.params = dict(params)
+        self.cache = cache
+        self._blocks: List[_Block] = []
+        for spec in specs:
+            if not self._blocks or self._blocks[-1].level != spec.level:
+                self._blocks.append(_Block(spec.level))
+            self._blocks[-1].specs.append(spec)
+        # Fixed fields are rendered once for the whole run.
+        self._blocks = [
+            _render_block(b.level, b.specs, {}, self.params) if b.level == "static" else b for b in self._blocks
+        ]
+        self._careers: Dict[Hashable, List[_Block]] = {}
+        self._lock = threading.Lock()
+        self.signature = hash((tuple(specs), tuple(sorted(self.params.items()))))
+
+    def _career_blocks(self, career_key: Hashable, career: Optional[Mapping[str, object]]) -> List[_Block]:
+        with self._lock:
+            blocks = self._careers.get(career_key)
+            if blocks is None:
+                values = career or {}
+                blocks = [
+                    _render_block(b.level, b.specs, values, self.params) if career is not None else _Block(b.level)
+                    for b in self._blocks
+                    if b.level == "career"
+                ]
+                self._careers[career_key] = blocks
+            return blocks
+
+    def render(
+        self,
+        values: Mapping[str, object],
+        career: Optional[Mapping[str, object]] = None,
+        career_key: Hashable = None,
+        cache_key: Hashable = None,
+    ) -> RenderedMetadata:
+        """
+        Entries and XML files of one item. ``career_key`` identifies the career config (its
+        block is rendered once); ``cache_key`` (if given) must change whenever ``values`` do.
+        """
+        if career is not None and career_key is None:
+            career_key = tuple(str(career.get(name) or "") for name in CAREER_FIELDS)
+        full_key = (self.signature, career_key, cache_key)
+        if self.cache is not None and cache_key is not None:
+            found = self.cache.get(full_key)
+            if found is not None:
+                return found
+
+        career_blocks = iter(self._career_blocks(career_key, career))
+        blocks: List[_Block] = []
+        for b in self._blocks:
+            if b.level == "static":
+                blocks.append(b)
+            elif b.level == "career":
+                blocks.append(next(career_blocks))
+            else:
+                blocks.append(_render_block(b.level, b.specs, values, self.params))
+
+        entries: List[MetadataEntry] = []
+        lines: Dict[str, List[str]] = {"dc": []}
+        for b in blocks:
+            entries.extend(b.entries)
+            for schema in {e[0] for e in b.entries}:
+                lines.setdefault(schema, []).extend(b.lines.get(schema, []))
+        files = {
+            metadata_filename(schema): _schema_document(schema, schema_lines).encode("utf-8")
+            for schema, schema_lines in sorted(lines.items(), key=lambda kv: (kv[0] != "dc", kv[0]))
+        }
+        rendered = RenderedMetadata(entries, files)
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(full_key, rendered)
+        return rendered
+
+
+def compile_crosswalk(
+    params: Mapping[str, str],
+    specs: Tuple[FieldSpec, ...] = CROSSWALK,
+    cache: Optional[RenderCache] = None,
+) -> Crosswalk:
+    return Crosswalk(specs, params, cache)
+
+
+def parse_metadata_xml(fileobj: IO[bytes]) -> List[MetadataEntry]:
+    """
+    Entries of a ``dublin_core.xml`` / ``metadata_<schema>.xml`` document (the inverse of
+    ``render_metadata_files``). The document is streamed; each ``dcvalue`` is dropped once read.
+    """
+    entries: List[MetadataEntry] = []
+    schema = "dc"
+    for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "dublin_core":
+                schema = elem.get("schema") or "dc"
+            continue
+        if elem.tag == "dcvalue":
+            entries.append(
+                (
+                    schema,
+                    elem.get("element", ""),
+                    elem.get("qualifier", "") or "",
+                    elem.get("language", "") or "",
+                    (elem.text or "").strip(),
+                )
+            )
+            elem.clear()
+    return entries
+
+
+def crosswalk_values_from_entries(
+    entries: List[MetadataEntry], specs: Tuple[FieldSpec, ...] = CROSSWALK
+) -> Dict[str, str]:
+    """
+    Record-level values (``title``, ``author1``...) back from rendered entries. Repeated fields
+    (authors, jurors) are assigned in output order; subjects are joined with ``; ``.
+    """
+    queues: Dict[Tuple[str, str, str], List[str]] = {}
+    for schema, element, qualifier, _, value in entries:
+        if value:
+            queues.setdefault((schema, element, qualifier), []).append(value)
+    values: Dict[str, str] = {}
+    for spec in specs:
+        if spec.level != "record":
+            continue
+        queue = queues.get((spec.schema, spec.element, spec.qualifier), [])
+        if spec.kind == "subjects":
+            values[spec.source] = "; ".join(queue)
+            queue.clear()
+        else:
+            values[spec.source] = queue.pop(0) if queue else ""
+    return values
@@ -0,0 +1,203 @@
+"""
+Time estimates and live ETA for SAF generation, learned from past batches.
+
+``learn_throughput`` reads the stage timings (``saf.timing``) of the last
+``SAF_ESTIMATE_HISTORY`` generated batches and derives:
+
+- seconds per item for planning and XML (``db`` + ``xml``),
+- seconds per DOCX converted (``convert``),
+- ZIP MB/s (``zip``) and seconds per MB copied to the staging tree (``copy``),
+- seconds per package MB for the finishing stages (report, scripts, compaction,
+  validation, manifest, parts).
+
+Rates with no history yet use conservative defaults. The preflight applies them to the
+records of a group (estimated time next to the estimated size). During generation
+``EtaTracker`` scales the remaining predicted cost by how fast the finished items actually
+went, so a DOCX-heavy group shows a moving ETA instead of a frozen counter.
+"""
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from saf.models import SafBatch
+from saf.timing import StageTimer
+
+MB = 1048576
+FINISH_STAGES = ("cleanup", "report", "scripts", "close", "validation", "manifest", "parts")
+
+
+@dataclass
+class Throughput:
+    item_seconds: float = 0.05
+    docx_seconds: float = 20.0
+    zip_mb_s: float = 40.0
+    copy_s_per_mb: float = 0.01
+    finish_s_per_mb: float = 0.05
+    # Batches the rates were learned from (0 = defaults only).
+    batches: int = 0
+
+    def item_cost(self, package_bytes: int, docx: bool, staging: bool) -> float:
+        """Work seconds of one item (summed over stages, before dividing by the workers)."""
+        mb = package_bytes / MB
+        cost = self.item_seconds + mb / self.zip_mb_s
+        if staging:
+            cost += mb * self.copy_s_per_mb
+        if docx:
+            cost += self.docx_seconds
+        return cost
+
+    def as_dict(self) -> dict:
+        return {key: round(value, 4) if isinstance(value, float) else value for key, value in asdict(self).items()}
+
+
+def learn_throughput(limit: Optional[int] = None) -> Throughput:
+    limit = max(1, int(limit or getattr(settings, "SAF_ESTIMATE_HISTORY", 20) or 1))
+    items = StageTimer()
+    finish = 0.0
+    finish_mb = 0.0
+    learned = Throughput()
+    rows = (
+        SafBatch.objects.filter(generated_at__isnull=False)
+        .order_by("-generated_at", "-id")
+        .values_list("timings", flat=True)[:limit]
+    )
+    for timings in rows:
+        if not timings or not timings.get("items"):
+            continue
+        learned.batches += 1
+        items.merge(timings["items"])
+        stages = timings.get("stages") or {}
+        finish += sum((stages.get(stage) or {}).get("s", 0.0) for stage in FINISH_STAGES)
+        finish_mb += (timings["items"].get("zip") or {}).get("bytes", 0) / MB
+
+    def stage(name: str) -> Dict[str, float]:
+        return items.stages.get(name) or {"s": 0.0, "bytes": 0, "n": 0}
+
+    # A rate is only replaced when its stage actually ran in the history.
+    planned = stage("db")["n"]
+    if planned:
+        learned.item_seconds = (stage("db")["s"] + stage("xml")["s"]) / planned
+    if stage("convert")["n"]:
+        learned.docx_seconds = stage("convert")["s"] / stage("convert")["n"]
+    if stage("zip")["bytes"] and stage("zip")["s"]:
+        learned.zip_mb_s = stage("zip")["bytes"] / MB / stage("zip")["s"]
+    if stage("copy")["bytes"]:
+        learned.copy_s_per_mb = stage("copy")["s"] / (stage("copy")["bytes"] / MB)
+    if finish_mb:
+        learned.finish_s_per_mb = finish / finish_mb
+    return learned
+
+
+def parallel_seconds(work: float, docx_work: float, workers: int) -> float:
+    """Wall time of ``work`` seconds on the item pool; conversions are also bounded by the soffice pool."""
+    workers = max(1, workers)
+    conversions = max(1, min(workers, int(getattr(settings, "SAF_CONVERSION_WORKERS", 1) or 1)))
+    if getattr(settings, "SAF_MAX_CONVERSIONS", 0):
+        conversions = min(conversions, int(settings.SAF_MAX_CONVERSIONS))
+    return (work - docx_work) / workers + docx_work / conversions
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 90:
+        return f"{seconds:.0f} s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+@dataclass
+class GenerationEstimate:
+    seconds: float
+    items_seconds: float
+    finish_seconds: float
+    bytes: int
+    docx: int
+    throughput: Throughput
+    # record_id -> predicted wall seconds of its item (input of EtaTracker).
+    costs: Dict[int, float]
+
+    def as_dict(self) -> dict:
+        return {
+            "seconds": round(self.seconds, 1),
+            "items_seconds": round(self.items_seconds, 1),
+            "finish_seconds": round(self.finish_seconds, 1),
+            "bytes": self.bytes,
+            "docx": self.docx,
+            "throughput": self.throughput.as_dict(),
+        }
+
+
+def estimate_generation(
+    packages: Dict[int, Tuple[int, bool]],
+    output_bytes: int,
+    workers: Optional[int] = None,
+    throughput: Optional[Throughput] = None,
+) -> GenerationEstimate:
+    """
+    Estimate for ``record_id -> (package bytes, needs DOCX conversion)``. ``output_bytes`` is
+    the preflight size estimate (archive, staging and conversions).
+    """
+    throughput = throughput or learn_throughput()
+    if workers is None:
+        workers = getattr(settings, "SAF_GENERATION_WORKERS", 1)
+    workers = max(1, int(workers or 1))
+    # Hardlinked staging (auto) costs nothing per MB; clone/copy does.
+    staging = getattr(settings, "SAF_KEEP_STAGING", False) and getattr(settings, "SAF_STAGING_LINK_MODE", "auto") != "auto"
+    work = {rid: throughput.item_cost(size, docx, staging) for rid, (size, docx) in packages.items()}
+    total_work = sum(work.values())
+    docx = sum(1 for _, needs in packages.values() if needs)
+    items_seconds = parallel_seconds(total_work, docx * throughput.docx_seconds, workers)
+    scale = items_seconds / total_work if total_work else 0.0
+    package_mb = sum(size for size, _ in packages.values()) / MB
+    finish_seconds = package_mb * throughput.finish_s_per_mb
+    return GenerationEstimate(
+        seconds=items_seconds + finish_seconds,
+        items_seconds=items_seconds,
+        finish_seconds=finish_seconds,
+        bytes=output_bytes,
+        docx=docx,
+        throughput=throughput,
+        costs={rid: cost * scale for rid, cost in work.items()},
+    )
+
+
+class EtaTracker:
+    """
+    Live ETA from per-record predicted costs (``record_id -> seconds``) and the finishing time.
+
+    The ratio between the elapsed time and the predicted cost of the finished items corrects
+    the remaining prediction, so both a slow machine and a wrong history converge quickly.
+    """
+
+    def __init__(self, costs: Dict[int, float], finish_seconds: float = 0.0, reused_cost: float = 0.0):
+        self.costs = costs
+        self.total = sum(costs.values())
+        self.finish_seconds = finish_seconds
+        self.reused_cost = reused_cost
+        self.done_cost = 0.0
+        self.started = time.monotonic()
+        self.items_finished: Optional[float] = None
+
+    def item_done(self, record_id: int, reused: bool = False):
+        cost = self.costs.pop(record_id, 0.0)
+        if reused:
+            # Reused items skip the expensive stages: take them out of the prediction.
+            self.total -= cost - self.reused_cost
+            cost = self.reused_cost
+        self.done_cost += cost
+        if not self.costs:
+            self.items_finished = time.monotonic()
+
+    def ratio(self) -> float:
+        if self.done_cost <= 0:
+            return 1.0
+        elapsed = (self.items_finished or time.monotonic()) - self.started
+        return min(10.0, max(0.1, elapsed / self.done_cost))
+
+    def eta_seconds(self) -> float:
+        ratio = self.ratio()
+        if self.items_finished is not None:
+            return max(0.0, self.finish_seconds * ratio - (time.monotonic() - self.items_finished))
+        return max(0.0, (self.total - self.done_cost) * ratio + self.finish_seconds * ratio)
@@ -0,0 +1,137 @@
+"""
+Event log for SAF generation progress, shared between the worker and the web process.
+
+The generator (``saf_worker``) publishes one event per item stage change (``nro``,
+``result``, ``stage``) and per progress update. Events are appended as JSON lines to
+``SAF_OUTPUT_ROOT/.events/batch_<id>.jsonl``; the sequence number of an event is the byte offset
+right after its line, so a reconnecting ``EventSource`` (``Last-Event-ID``) resumes with a
+single seek. SSE subscribers in another process follow the file (a ``stat`` every
+``POLL_SECONDS``, no DB queries); subscribers in the publishing process are woken at once.
+
+Only one job per batch runs at a time, so each log has a single writer. ``clear`` drops the
+log when a new generation is queued; a reader whose offset no longer fits the file reads
+it again from the start.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+POLL_SECONDS = 0.25
+# Max bytes read per call: a reader far behind catches up over several calls.
+READ_CHUNK = 1024 * 1024
+TAIL_BYTES = 64 * 1024
+
+
+def _default_root() -> Path:
+    from django.conf import settings
+
+    return Path(settings.SAF_OUTPUT_ROOT) / ".events"
+
+
+class EventLog:
+    def __init__(self, root: Union[Path, Callable[[], Path], None] = None):
+        self._root = root or _default_root
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+
+    @property
+    def root(self) -> Path:
+        return Path(self._root() if callable(self._root) else self._root)
+
+    def path(self, batch_id: int) -> Path:
+        return self.root / f"batch_{batch_id}.jsonl"
+
+    def publish(self, batch_id: int, event: dict) -> int:
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        path = self.path(batch_id)
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("ab") as fh:
+                fh.write(line)
+                seq = fh.tell()
+        with self._cond:
+            self._cond.notify_all()
+        return seq
+
+    def last_seq(self, batch_id: int) -> int:
+        try:
+            return self.path(batch_id).stat().st_size
+        except OSError:
+            return 0
+
+    def since(self, batch_id: int, after_seq: int) -> List[Tuple[int, dict]]:
+        """Complete events of ``batch_id`` after offset ``after_seq``."""
+        try:
+            fh = self.path(batch_id).open("rb")
+        except OSError:
+            return []
+        with fh:
+            size = os.fstat(fh.fileno()).st_size
+            if after_seq > size:
+                after_seq = 0
+            elif after_seq > 0:
+                fh.seek(after_seq - 1)
+                if fh.read(1) != b"\n":
+                    # The log was cleared and written again past our offset.
+                    after_seq = 0
+            if after_seq == size:
+                return []
+            fh.seek(after_seq)
+            data = fh.read(READ_CHUNK)
+        events = []
+        offset = after_seq
+        for raw in data.splitlines(keepends=True):
+            if not raw.endswith(b"\n"):
+                break  # line still being written
+            offset += len(raw)
+            try:
+                events.append((offset, json.loads(raw)))
+            except ValueError:
+                continue
+        return events
+
+    def wait(self, batch_id: int, after_seq: int, timeout: float) -> List[Tuple[int, dict]]:
+        """Events of ``batch_id`` newer than ``after_seq``, blocking up to ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.last_seq(batch_id) != after_seq:
+                events = self.since(batch_id, after_seq)
+                if events:
+                    return events
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            with self._cond:
+                self._cond.wait(min(remaining, POLL_SECONDS))
+
+    def last(self, batch_id: int, event_type: str) -> Optional[dict]:
+        """Most recent event of ``event_type`` (read from the end of the log)."""
+        try:
+            fh = self.path(batch_id).open("rb")
+        except OSError:
+            return None
+        with fh:
+            size = os.fstat(fh.fileno()).st_size
+            fh.seek(max(0, size - TAIL_BYTES))
+            lines = fh.read().splitlines()
+        for raw in reversed(lines):
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                continue
+            if event.get("type") == event_type:
+                return event
+        return None
+
+    def clear(self, batch_id: int):
+        with self._lock:
+            try:
+                self.path(batch_id).unlink()
+            except OSError:
+                pass
+
+
+bus = EventLog()
@@ -0,0 +1,146 @@
+"""
+Bulk re-export of records across groups (``manage.py saf_export``).
+
+After a crosswalk change or a DSpace migration every published record has to be rebuilt.
+An export selects records by group date, career and status and splits them into parts of
+``SAF_EXPORT_BATCH_SIZE`` records; each part is an ordinary ``SafBatch`` (``export_code``
+set, no group) with its own ``GENERATE`` job, so ``saf_worker`` processes several parts in
+parallel and a part interrupted by a dead worker is retried from its lease. Parts keep the
+status of their records, and items that already have a ``dspace_handle`` go into
+``mapfiles/map_<CAREER>.map`` so the import scripts run in replace mode (``-r``).
+
+Resuming an export queues again only the parts that did not finish; generation is
+incremental, so items already written in a part are reused.
+"""
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, QuerySet
+from django.utils import timezone
+
+from registry.models import ThesisRecord
+from saf.jobs import enqueue_generation
+from saf.models import SafBatch, SafBatchItem, SafJob
+
+EXPORT_PREFIX = "EXP_"
+
+
+def export_batch_size(size: Optional[int] = None) -> int:
+    return max(1, int(size or getattr(settings, "SAF_EXPORT_BATCH_SIZE", 500) or 1))
+
+
+def select_export_records(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    careers: Iterable[str] = (),
+    statuses: Iterable[str] = (ThesisRecord.STATUS_PUBLICADO,),
+) -> QuerySet:
+    """Records to re-export, ordered so that each part mostly holds one career."""
+    qs = ThesisRecord.objects.all()
+    if date_from:
+        qs = qs.filter(group__date__gte=date_from)
+    if date_to:
+        qs = qs.filter(group__date__lte=date_to)
+    careers = [c.strip().upper() for c in careers if c.strip()]
+    if careers:
+        qs = qs.filter(career__carrera_norm__in=careers)
+    statuses = list(statuses)
+    if statuses:
+        qs = qs.filter(status__in=statuses)
+    return qs.order_by("career__carrera_norm", "group__date", "nro")
+
+
+def create_export(records: QuerySet, user, batch_size: Optional[int] = None, description: str = "") -> Tuple[str, List[SafBatch]]:
+    """Create the parts of a new export and queue their generation. Returns ``(export_code, parts)``."""
+    size = export_batch_size(batch_size)
+    record_ids = list(records.values_list("id", flat=True))
+    if not record_ids:
+        return "", []
+    code = f"{EXPORT_PREFIX}{timezone.localtime().strftime('%Y%m%d_%H%M%S')}"
+    chunks = [record_ids[i:i + size] for i in range(0, len(record_ids), size)]
+    parts: List[SafBatch] = []
+    # All parts or none: an interrupted creation leaves nothing half-built to resume.
+    with transaction.atomic():
+        for number, chunk in enumerate(chunks, start=1):
+            batch = SafBatch.objects.create(
+                batch_code=f"{code}_P{number:03d}",
+                export_code=code,
+                created_by=user,
+                log_text=f"Exportación {code}: parte {number}/{len(chunks)} ({len(chunk)} registro(s)). {description}".strip(),
+            )
+            SafBatchItem.objects.bulk_create([SafBatchItem(batch=batch, record_id=rid) for rid in chunk])
+            parts.append(batch)
+    for batch in parts:
+        enqueue_generation(batch, user)
+    return code, parts
+
+
+def export_parts(code: str) -> QuerySet:
+    return SafBatch.objects.filter(export_code=code).order_by("batch_code")
+
+
+def resume_export(code: str, user=None) -> int:
+    """Queue again the parts of ``code`` that are not done (failed, never run). Returns how many."""
+    queued = 0
+    for batch in export_parts(code).exclude(status=SafBatch.STATUS_DONE):
+        _, created = enqueue_generation(batch, user)
+        queued += int(created)
+    return queued
+
+
+@dataclass
+class ExportStatus:
+    code: str
+    parts: int = 0
+    parts_done: int = 0
+    parts_failed: int = 0
+    parts_active: int = 0
+    items: int = 0
+    items_ok: int = 0
+    items_error: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.parts_active == 0
+
+    def summary(self) -> str:
+        processed = self.items_ok + self.items_error
+        rate = processed / self.seconds * 60 if self.seconds else 0.0
+        mbps = self.bytes / 1048576 / self.seconds if self.seconds else 0.0
+        return (
+            f"{self.code}: partes {self.parts_done}/{self.parts} listas, {self.parts_failed} con error, "
+            f"{self.parts_active} en cola o en proceso | items {processed}/{self.items} "
+            f"({self.items_error} con error) | {rate:.1f} registro(s)/min, {mbps:.2f} MB/s "
+            f"en {self.seconds:.0f} s"
+        )
+
+
+def export_status(code: str) -> ExportStatus:
+    """Overall progress and throughput of an export (elapsed time from its first job)."""
+    status = ExportStatus(code=code)
+    parts = list(export_parts(code))
+    status.parts = len(parts)
+    status.parts_done = sum(1 for b in parts if b.status == SafBatch.STATUS_DONE)
+    status.parts_failed = sum(1 for b in parts if b.status == SafBatch.STATUS_FAILED)
+    for b in parts:
+        if b.status == SafBatch.STATUS_DONE and b.zip_path and Path(b.zip_path).exists():
+            status.bytes += Path(b.zip_path).stat().st_size
+    items = SafBatchItem.objects.filter(batch__export_code=code).aggregate(
+        total=Count("id"),
+        ok=Count("id", filter=Q(result=SafBatchItem.RESULT_OK)),
+        error=Count("id", filter=Q(result=SafBatchItem.RESULT_ERROR)),
+    )
+    status.items, status.items_ok, status.items_error = items["total"], items["ok"], items["error"]
+    jobs = SafJob.objects.filter(batch__export_code=code, kind=SafJob.KIND_GENERATE)
+    status.parts_active = jobs.filter(status__in=SafJob.ACTIVE_STATUSES).values("batch").distinct().count()
+    span = jobs.aggregate(start=Min("started_at"), end=Max("finished_at"))
+    if span["start"]:
+        end = timezone.now() if status.parts_active or not span["end"] else span["end"]
+        status.seconds = max(0.0, (end - span["start"]).total_seconds())
+    return status
@@ -0,0 +1,388 @@
+"""
+Reverse SAF ingest (``manage.py saf_ingest``): load existing SAF packages into the registry.
+
+Walks an unpacked tree such as ``build_saf.py``'s ``out_saf/<CARRERA>/item_###/`` (or a ZIP of
+it). Items are read on a thread pool: ``dublin_core.xml`` and ``metadata_<schema>.xml`` are
+streamed through ``saf.crosswalk.parse_metadata_xml`` and mapped back to record fields, and the
+bitstreams listed in ``contents`` are copied into ``MEDIA_ROOT`` while their SHA-256 is
+computed. The main thread does all DB work, one chunk at a time: records, files and a
+``SafIngestItem`` row per item are bulk-inserted in one transaction, so a re-run (or a run
+resumed after an interruption) skips what was already committed. A thesis whose SHA-256 is
+already in the registry is linked instead of duplicated.
+
+Careers are resolved by collection handle (``collections`` file of the item or ``HANDLE`` of
+the career ``importar.bat``), falling back to the folder name. Records land in one synthetic
+``SustentationGroup`` per year of ``dc.date.issued``; items with a known DSpace handle
+(``handle`` file or a DSpace map file in the package) are marked as published.
+"""
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from appconfig.models import CareerConfig
+from registry.models import SustentationGroup, ThesisFile, ThesisRecord
+from saf.crosswalk import crosswalk_values_from_entries, norm_text, parse_metadata_xml
+from saf.models import SafIngestItem
+from saf.services import REPLACE_SUFFIX, get_scheduler
+from saf.validator import METADATA_RE, group_item_files, open_saf_source
+
+INGEST_GROUP_NAME = "SAF HISTORICO {year}"
+COPY_BUFFER = 1024 * 1024
+HANDLE_LINE_RE = re.compile(r'set "HANDLE=([^"]+)"', re.IGNORECASE)
+MAP_NAME_RE = re.compile(r"(?:^|/)map_(?P<career>.+?)(?:_\d{8})?\.map$")
+
+# Record field <- crosswalk source (inverse of saf.services.record_crosswalk_values).
+RECORD_FIELDS = {
+    "titulo": "title",
+    "autor1_nombre": "author1",
+    "autor1_dni": "author1_dni",
+    "autor2_nombre": "author2",
+    "autor2_dni": "author2_dni",
+    "autor3_nombre": "author3",
+    "autor3_dni": "author3_dni",
+    "asesor_nombre": "advisor",
+    "asesor_dni": "advisor_dni",
+    "asesor_orcid": "advisor_orcid",
+    "jurado1": "juror1",
+    "jurado2": "juror2",
+    "jurado3": "juror3",
+    "resumen": "abstract",
+    "keywords_raw": "keywords",
+}
+
+
+@dataclass
+class IngestFile:
+    file_type: str
+    original_name: str
+    stored_name: str
+    size: int = 0
+    sha256: str = ""
+
+
+@dataclass
+class IngestItem:
+    prefix: str
+    career_folder: str
+    values: Dict[str, str] = field(default_factory=dict)
+    year: Optional[int] = None
+    handle: str = ""
+    collection: str = ""
+    files: List[IngestFile] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    error: str = ""
+
+    @property
+    def thesis(self) -> Optional[IngestFile]:
+        return next((f for f in self.files if f.file_type == ThesisFile.TYPE_TESIS_PDF), None)
+
+
+@dataclass
+class IngestReport:
+    source: str
+    items: int = 0
+    created: int = 0
+    skipped: int = 0
+    linked: int = 0
+    failed: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    lines: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        rate = (self.created + self.linked) / self.seconds if self.seconds else 0.0
+        mbps = self.bytes / 1048576 / self.seconds if self.seconds else 0.0
+        return (
+            f"Ingesta {self.source}: {self.items} item(s) | nuevos: {self.created} | ya importados: {self.skipped} | "
+            f"enlazados a registros existentes: {self.linked} | con error: {self.failed} | "
+            f"{rate:.1f} item(s)/s, {mbps:.1f} MB/s ({self.seconds:.1f} s)"
+        )
+
+
+def source_key(path: Path) -> str:
+    return str(Path(path).resolve())
+
+
+def _file_type(file_name: str, primary: bool) -> Optional[str]:
+    lower = file_name.lower()
+    if primary or lower == "tesis.pdf":
+        return ThesisFile.TYPE_TESIS_PDF
+    if lower.startswith("formulario"):
+        return ThesisFile.TYPE_FORMULARIO
+    if lower.startswith("turnitin"):
+        return ThesisFile.TYPE_TURNITIN
+    return None
+
+
+def _copy_hashing(source, name: str, dst: Path) -> Tuple[int, str]:
+    """Copy member ``name`` to ``dst`` computing its SHA-256 on the way (single read)."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".part")
+    digest = hashlib.sha256()
+    size = 0
+    with source.open(name) as src, open(tmp, "wb") as out:
+        while True:
+            chunk = src.read(COPY_BUFFER)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    os.replace(tmp, dst)
+    return size, digest.hexdigest()
+
+
+def _read_text(source, name: str) -> str:
+    return source.read(name).decode("utf-8-sig", errors="replace")
+
+
+def load_item(source, prefix: str, files: List[str], storage_prefix: str) -> IngestItem:
+    """Parse one item folder and copy its bitstreams; runs on the pool (no DB access)."""
+    career_folder = prefix.rstrip("/").rsplit("/", 2)[-2] if prefix.count("/") >= 2 else ""
+    item = IngestItem(prefix=prefix, career_folder=career_folder)
+    present = set(files)
+    scheduler = get_scheduler()
+    try:
+        if "dublin_core.xml" not in present:
+            raise ValueError("falta dublin_core.xml")
+        entries = []
+        for file_name in sorted(files):
+            if file_name == "dublin_core.xml" or METADATA_RE.match(file_name):
+                with source.open(prefix + file_name) as f:
+                    entries.extend(parse_metadata_xml(f))
+        item.values = crosswalk_values_from_entries(entries)
+        if not item.values.get("title"):
+            raise ValueError("dublin_core.xml sin dc.title")
+        issued = next((e[4] for e in entries if e[:3] == ("dc", "date", "issued") and e[4]), "")
+        if re.match(r"^\d{4}", issued):
+            item.year = int(issued[:4])
+        if "handle" in present:
+            item.handle = _read_text(source, prefix + "handle").strip()
+        if "collections" in present:
+            lines = _read_text(source, prefix + "collections").split()
+            item.collection = lines[0] if lines else ""
+
+        listed: List[Tuple[str, List[str]]] = []
+        if "contents" in present:
+            for line in _read_text(source, prefix + "contents").splitlines():
+                parts = [p.strip() for p in line.split("\t")]
+                if parts[0]:
+                    listed.append((parts[0], parts[1:]))
+        else:
+            item.warnings.append("sin contents: se toman los PDF de la carpeta")
+            listed = [(f, []) for f in sorted(files) if f.lower().endswith(".pdf")]
+
+        for file_name, options in listed:
+            if "bundle:LICENSE" in options:
+                continue  # The platform adds the active license itself.
+            if file_name not in present:
+                item.warnings.append(f"{file_name} figura en contents pero no existe")
+                continue
+            file_type = _file_type(file_name, "primary:true" in options)
+            if file_type is None:
+                item.warnings.append(f"{file_name} no se importa (tipo de archivo no reconocido)")
+                continue
+            if file_type == ThesisFile.TYPE_TESIS_PDF and item.thesis:
+                item.warnings.append(f"{file_name} no se importa (ya hay una tesis principal)")
+                continue
+            stored = f"{storage_prefix}/{prefix}{file_name}"
+            # Shares the process-wide copy limit with running generations.
+            with scheduler.owner(storage_prefix), scheduler.slot("copy"):
+                size, sha = _copy_hashing(source, prefix + file_name, Path(default_storage.path(stored)))
+            item.files.append(IngestFile(file_type, file_name, stored, size, sha))
+        if not item.thesis:
+            raise ValueError("no se encontró la tesis (tesis.pdf o primary:true)")
+    except Exception as exc:  # noqa: BLE001
+        item.error = str(exc)
+    return item
+
+
+def _field_value(name: str, value: Optional[str]) -> str:
+    max_length = ThesisRecord._meta.get_field(name).max_length
+    return (value or "")[:max_length] if max_length else (value or "")
+
+
+def _discard_files(item: IngestItem):
+    for f in item.files:
+        default_storage.delete(f.stored_name)
+
+
+def _package_handles(source, names: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """``(career folder -> collection handle, item prefix -> item handle)`` from scripts and map files."""
+    collections: Dict[str, str] = {}
+    item_handles: Dict[str, str] = {}
+    for name in names:
+        base = name.rsplit("/", 1)[-1].lower()
+        if base == "importar.bat" and "/" in name:
+            match = HANDLE_LINE_RE.search(_read_text(source, name))
+            if match:
+                career_path = name.rsplit("/", 1)[0]
+                collections[career_path.rsplit("/", 1)[-1]] = match.group(1).strip()
+            continue
+        match = MAP_NAME_RE.search(name)
+        if not match:
+            continue
+        career = match.group("career")
+        for line in _read_text(source, name).splitlines():
+            folder, _, handle = line.strip().partition(" ")
+            if folder and handle:
+                item_handles[f"{career}/{folder}"] = handle.strip()
+    return collections, item_handles
+
+
+def _career_lookup() -> Tuple[Dict[str, CareerConfig], Dict[str, CareerConfig]]:
+    by_handle: Dict[str, CareerConfig] = {}
+    by_folder: Dict[str, CareerConfig] = {}
+    for career in CareerConfig.objects.order_by("-active", "id"):
+        by_handle.setdefault((career.handle or "").strip(), career)
+        by_folder.setdefault(re.sub(r"\s+", "_", norm_text(career.carrera_norm)), career)
+    return by_handle, by_folder
+
+
+def ingest_group(year: int, user=None) -> SustentationGroup:
+    """Synthetic group of the ingested records of ``year`` (first free date of that year)."""
+    name = INGEST_GROUP_NAME.format(year=year)
+    group = SustentationGroup.objects.filter(name=name).first()
+    if group:
+        return group
+    day = date(year, 1, 1)
+    taken = set(SustentationGroup.objects.filter(date__year=year).values_list("date", flat=True))
+    while day in taken:
+        day = date.fromordinal(day.toordinal() + 1)
+    return SustentationGroup.objects.create(date=day, name=name, created_by=user)
+
+
+def _insert_chunk(items: List[IngestItem], key: str, careers, handles, user, report: IngestReport) -> List[int]:
+    """Create records/files/ledger rows of a parsed chunk in one transaction. Returns touched group ids."""
+    by_handle, by_folder = careers
+    collections, item_handles = handles
+    base_url = (getattr(settings, "DSPACE_BASE_URL", "") or "").strip().rstrip("/")
+    known = dict(
+        ThesisFile.objects.filter(
+            file_type=ThesisFile.TYPE_TESIS_PDF, sha256__in=[i.thesis.sha256 for i in items]
+        ).values_list("sha256", "record_id")
+    )
+    groups: Dict[int, SustentationGroup] = {}
+    new_items: List[IngestItem] = []
+    ledger: List[SafIngestItem] = []
+    first_of: Dict[str, str] = {}
+    for item in items:
+        item_path = item.prefix.rstrip("/")
+        sha = item.thesis.sha256
+        if sha in known:
+            # Already in the registry (loaded through the platform or from another package).
+            _discard_files(item)
+            ledger.append(SafIngestItem(source=key, item_path=item_path, record_id=known[sha], sha256=sha))
+            report.linked += 1
+            report.lines.append(f"[ENLAZADO] {item_path} - tesis ya registrada")
+        elif sha in first_of:
+            # Same thesis twice in this chunk: no ledger row, the next run links it to the first one.
+            _discard_files(item)
+            report.failed += 1
+            report.lines.append(f"[ERROR] {item_path} - tesis repetida (igual a {first_of[sha]})")
+        else:
+            first_of[sha] = item_path
+            new_items.append(item)
+
+    with transaction.atomic():
+        # Same lock as ThesisRecord.next_nro (FOR UPDATE cannot be combined with an aggregate).
+        top = ThesisRecord.objects.select_for_update().order_by("-nro").first()
+        last = top.nro if top else 0
+        records: List[ThesisRecord] = []
+        for offset, item in enumerate(new_items, start=1):
+            career = by_handle.get(item.collection) or by_handle.get(collections.get(item.career_folder, ""))
+            career = career or by_folder.get(item.career_folder.removesuffix(REPLACE_SUFFIX))
+            if career is None:
+                item.warnings.append(f"carrera no encontrada para {item.career_folder or 'la carpeta'}")
+            year = item.year or date.today().year
+            if year not in groups:
+                groups[year] = ingest_group(year, user)
+            handle = item.handle or item_handles.get("/".join(item.prefix.rstrip("/").split("/")[-2:]), "")
+            record = ThesisRecord(
+                nro=last + offset,
+                group=groups[year],
+                career=career,
+                status=ThesisRecord.STATUS_PUBLICADO if handle else ThesisRecord.STATUS_POR_PUBLICAR,
+                dspace_handle=handle,
+                dspace_url=f"{base_url}/handle/{handle}" if handle and base_url else "",
+                **{name: _field_value(name, item.values.get(src)) for name, src in RECORD_FIELDS.items()},
+            )
+            records.append(record)
+        ThesisRecord.objects.bulk_create(records)
+        # MySQL does not return ids from bulk_create: map them back through the unique nro.
+        ids = dict(ThesisRecord.objects.filter(nro__in=[r.nro for r in records]).values_list("nro", "id"))
+        files: List[ThesisFile] = []
+        for item, record in zip(new_items, records):
+            record_id = ids[record.nro]
+            for f in item.files:
+                files.append(
+                    ThesisFile(
+                        record_id=record_id,
+                        file_type=f.file_type,
+                        original_name=f.original_name,
+                        stored_path=f.stored_name,
+                        mime_type="application/pdf" if f.original_name.lower().endswith(".pdf") else "",
+                        size_bytes=f.size,
+                        sha256=f.sha256,
+                        file=f.stored_name,
+                    )
+                )
+            ledger.append(
+                SafIngestItem(source=key, item_path=item.prefix.rstrip("/"), record_id=record_id, sha256=item.thesis.sha256)
+            )
+            report.created += 1
+            report.lines.append(f"[OK] {item.prefix.rstrip('/')} -> {record.nro:03d}")
+            for warning in item.warnings:
+                report.lines.append(f"[AVISO] {item.prefix.rstrip('/')} - {warning}")
+        ThesisFile.objects.bulk_create(files)
+        SafIngestItem.objects.bulk_create(ledger)
+    return [g.id for g in groups.values()]
+
+
+def ingest_saf(path: Path, user=None, workers: Optional[int] = None, chunk_size: int = 200) -> IngestReport:
+    """Load every ``item_###`` of the package at ``path`` not ingested yet from the same source."""
+    started = time.monotonic()
+    path = Path(path)
+    key = source_key(path)
+    report = IngestReport(source=str(path))
+    source = open_saf_source(path)
+    items = group_item_files(source.names)
+    report.items = len(items)
+    done = set(SafIngestItem.objects.filter(source=key).values_list("item_path", flat=True))
+    pending = [p for p in sorted(items) if p.rstrip("/") not in done]
+    report.skipped = report.items - len(pending)
+    careers = _career_lookup()
+    handles = _package_handles(source, source.names)
+    storage_prefix = f"records/ingest/{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+    workers = max(1, int(workers or getattr(settings, "SAF_INGEST_WORKERS", 8) or 1))
+    touched = set()
+    # The pool threads read the ZIP through the source: close it only after the pool.
+    with source, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="saf-ingest") as pool:
+        for start in range(0, len(pending), max(1, chunk_size)):
+            chunk = pending[start:start + max(1, chunk_size)]
+            parsed = list(pool.map(lambda p: load_item(source, p, items[p], storage_prefix), chunk))
+            ok_items = []
+            for item in parsed:
+                report.bytes += sum(f.size for f in item.files)
+                if item.error:
+                    _discard_files(item)
+                    report.failed += 1
+                    report.lines.append(f"[ERROR] {item.prefix.rstrip('/')} - {item.error}")
+                else:
+                    ok_items.append(item)
+            if ok_items:
+                touched.update(_insert_chunk(ok_items, key, careers, handles, user, report))
+    for group in SustentationGroup.objects.filter(id__in=touched):
+        group.recompute_status(save=True)
+    report.seconds = time.monotonic() - started
+    return report
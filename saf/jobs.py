@@ -0,0 +1,322 @@
+"""
+Durable job queue for SAF work.
+
+The web process only enqueues ``SafJob`` rows; ``manage.py saf_worker`` claims them and runs
+them. A claimed job holds a lease (``lease_expires_at``) that the worker renews with a
+heartbeat while the job runs. If the worker dies the lease expires and the next worker
+claims the job again: generation is incremental (item fingerprints), so a re-run resumes
+from the items already written instead of starting over. After ``SAF_JOB_MAX_ATTEMPTS``
+claims the job and its batch are marked as failed.
+
+Approving a record queues a ``STAGE`` job for its group batch (``SAF_SPECULATIVE_STAGING``):
+the worker builds the approved items ahead of time and the final generation reuses them.
+Only one job per batch runs at a time, since both kinds write the same archive.
+
+The full preflight of a group (SHA-256 of every file and the soffice probe) is a
+``PREFLIGHT`` job of its batch; the report is the job message.
+
+Uploading a thesis DOCX queues a ``CONVERT`` job, so soffice never runs in the web process and
+a restart does not lose the conversion. ``requeue_stale_conversions`` (run by the worker)
+queues again the files left PENDING/RUNNING without an active job.
+
+Claims use ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database supports it (MySQL) and
+always finish with a conditional update, so two workers never run the same job (SQLite
+ignores row locks; the conditional update is enough there). A job of a batch is claimed
+while holding the ``SafBatch`` row lock, so two workers cannot start two different jobs of
+the same batch either (e.g. a requeued job next to one whose lease just expired).
+"""
+import os
+import socket
+import uuid
+from datetime import timedelta
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from registry.models import SustentationGroup, ThesisFile, ThesisRecord
+from saf.models import SafBatch, SafBatchItem, SafJob
+from saf.progress import clear_progress, fail_progress
+
+
+def job_lease_seconds() -> int:
+    return max(10, int(getattr(settings, "SAF_JOB_LEASE_SECONDS", 120)))
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def get_or_create_group_batch(group: SustentationGroup, user) -> SafBatch:
+    batch = SafBatch.objects.filter(group=group).order_by("-created_at").first()
+    if batch:
+        return batch
+    # One batch per group in the new flow (code is internal; UI should not show it).
+    code = f"SAF_{group.date.strftime('%Y%m%d')}_G{group.id}"
+    return SafBatch.objects.create(batch_code=code, created_by=user, group=group)
+
+
+def enqueue_staging(record: ThesisRecord, user=None) -> Optional[SafJob]:
+    """Queue speculative staging of an approved record's item (None when there is nothing to do)."""
+    if not getattr(settings, "SAF_SPECULATIVE_STAGING", True) or not record.group_id:
+        return None
+    batch = get_or_create_group_batch(record.group, user)
+    if batch.status == SafBatch.STATUS_RUNNING or (batch.status == SafBatch.STATUS_DONE and batch.zip_path):
+        # A generation is queued (it builds the item itself) or the SAF is already final.
+        return None
+    SafBatchItem.objects.get_or_create(batch=batch, record=record)
+    with transaction.atomic():
+        SafBatch.objects.select_for_update().filter(pk=batch.pk).first()
+        # A queued job has not read the items yet and will pick this one up too.
+        job = batch.jobs.filter(kind=SafJob.KIND_STAGE, status=SafJob.STATUS_QUEUED).first()
+        if job is None:
+            job = SafJob.objects.create(kind=SafJob.KIND_STAGE, batch=batch, created_by=user)
+    return job
+
+
+def enqueue_generation(batch: SafBatch, user=None, profile: bool = False) -> Tuple[SafJob, bool]:
+    """Queue a generation for ``batch``. Returns ``(job, created)``; an active job is reused."""
+    with transaction.atomic():
+        SafBatch.objects.select_for_update().filter(pk=batch.pk).first()
+        job = batch.jobs.filter(kind=SafJob.KIND_GENERATE, status__in=SafJob.ACTIVE_STATUSES).first()
+        if job:
+            if profile and not job.profile and job.status == SafJob.STATUS_QUEUED:
+                job.profile = True
+                job.save(update_fields=["profile", "updated_at"])
+            return job, False
+        job = SafJob.objects.create(kind=SafJob.KIND_GENERATE, batch=batch, created_by=user, profile=profile)
+        batch.status = SafBatch.STATUS_RUNNING
+        batch.log_text = "En cola: esperando al worker SAF..."
+        batch.save(update_fields=["status", "log_text", "updated_at"])
+    clear_progress(batch.id)
+    return job, True
+
+
+def enqueue_conversion(thesis_file: ThesisFile, user=None) -> SafJob:
+    """Queue the DOCX -> PDF conversion of an uploaded thesis for ``saf_worker``."""
+    with transaction.atomic():
+        # Status and job together: the sweep never sees a PENDING file without its job.
+        ThesisFile.objects.filter(pk=thesis_file.pk).update(
+            conversion_status=ThesisFile.CONVERSION_PENDING, conversion_detail="", updated_at=timezone.now()
+        )
+        job = SafJob.objects.filter(
+            kind=SafJob.KIND_CONVERT, thesis_file=thesis_file, status=SafJob.STATUS_QUEUED
+        ).first()
+        if job is None:
+            job = SafJob.objects.create(kind=SafJob.KIND_CONVERT, thesis_file=thesis_file, created_by=user)
+    thesis_file.conversion_status = ThesisFile.CONVERSION_PENDING
+    thesis_file.conversion_detail = ""
+    return job
+
+
+def enqueue_preflight(group: SustentationGroup, user=None) -> SafJob:
+    """Queue the full preflight of ``group``; an active one is reused."""
+    batch = get_or_create_group_batch(group, user)
+    with transaction.atomic():
+        SafBatch.objects.select_for_update().filter(pk=batch.pk).first()
+        job = batch.jobs.filter(kind=SafJob.KIND_PREFLIGHT, status__in=SafJob.ACTIVE_STATUSES).first()
+        if job is None:
+            job = SafJob.objects.create(kind=SafJob.KIND_PREFLIGHT, batch=batch, created_by=user)
+    return job
+
+
+def requeue_stale_conversions() -> int:
+    """Queue again DOCX conversions left PENDING/RUNNING without an active job (e.g. lost web threads)."""
+    active = SafJob.objects.filter(
+        kind=SafJob.KIND_CONVERT, thesis_file=OuterRef("pk"), status__in=SafJob.ACTIVE_STATUSES
+    )
+    stale = ThesisFile.objects.filter(
+        file_type=ThesisFile.TYPE_TESIS_DOCX,
+        conversion_status__in=[ThesisFile.CONVERSION_PENDING, ThesisFile.CONVERSION_RUNNING],
+    ).filter(~Exists(active))
+    count = 0
+    for thesis_file in stale:
+        enqueue_conversion(thesis_file)
+        count += 1
+    return count
+
+
+def _fail_conversion(job: SafJob, message: str):
+    if job.thesis_file_id:
+        ThesisFile.objects.filter(
+            pk=job.thesis_file_id,
+            conversion_status__in=[ThesisFile.CONVERSION_PENDING, ThesisFile.CONVERSION_RUNNING],
+        ).update(conversion_status=ThesisFile.CONVERSION_ERROR, conversion_detail=message, updated_at=timezone.now())
+
+
+def _fail_job(job: SafJob, message: str):
+    now = timezone.now()
+    SafJob.objects.filter(pk=job.pk).update(
+        status=SafJob.STATUS_FAILED, message=message, finished_at=now, lease_expires_at=None, updated_at=now
+    )
+    _fail_conversion(job, message)
+    if job.batch_id and job.kind != SafJob.KIND_PREFLIGHT:
+        SafBatch.objects.filter(pk=job.batch_id, status=SafBatch.STATUS_RUNNING).update(
+            status=SafBatch.STATUS_FAILED, log_text=f"Error: {message}", updated_at=now
+        )
+        fail_progress(job.batch_id, f"Error: {message}")
+
+
+def _batch_busy(job: SafJob, now) -> bool:
+    """Another job of ``job``'s batch holds a live lease (read under the batch row lock)."""
+    return (
+        SafJob.objects.select_for_update()
+        .filter(batch_id=job.batch_id, status=SafJob.STATUS_RUNNING, lease_expires_at__gte=now)
+        .exclude(pk=job.pk)
+        .exists()
+    )
+
+
+def claim_job(worker_id: str) -> Optional[SafJob]:
+    """Take the oldest queued job (or one whose lease expired) for ``worker_id``."""
+    max_attempts = max(1, int(getattr(settings, "SAF_JOB_MAX_ATTEMPTS", 3)))
+    skipped = set()
+    while True:
+        now = timezone.now()
+        # Jobs of a batch that already has a live job wait: they would write the same archive.
+        busy = SafJob.objects.filter(batch=OuterRef("batch"), status=SafJob.STATUS_RUNNING, lease_expires_at__gte=now)
+        with transaction.atomic():
+            job = (
+                SafJob.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=SafJob.STATUS_QUEUED) | Q(status=SafJob.STATUS_RUNNING, lease_expires_at__lt=now))
+                .filter(~Exists(busy))
+                .exclude(pk__in=skipped)
+                .order_by("created_at", "id")
+                .first()
+            )
+            if job is None:
+                return None
+            if job.batch_id:
+                # The busy check above ran before any lock: serialize the claims of a batch on its row
+                # and check again, so two workers never start two jobs of the same batch.
+                SafBatch.objects.select_for_update().filter(pk=job.batch_id).first()
+                if _batch_busy(job, now):
+                    skipped.add(job.pk)
+                    continue
+            if job.attempts >= max_attempts:
+                _fail_job(job, f"Trabajo abandonado tras {job.attempts} intento(s) sin terminar (worker detenido).")
+                continue
+            claimed = SafJob.objects.filter(
+                pk=job.pk, status=job.status, worker_id=job.worker_id, attempts=job.attempts
+            ).update(
+                status=SafJob.STATUS_RUNNING,
+                worker_id=worker_id,
+                attempts=job.attempts + 1,
+                lease_expires_at=now + timedelta(seconds=job_lease_seconds()),
+                heartbeat_at=now,
+                started_at=now,
+                updated_at=now,
+            )
+        if claimed:
+            return SafJob.objects.select_related("batch").get(pk=job.pk)
+
+
+def heartbeat(worker_id: str, job_ids: Iterable[int]) -> int:
+    """Renew the leases of the jobs ``worker_id`` is running. Returns how many are still held."""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    now = timezone.now()
+    return SafJob.objects.filter(pk__in=job_ids, worker_id=worker_id, status=SafJob.STATUS_RUNNING).update(
+        lease_expires_at=now + timedelta(seconds=job_lease_seconds()), heartbeat_at=now, updated_at=now
+    )
+
+
+def release_jobs(worker_id: str, job_ids: Iterable[int]) -> int:
+    """Put unfinished jobs back in the queue (worker shutting down) without spending an attempt."""
+    now = timezone.now()
+    return SafJob.objects.filter(pk__in=list(job_ids), worker_id=worker_id, status=SafJob.STATUS_RUNNING).update(
+        status=SafJob.STATUS_QUEUED,
+        worker_id="",
+        attempts=F("attempts") - 1,
+        lease_expires_at=None,
+        updated_at=now,
+    )
+
+
+def _finish_job(job: SafJob, worker_id: str, status: str, message: str):
+    now = timezone.now()
+    SafJob.objects.filter(pk=job.pk, worker_id=worker_id).update(
+        status=status, message=message, finished_at=now, lease_expires_at=None, updated_at=now
+    )
+
+
+def _run_generate(job: SafJob) -> Tuple[bool, str]:
+    from saf.services import generate_saf_batch
+
+    batch = SafBatch.objects.select_related("group").get(pk=job.batch_id)
+    ok, msg = generate_saf_batch(batch)
+    batch.refresh_from_db(fields=["status"])
+    if batch.status == SafBatch.STATUS_RUNNING:
+        # Returned before generating anything (e.g. no active license).
+        batch.status = SafBatch.STATUS_FAILED
+        batch.log_text = msg
+        batch.save(update_fields=["status", "log_text", "updated_at"])
+        fail_progress(batch.id, msg)
+    if batch.group_id:
+        batch.group.recompute_status(save=True)
+    return ok, msg
+
+
+def _run_stage(job: SafJob) -> Tuple[bool, str]:
+    from saf.services import stage_batch_items
+
+    return stage_batch_items(SafBatch.objects.get(pk=job.batch_id))
+
+
+def _run_convert(job: SafJob) -> Tuple[bool, str]:
+    from saf.services import convert_thesis_file
+
+    return convert_thesis_file(job.thesis_file_id)
+
+
+def _run_preflight(job: SafJob) -> Tuple[bool, str]:
+    from saf.preflight import run_preflight
+
+    batch = SafBatch.objects.select_related("group").get(pk=job.batch_id)
+    records = batch.group.records.select_related("career").prefetch_related("files").order_by("nro")
+    report = run_preflight(records, verify_hash=True)
+    return report.ok, report.summary()
+
+
+JOB_RUNNERS = {
+    SafJob.KIND_GENERATE: _run_generate,
+    SafJob.KIND_STAGE: _run_stage,
+    SafJob.KIND_CONVERT: _run_convert,
+    SafJob.KIND_PREFLIGHT: _run_preflight,
+}
+
+
+def _run_profiled(job: SafJob, runner) -> Tuple[bool, str]:
+    from saf.profiler import profile_run
+    from saf.services import batch_profile_paths
+
+    folded_path, memory_path = batch_profile_paths(SafBatch.objects.get(pk=job.batch_id))
+    interval = float(getattr(settings, "SAF_PROFILE_INTERVAL_MS", 10)) / 1000
+    with profile_run(folded_path, memory_path, interval):
+        return runner(job)
+
+
+def run_job(job: SafJob, worker_id: str) -> Tuple[bool, str]:
+    from saf.services import get_scheduler
+
+    runner = JOB_RUNNERS[job.kind]
+    try:
+        # Global slots taken by this job are queued under its batch (fair ordering between groups).
+        with get_scheduler().owner(job.batch_id or f"job:{job.id}"):
+            ok, msg = _run_profiled(job, runner) if job.profile and job.batch_id else runner(job)
+    except Exception as exc:  # noqa: BLE001
+        _finish_job(job, worker_id, SafJob.STATUS_FAILED, f"Error: {exc}")
+        _fail_conversion(job, f"Error: {exc}")
+        # A failed staging leaves the batch alone: the generation rebuilds those items.
+        if job.batch_id and job.kind == SafJob.KIND_GENERATE:
+            SafBatch.objects.filter(pk=job.batch_id).update(
+                status=SafBatch.STATUS_FAILED, log_text=f"Error: {exc}", updated_at=timezone.now()
+            )
+            fail_progress(job.batch_id, f"Error: {exc}")
+        return False, f"Error: {exc}"
+    # A batch generated with item errors is still a finished job; the batch carries the result.
+    _finish_job(job, worker_id, SafJob.STATUS_DONE, msg)
+    return ok, msg
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from saf.services import get_conversion_cache
+
+
+def _fmt_ts(ts) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else "-"
+
+
+class Command(BaseCommand):
+    help = "Muestra o poda la cache de conversiones DOCX -> PDF."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prune", action="store_true", help="Elimina entradas antiguas hasta respetar el limite.")
+        parser.add_argument("--max-mb", type=int, default=None, help="Limite a usar con --prune (default: settings).")
+        parser.add_argument("--clear", action="store_true", help="Vacia la cache por completo.")
+
+    def handle(self, *args, **options):
+        cache = get_conversion_cache()
+        if options["clear"]:
+            removed, freed = cache.clear()
+            self.stdout.write(self.style.SUCCESS(f"Cache vaciada: {removed} archivo(s), {freed / 1048576:.1f} MB."))
+        elif options["prune"]:
+            max_bytes = None if options["max_mb"] is None else options["max_mb"] * 1024 * 1024
+            removed, freed = cache.prune(max_bytes)
+            self.stdout.write(self.style.SUCCESS(f"Podadas: {removed} entrada(s), {freed / 1048576:.1f} MB liberados."))
+
+        stats = cache.stats()
+        limit = f"{stats['max_bytes'] / 1048576:.0f} MB" if stats["max_bytes"] else "sin limite"
+        self.stdout.write(f"Carpeta: {stats['root']}")
+        self.stdout.write(f"Entradas: {stats['entries']} | Tamano: {stats['bytes'] / 1048576:.1f} MB | Limite: {limit}")
+        self.stdout.write(f"Uso mas antiguo: {_fmt_ts(stats['oldest'])} | mas reciente: {_fmt_ts(stats['newest'])}")
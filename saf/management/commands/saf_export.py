@@ -0,0 +1,92 @@
+import time
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from registry.models import ThesisRecord
+from saf.export import create_export, export_parts, export_status, resume_export, select_export_records
+
+
+def _parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Fecha invalida (AAAA-MM-DD): {value}")
+
+
+class Command(BaseCommand):
+    help = "Re-exporta en bloque registros de varios grupos (por fecha, carrera o estado) en lotes SAF procesados por saf_worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", default="", help="Fecha de sustentacion desde (AAAA-MM-DD).")
+        parser.add_argument("--to", dest="date_to", default="", help="Fecha de sustentacion hasta (AAAA-MM-DD).")
+        parser.add_argument("--career", action="append", default=[], help="Carrera normalizada (repetible).")
+        parser.add_argument(
+            "--status", action="append", default=[], help="Estado del registro (repetible; default: PUBLICADO)."
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Registros por parte (default: settings).")
+        parser.add_argument("--user", default="", help="Usuario que crea los lotes (default: primer superusuario).")
+        parser.add_argument("--dry-run", action="store_true", help="Solo cuenta los registros seleccionados.")
+        parser.add_argument("--resume", default="", metavar="CODIGO", help="Vuelve a encolar las partes no terminadas.")
+        parser.add_argument("--show", default="", metavar="CODIGO", help="Muestra el avance de una exportacion.")
+        parser.add_argument("--wait", action="store_true", help="Sigue el avance hasta que terminen todas las partes.")
+        parser.add_argument("--poll", type=float, default=10, help="Segundos entre lecturas de avance con --wait.")
+
+    def _user(self, username: str):
+        User = get_user_model()
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.filter(Q(is_superuser=True) | Q(role=User.ROLE_AUDITOR)).order_by("-is_superuser", "id").first()
+        if user is None:
+            raise CommandError("No se encontro el usuario para crear los lotes (usa --user).")
+        return user
+
+    def handle(self, *args, **options):
+        code = options["show"] or options["resume"]
+        if code:
+            if not export_parts(code).exists():
+                raise CommandError(f"No existe la exportacion {code}.")
+            if options["resume"]:
+                queued = resume_export(code, self._user(options["user"]))
+                self.stdout.write(f"{code}: {queued} parte(s) en cola de nuevo.")
+        else:
+            statuses = [s.strip().upper() for s in options["status"]] or [ThesisRecord.STATUS_PUBLICADO]
+            valid = {value for value, _ in ThesisRecord.STATUS_CHOICES}
+            unknown = [s for s in statuses if s not in valid]
+            if unknown:
+                raise CommandError(f"Estado desconocido: {', '.join(unknown)}")
+            records = select_export_records(
+                _parse_date(options["date_from"]) if options["date_from"] else None,
+                _parse_date(options["date_to"]) if options["date_to"] else None,
+                options["career"],
+                statuses,
+            )
+            total = records.count()
+            self.stdout.write(f"Registros seleccionados: {total}")
+            if options["dry_run"] or not total:
+                return
+            description = " ".join(
+                part
+                for part in [
+                    f"desde {options['date_from']}" if options["date_from"] else "",
+                    f"hasta {options['date_to']}" if options["date_to"] else "",
+                    f"carreras {','.join(options['career'])}" if options["career"] else "",
+                    f"estados {','.join(statuses)}",
+                ]
+                if part
+            )
+            code, parts = create_export(records, self._user(options["user"]), options["batch_size"], description)
+            self.stdout.write(self.style.SUCCESS(f"Exportacion {code}: {len(parts)} parte(s) en cola."))
+            self.stdout.write("Las procesa `python manage.py saf_worker` (--concurrency N para partes en paralelo).")
+
+        status = export_status(code)
+        self.stdout.write(status.summary())
+        while options["wait"] and not status.finished:
+            time.sleep(max(0.5, options["poll"]))
+            status = export_status(code)
+            self.stdout.write(status.summary())
+        if status.finished and status.parts_failed:
+            self.stdout.write(self.style.WARNING(f"Partes con error: reintenta con --resume {code}."))
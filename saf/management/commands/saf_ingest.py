@@ -0,0 +1,42 @@
+from pathlib import Path
+from zipfile import BadZipFile
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from saf.ingest import ingest_saf
+
+
+class Command(BaseCommand):
+    help = "Carga al registro paquetes SAF existentes (carpeta out_saf de build_saf.py o ZIP); se puede repetir sin duplicar."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Carpeta o ZIP SAF.")
+        parser.add_argument("--workers", type=int, default=None, help="Hilos de lectura/copia (default: SAF_INGEST_WORKERS).")
+        parser.add_argument("--chunk", type=int, default=200, help="Items por transaccion (default: 200).")
+        parser.add_argument("--user", default="", help="Usuario creador de los grupos sinteticos.")
+        parser.add_argument("--all", action="store_true", help="Lista tambien los items importados sin avisos.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            user = get_user_model().objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"No existe el usuario {options['user']}.")
+        failed = 0
+        for raw in options["paths"]:
+            path = Path(raw)
+            if not path.exists():
+                raise CommandError(f"No existe: {path}")
+            try:
+                report = ingest_saf(path, user=user, workers=options["workers"], chunk_size=options["chunk"])
+            except (BadZipFile, OSError) as exc:
+                raise CommandError(f"No se pudo leer {path}: {exc}")
+            for line in report.lines:
+                if options["all"] or not line.startswith("[OK]"):
+                    self.stdout.write(line)
+            style = self.style.WARNING if report.failed else self.style.SUCCESS
+            self.stdout.write(style(report.summary()))
+            failed += report.failed
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} item(s) con error; corrige y vuelve a ejecutar (los ya cargados se omiten)."))
@@ -0,0 +1,113 @@
+import os
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from saf.jobs import (
+    claim_job,
+    heartbeat,
+    job_lease_seconds,
+    make_worker_id,
+    release_jobs,
+    requeue_stale_conversions,
+    run_job,
+)
+from saf.scheduler import lower_process_priority
+
+
+def _run(job, worker_id: str):
+    close_old_connections()
+    try:
+        return run_job(job, worker_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Procesa la cola de trabajos SAF (generacion) con leases y heartbeat."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=None, help="Trabajos simultaneos (default: settings).")
+        parser.add_argument("--poll", type=float, default=None, help="Segundos entre consultas a la cola.")
+        parser.add_argument("--once", action="store_true", help="Procesa lo pendiente y termina.")
+        parser.add_argument("--worker-id", default="", help="Identificador del worker (default: host:pid).")
+        parser.add_argument("--nice", type=int, default=None, help="Baja la prioridad del worker (default: settings; 0 = normal).")
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options["concurrency"] or int(getattr(settings, "SAF_WORKER_CONCURRENCY", 1)))
+        poll = options["poll"] or float(getattr(settings, "SAF_WORKER_POLL_SECONDS", 2))
+        beat_every = float(getattr(settings, "SAF_JOB_HEARTBEAT_SECONDS", 30))
+        worker_id = options["worker_id"] or make_worker_id()
+        nice = options["nice"] if options["nice"] is not None else int(getattr(settings, "SAF_WORKER_NICE", 0) or 0)
+        if lower_process_priority(nice):
+            self.stdout.write(f"Prioridad del worker reducida (nice {nice}).")
+        stop = threading.Event()
+        signals = {"count": 0}
+
+        def on_signal(signum, frame):
+            signals["count"] += 1
+            if signals["count"] > 1:
+                raise KeyboardInterrupt
+            stop.set()
+            self.stdout.write(self.style.WARNING("Deteniendo: se terminan los trabajos en curso (otra senal los devuelve a la cola)."))
+
+        previous = {}
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                previous[sig] = signal.signal(sig, on_signal)
+
+        self.stdout.write(f"Worker SAF {worker_id} | concurrencia: {concurrency}")
+        running = {}
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="saf-job")
+        next_beat = time.monotonic() + beat_every
+        next_sweep = time.monotonic()
+        try:
+            while True:
+                if time.monotonic() >= next_sweep:
+                    requeued = requeue_stale_conversions()
+                    if requeued:
+                        self.stdout.write(f"Conversiones DOCX pendientes vueltas a encolar: {requeued}")
+                    next_sweep = time.monotonic() + job_lease_seconds()
+
+                for future in [f for f in running if f.done()]:
+                    job = running.pop(future)
+                    ok, msg = future.result()
+                    style = self.style.SUCCESS if ok else self.style.WARNING
+                    self.stdout.write(style(f"Trabajo #{job.id} terminado: {msg}"))
+
+                if running and time.monotonic() >= next_beat:
+                    held = heartbeat(worker_id, [job.id for job in running.values()])
+                    if held < len(running):
+                        self.stdout.write(self.style.WARNING("Se perdio el lease de algun trabajo (heartbeat tardio)."))
+                    next_beat = time.monotonic() + beat_every
+
+                queue_empty = False
+                while not stop.is_set() and len(running) < concurrency:
+                    job = claim_job(worker_id)
+                    if job is None:
+                        queue_empty = True
+                        break
+                    self.stdout.write(f"Trabajo #{job.id} ({job.get_kind_display()}) intento {job.attempts}: lote {job.batch}")
+                    running[pool.submit(_run, job, worker_id)] = job
+
+                if not running and (stop.is_set() or (options["once"] and queue_empty)):
+                    break
+                if running:
+                    wait(list(running), timeout=min(poll, beat_every), return_when=FIRST_COMPLETED)
+                else:
+                    stop.wait(poll)
+        except KeyboardInterrupt:
+            released = release_jobs(worker_id, [job.id for job in running.values()])
+            self.stdout.write(self.style.WARNING(f"Interrumpido: {released} trabajo(s) devueltos a la cola."))
+            self.stdout.flush()
+            # Generation threads cannot be cancelled; leave without waiting for them.
+            os._exit(1)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        pool.shutdown(wait=True)
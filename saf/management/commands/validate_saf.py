@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from saf.validator import validate_saf
+
+
+class Command(BaseCommand):
+    help = "Valida la estructura de paquetes SAF (ZIP o carpeta, p. ej. la salida de build_saf.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="ZIP o carpeta SAF a validar.")
+        parser.add_argument("--workers", type=int, default=None, help="Hilos de lectura (default: SAF_PREFLIGHT_WORKERS).")
+        parser.add_argument("--all", action="store_true", help="Lista tambien los items sin problemas.")
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"] or int(getattr(settings, "SAF_PREFLIGHT_WORKERS", 8)))
+        failed = 0
+        for raw in options["paths"]:
+            path = Path(raw)
+            if not path.exists():
+                raise CommandError(f"No existe: {path}")
+            report = validate_saf(path, workers=workers)
+            self.stdout.write(f"== {path}")
+            for line in report.lines(include_ok=options["all"]):
+                self.stdout.write(line)
+            if report.ok:
+                self.stdout.write(self.style.SUCCESS(report.summary()))
+            else:
+                failed += 1
+                self.stdout.write(self.style.ERROR(report.summary()))
+        if failed:
+            raise CommandError(f"{failed} paquete(s) con errores.")
@@ -0,0 +1,218 @@
+"""
+Checksum manifests and delta packages for SAF archives.
+
+A manifest lists every member of a package with its size, CRC-32 and SHA-256. It is kept
+next to the batch ZIP and inside it (``manifest.csv``). Hashing reads every member, so an
+earlier manifest can be passed in with the item folders left untouched since it was
+written: their members keep its SHA-256 when size and CRC-32 (free, from the ZIP
+directory) still match. Every member written in this run is read and hashed, so the
+SHA-256 column that ``aplicar_delta.bat`` checks is always the hash of the actual bytes.
+
+A delta package holds only the items whose manifest entries differ from an earlier
+manifest, plus the top-level files, the full new manifest and ``aplicar_delta.bat``, which
+merges the delta into the unpacked earlier tree on the DSpace server.
+
+Like ``saf.archive`` this module does not import Django.
+"""
+import csv
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from zipfile import ZipFile
+
+from saf.archive import copy_zip_members
+from saf.validator import ZipSource
+
+MANIFEST_NAME = "manifest.csv"
+DELTA_ITEMS_NAME = "delta_items.txt"
+DELTA_REMOVED_NAME = "delta_eliminar.txt"
+DELTA_FILES_NAME = "delta_archivos.txt"
+DELTA_SCRIPT_NAME = "aplicar_delta.bat"
+HASH_BUFFER = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    size: int
+    crc32: int
+    sha256: str
+
+
+def render_manifest(entries: Dict[str, ManifestEntry]) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n")
+    writer.writerow(["path", "size", "crc32", "sha256"])
+    for name in sorted(entries):
+        e = entries[name]
+        writer.writerow([name, e.size, f"{e.crc32:08x}", e.sha256])
+    return buf.getvalue().encode("utf-8")
+
+
+def read_manifest(path: Path) -> Dict[str, ManifestEntry]:
+    entries: Dict[str, ManifestEntry] = {}
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            entries[row["path"]] = ManifestEntry(int(row["size"]), int(row["crc32"], 16), row["sha256"])
+    return entries
+
+
+def _hash_member(source: ZipSource, name: str) -> str:
+    digest = hashlib.sha256()
+    with source.open(name) as f:
+        while True:
+            chunk = f.read(HASH_BUFFER)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def zip_manifest(
+    zip_path: Path,
+    previous: Optional[Dict[str, ManifestEntry]] = None,
+    workers: int = 4,
+    unchanged: Optional[Set[str]] = None,
+) -> Dict[str, ManifestEntry]:
+    """
+    Manifest of every member of ``zip_path`` except ``manifest.csv`` itself. Entries of
+    ``previous`` are only reused for members of the item folders in ``unchanged``.
+    """
+    previous = previous or {}
+    unchanged = unchanged or set()
+    entries: Dict[str, ManifestEntry] = {}
+    to_hash: List[Tuple[str, int, int]] = []
+    with ZipSource(zip_path) as source:
+        for name, info in source.infos.items():
+            if name == MANIFEST_NAME:
+                continue
+            known = previous.get(name)
+            if known and item_prefix(name) in unchanged and known.size == info.file_size and known.crc32 == info.CRC:
+                entries[name] = known
+            else:
+                to_hash.append((name, info.file_size, info.CRC))
+        if to_hash:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="saf-manifest") as pool:
+                hashes = pool.map(lambda m: _hash_member(source, m[0]), to_hash)
+                for (name, size, crc), sha in zip(to_hash, hashes):
+                    entries[name] = ManifestEntry(size, crc, sha)
+    return entries
+
+
+def item_prefix(name: str) -> Optional[str]:
+    parts = name.split("/")
+    return f"{parts[0]}/{parts[1]}/" if len(parts) >= 3 else None
+
+
+def diff_items(current: Dict[str, ManifestEntry], base: Dict[str, ManifestEntry]) -> Tuple[List[str], List[str]]:
+    """``(changed, removed)`` item prefixes: new or different items, and items no longer present."""
+
+    def by_item(entries: Dict[str, ManifestEntry]) -> Dict[str, set]:
+        out: Dict[str, set] = {}
+        for name, e in entries.items():
+            prefix = item_prefix(name)
+            if prefix:
+                out.setdefault(prefix, set()).add((name, e.size, e.sha256))
+        return out
+
+    cur, old = by_item(current), by_item(base)
+    changed = sorted(p for p, members in cur.items() if old.get(p) != members)
+    removed = sorted(p for p in old if p not in cur)
+    return changed, removed
+
+
+def _windows_list(prefixes: List[str]) -> bytes:
+    return "".join(p.rstrip("/").replace("/", "\\") + "\r\n" for p in prefixes).encode("utf-8")
+
+
+def render_apply_delta_bat() -> str:
+    lines = [
+        "@echo off",
+        "setlocal EnableExtensions EnableDelayedExpansion",
+        "rem Aplica este paquete delta sobre la carpeta SAF ya descomprimida del lote anterior.",
+        "rem Uso: aplicar_delta.bat \"C:\\ruta\\SAF_anterior\"",
+        'set "DELTA_DIR=%~dp0"',
+        'set "TARGET=%~1"',
+        'if "%TARGET%"=="" (',
+        '  echo Uso: aplicar_delta.bat "C:\\ruta\\SAF_anterior"',
+        "  exit /b 2",
+        ")",
+        'if not exist "%TARGET%\\" (',
+        '  echo ERROR: no existe la carpeta "%TARGET%"',
+        "  exit /b 2",
+        ")",
+        "",
+        "rem 1) Items eliminados o reemplazados: se borra la carpeta anterior.",
+        f'for /f "usebackq delims=" %%D in ("%DELTA_DIR%{DELTA_REMOVED_NAME}") do (',
+        '  if exist "%TARGET%\\%%D\\" rmdir /s /q "%TARGET%\\%%D"',
+        ")",
+        f'for /f "usebackq delims=" %%D in ("%DELTA_DIR%{DELTA_ITEMS_NAME}") do (',
+        '  if exist "%TARGET%\\%%D\\" rmdir /s /q "%TARGET%\\%%D"',
+        '  robocopy "%DELTA_DIR%%%D" "%TARGET%\\%%D" /E /NFL /NDL /NJH /NJS /NP >nul',
+        "  if errorlevel 8 (",
+        "    echo ERROR: no se pudo copiar %%D",
+        "    exit /b 1",
+        "  )",
+        "  echo [ITEM] %%D",
+        ")",
+        "",
+        "rem 2) Archivos generales (reporte, scripts, manifest).",
+        f'for /f "usebackq delims=" %%F in ("%DELTA_DIR%{DELTA_FILES_NAME}") do (',
+        '  for %%P in ("%TARGET%\\%%F") do if not exist "%%~dpP" mkdir "%%~dpP"',
+        '  copy /y "%DELTA_DIR%%%F" "%TARGET%\\%%F" >nul',
+        ")",
+        "",
+        "rem 3) Verificacion: cada archivo del manifest debe existir con el mismo SHA-256.",
+        'set "BAD=0"',
+        f'for /f "usebackq skip=1 tokens=1,4 delims=," %%A in ("%TARGET%\\{MANIFEST_NAME}") do (',
+        '  set "REL=%%A"',
+        '  set "REL=!REL:/=\\!"',
+        '  set "HASH="',
+        '  if exist "%TARGET%\\!REL!" (',
+        '    for /f "skip=1 delims=" %%H in (\'certutil -hashfile "%TARGET%\\!REL!" SHA256 ^| findstr /v /c:"CertUtil"\') do if not defined HASH set "HASH=%%H"',
+        '    set "HASH=!HASH: =!"',
+        "  )",
+        '  if /i not "!HASH!"=="%%B" (',
+        "    echo [ERROR] !REL!",
+        '    set /a BAD+=1',
+        "  )",
+        ")",
+        'if not "%BAD%"=="0" (',
+        "  echo ERROR: %BAD% archivo(s) no coinciden con el manifest.",
+        "  exit /b 1",
+        ")",
+        "echo OK: delta aplicado y verificado.",
+        "exit /b 0",
+    ]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def build_delta_zip(
+    zip_path: Path,
+    dst: Path,
+    current: Dict[str, ManifestEntry],
+    base: Dict[str, ManifestEntry],
+    policy: str = "auto",
+    level: int = 6,
+) -> Tuple[List[str], List[str]]:
+    """
+    Write the delta of ``zip_path`` (manifest ``current``) against ``base`` to ``dst``.
+    Members are copied raw from the package; returns ``(changed, removed)`` item prefixes.
+    """
+    changed, removed = diff_items(current, base)
+    wanted = set(changed)
+    with ZipFile(zip_path, "r") as zf:
+        names = [i.filename for i in zf.infolist() if not i.is_dir() and i.filename != MANIFEST_NAME]
+    item_names = [n for n in names if item_prefix(n) in wanted]
+    general = [n for n in names if item_prefix(n) is None]
+    extra = [
+        (MANIFEST_NAME, render_manifest(current)),
+        (DELTA_ITEMS_NAME, _windows_list(changed)),
+        (DELTA_REMOVED_NAME, _windows_list(removed)),
+        (DELTA_FILES_NAME, _windows_list(general + [MANIFEST_NAME])),
+        (DELTA_SCRIPT_NAME, render_apply_delta_bat().encode("ascii")),
+    ]
+    copy_zip_members(zip_path, dst, [(n, n) for n in item_names + general], extra, policy=policy, level=level)
+    return changed, removed
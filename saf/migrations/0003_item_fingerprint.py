@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0002_batch_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='safbatchitem',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0003_item_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SafJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('GENERATE', 'Generar SAF')], default='GENERATE', max_length=20)),
+                ('status', models.CharField(choices=[('QUEUED', 'En cola'), ('RUNNING', 'En proceso'), ('DONE', 'Completado'), ('FAILED', 'Fallido')], default='QUEUED', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('worker_id', models.CharField(blank=True, max_length=120)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='saf.safbatch')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='saf_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='saf_safjob_status_3ad8c6_idx')],
+            },
+        ),
+    ]
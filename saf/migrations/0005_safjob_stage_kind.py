@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0004_safjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='safjob',
+            name='kind',
+            field=models.CharField(choices=[('GENERATE', 'Generar SAF'), ('STAGE', 'Preparar items aprobados')], default='GENERATE', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0005_safjob_stage_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='safbatch',
+            name='export_code',
+            field=models.CharField(blank=True, db_index=True, max_length=40),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0008_thesisfile_conversion'),
+        ('saf', '0006_batch_export_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SafIngestItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500)),
+                ('item_path', models.CharField(max_length=255)),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_items', to='registry.thesisrecord')),
+            ],
+            options={
+                'ordering': ['source', 'item_path'],
+                'unique_together': {('source', 'item_path')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0007_safingestitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='safbatch',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='safbatchitem',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
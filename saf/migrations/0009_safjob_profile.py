@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0008_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='safjob',
+            name='profile',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0008_thesisfile_conversion'),
+        ('saf', '0009_safjob_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='safjob',
+            name='thesis_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='saf_jobs', to='registry.thesisfile'),
+        ),
+        migrations.AlterField(
+            model_name='safjob',
+            name='kind',
+            field=models.CharField(choices=[('GENERATE', 'Generar SAF'), ('STAGE', 'Preparar items aprobados'), ('CONVERT', 'Convertir DOCX a PDF')], default='GENERATE', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('saf', '0010_safjob_convert'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='safjob',
+            name='kind',
+            field=models.CharField(choices=[('GENERATE', 'Generar SAF'), ('STAGE', 'Preparar items aprobados'), ('CONVERT', 'Convertir DOCX a PDF'), ('PREFLIGHT', 'Verificacion previa completa')], default='GENERATE', max_length=20),
+        ),
+    ]
@@ -25,12 +25,16 @@ class SafBatch(models.Model):
         related_name="batches",
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_CREATED)
+    # Set on the parts of a bulk re-export (saf.export): records keep their status and handle.
+    export_code = models.CharField(max_length=40, blank=True, db_index=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="saf_batches")
     generated_at = models.DateTimeField(null=True, blank=True)
     output_path = models.CharField(max_length=500, blank=True)
     report_path = models.CharField(max_length=500, blank=True)
     zip_path = models.CharField(max_length=500, blank=True)
     log_text = models.TextField(blank=True)
+    # Last generation: {"stages": batch stages, "items": item stages summed} (see saf.timing).
+    timings = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -56,6 +60,10 @@ class SafBatchItem(models.Model):
     item_folder_name = models.CharField(max_length=120, blank=True)
     result = models.CharField(max_length=20, choices=RESULT_CHOICES, default=RESULT_PENDING)
     detail = models.TextField(blank=True)
+    # sha256 of everything the item output depends on; unchanged OK items are reused on regeneration.
+    fingerprint = models.CharField(max_length=64, blank=True)
+    # Seconds and bytes per stage of the last run that processed the item (see saf.timing).
+    timings = models.JSONField(default=dict, blank=True)
 
     class Meta:
         unique_together = [("batch", "record")]
@@ -63,3 +71,85 @@ class SafBatchItem(models.Model):
 
     def __str__(self):
         return f"{self.batch.batch_code} - {self.record.nro:03d}"
+
+
+class SafJob(models.Model):
+    """Durable queue entry processed by ``manage.py saf_worker`` (leases renewed by heartbeat)."""
+
+    KIND_GENERATE = "GENERATE"
+    KIND_STAGE = "STAGE"
+    KIND_CONVERT = "CONVERT"
+    KIND_PREFLIGHT = "PREFLIGHT"
+    KIND_CHOICES = [
+        (KIND_GENERATE, "Generar SAF"),
+        (KIND_STAGE, "Preparar items aprobados"),
+        (KIND_CONVERT, "Convertir DOCX a PDF"),
+        (KIND_PREFLIGHT, "Verificacion previa completa"),
+    ]
+
+    STATUS_QUEUED = "QUEUED"
+    STATUS_RUNNING = "RUNNING"
+    STATUS_DONE = "DONE"
+    STATUS_FAILED = "FAILED"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "En cola"),
+        (STATUS_RUNNING, "En proceso"),
+        (STATUS_DONE, "Completado"),
+        (STATUS_FAILED, "Fallido"),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_GENERATE)
+    batch = models.ForeignKey(SafBatch, null=True, blank=True, on_delete=models.CASCADE, related_name="jobs")
+    # CONVERT jobs: the uploaded thesis DOCX to convert (no batch).
+    thesis_file = models.ForeignKey(
+        "registry.ThesisFile",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="saf_jobs",
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="saf_jobs",
+    )
+    # Sample stacks and tracemalloc while the job runs (saf.profiler); off = no profiling code runs.
+    profile = models.BooleanField(default=False)
+    attempts = models.PositiveIntegerField(default=0)
+    worker_id = models.CharField(max_length=120, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.status})"
+
+
+class SafIngestItem(models.Model):
+    """One item folder loaded by ``manage.py saf_ingest``; re-running an ingest skips it."""
+
+    source = models.CharField(max_length=500)
+    item_path = models.CharField(max_length=255)
+    record = models.ForeignKey(ThesisRecord, on_delete=models.CASCADE, related_name="ingest_items")
+    # sha256 of the item's primary bitstream (tesis.pdf).
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [("source", "item_path")]
+        ordering = ["source", "item_path"]
+
+    def __str__(self):
+        return f"{self.source}:{self.item_path}"
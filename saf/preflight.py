@@ -0,0 +1,293 @@
+"""
+Preflight check run before SAF generation (and on demand from the group page).
+
+Every ``ThesisFile`` of the records is checked on a thread pool: the file must exist, its
+size must match ``size_bytes`` and, optionally, its SHA-256 must match the stored hash.
+When some thesis still needs a DOCX -> PDF conversion, soffice is asked for its version.
+Finally the output size is estimated and compared with the free space of
+``SAF_OUTPUT_ROOT``, and the generation time is estimated from past batches (``saf.estimate``). All problems are reported together instead of failing item by item
+halfway through a generation.
+
+Problems on files that go into the package are item errors (the item is not generated);
+soffice or disk problems are global and stop the generation before anything is written.
+
+The web process runs it with ``probe_soffice=False`` and without hashing (stat and disk
+only): it reports the last soffice probe made by ``saf_worker`` instead of starting soffice.
+The full check runs in the worker as a ``PREFLIGHT`` job.
+"""
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from registry.models import ThesisFile, ThesisRecord
+from registry.services import compute_sha256
+from saf.estimate import GenerationEstimate, estimate_generation, format_seconds
+from saf.services import (
+    _pick_thesis_file,
+    _record_files,
+    download_mode,
+    get_cached_docx_pdf,
+    get_conversion_pool,
+    resolve_soffice_binary,
+)
+
+# dublin_core.xml, metadata_*.xml, contents, license and archive headers of one item.
+ITEM_OVERHEAD_BYTES = 16 * 1024
+DISK_MARGIN = 1.1
+
+# Last soffice probe of a worker, shown by the web process (which never starts soffice).
+SOFFICE_PROBE_KEY = "saf:preflight:soffice"
+
+LEVEL_ERROR = "error"
+LEVEL_WARNING = "warning"
+
+
+@dataclass
+class PreflightIssue:
+    message: str
+    level: str = LEVEL_ERROR
+    record_id: Optional[int] = None
+    nro: Optional[int] = None
+
+    def as_text(self) -> str:
+        tag = "ERROR" if self.level == LEVEL_ERROR else "AVISO"
+        if self.nro is None:
+            return f"[{tag}] {self.message}"
+        return f"[{tag}] {self.nro:03d} - {self.message}"
+
+
+@dataclass
+class PreflightReport:
+    records: int = 0
+    files: int = 0
+    hashed: int = 0
+    estimated_bytes: int = 0
+    free_bytes: Optional[int] = None
+    soffice: str = ""
+    seconds: float = 0.0
+    issues: List[PreflightIssue] = field(default_factory=list)
+    estimate: Optional[GenerationEstimate] = None
+
+    @property
+    def errors(self) -> List[PreflightIssue]:
+        return [i for i in self.issues if i.level == LEVEL_ERROR]
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def blocking(self) -> List[PreflightIssue]:
+        """Errors not tied to a record (soffice, disk): nothing can be generated."""
+        return [i for i in self.errors if i.record_id is None]
+
+    def record_errors(self) -> Dict[int, str]:
+        out: Dict[int, List[str]] = {}
+        for issue in self.errors:
+            if issue.record_id is not None:
+                out.setdefault(issue.record_id, []).append(issue.message)
+        return {record_id: "; ".join(msgs) for record_id, msgs in out.items()}
+
+    def summary(self) -> str:
+        free = "?" if self.free_bytes is None else f"{self.free_bytes / 1048576:.1f}"
+        duration = f"~{format_seconds(self.estimate.seconds)} de generación, " if self.estimate else ""
+        head = (
+            f"Verificación previa: {self.records} registro(s), {self.files} archivo(s)"
+            f"{f' ({self.hashed} con SHA-256)' if self.hashed else ''}, "
+            f"{self.estimated_bytes / 1048576:.1f} MB estimados, {duration}{free} MB libres ({self.seconds:.1f} s)."
+        )
+        lines = [head] + [issue.as_text() for issue in self.issues]
+        if self.ok:
+            lines.append("Sin errores." if not self.issues else "Sin errores (solo avisos).")
+        return "\n".join(lines)
+
+    def as_dict(self) -> dict:
+        return {
+            "ok": self.ok,
+            "records": self.records,
+            "files": self.files,
+            "hashed": self.hashed,
+            "estimated_bytes": self.estimated_bytes,
+            "free_bytes": self.free_bytes,
+            "soffice": self.soffice,
+            "seconds": round(self.seconds, 3),
+            "estimate": self.estimate.as_dict() if self.estimate else None,
+            "issues": [
+                {"level": i.level, "nro": i.nro, "record_id": i.record_id, "message": i.message} for i in self.issues
+            ],
+            "message": self.summary(),
+        }
+
+
+@dataclass
+class _FileCheck:
+    record_id: int
+    nro: int
+    path: Path
+    name: str
+    size_bytes: int
+    sha256: str
+    included: bool
+
+
+def _check_file(check: _FileCheck, verify_hash: bool) -> Tuple[Optional[str], bool]:
+    """Returns ``(problem, hashed)`` for one file; runs on the pool (no DB access)."""
+    try:
+        size = check.path.stat().st_size
+    except OSError:
+        return f"No existe archivo: {check.name}", False
+    if check.size_bytes and size != check.size_bytes:
+        return f"Tamaño distinto en {check.name}: {size} bytes en disco, {check.size_bytes} registrados.", False
+    if verify_hash and check.sha256:
+        try:
+            actual = compute_sha256(str(check.path))
+        except OSError as exc:
+            return f"No se pudo leer {check.name}: {exc}", False
+        if actual != check.sha256:
+            return f"SHA-256 distinto en {check.name} (archivo modificado fuera de la plataforma).", True
+        return None, True
+    return None, False
+
+
+def _check_soffice() -> Tuple[Optional[str], str]:
+    pool = get_conversion_pool()
+    if not pool:
+        return "Hay tesis DOCX sin PDF convertido y no se encontró LibreOffice (soffice).", ""
+    ok, output = pool.probe(timeout=int(getattr(settings, "SOFFICE_TIMEOUT", 180)))
+    result = (None, output) if ok else (f"LibreOffice (soffice) no responde: {output}", "")
+    cache.set(SOFFICE_PROBE_KEY, result, None)
+    return result
+
+
+def _last_soffice_probe() -> Tuple[Optional[PreflightIssue], str]:
+    if not resolve_soffice_binary():
+        return PreflightIssue("Hay tesis DOCX sin PDF convertido y no se encontró LibreOffice (soffice)."), ""
+    last = cache.get(SOFFICE_PROBE_KEY)
+    if last is None:
+        return PreflightIssue("LibreOffice aún no fue verificado por saf_worker.", level=LEVEL_WARNING), ""
+    problem, output = last
+    return (PreflightIssue(problem) if problem else None), output
+
+
+def _free_bytes(root: Path) -> Optional[int]:
+    # SAF_OUTPUT_ROOT may not exist yet: measure the closest existing parent.
+    for candidate in [root, *root.parents]:
+        if candidate.exists():
+            try:
+                return shutil.disk_usage(candidate).free
+            except OSError:
+                return None
+    return None
+
+
+def _estimate_output_bytes(package_bytes: int, convert_bytes: int, items: int) -> int:
+    archive = 0 if download_mode() == "stream" else package_bytes + items * ITEM_OVERHEAD_BYTES
+    staging = 0
+    if getattr(settings, "SAF_KEEP_STAGING", False):
+        # Hardlinks (auto) cost no space; clone/copy may duplicate every source.
+        if getattr(settings, "SAF_STAGING_LINK_MODE", "auto") != "auto":
+            staging = package_bytes
+        staging += items * ITEM_OVERHEAD_BYTES
+    # DOCX conversions land in the work folder; the PDF size is taken as the DOCX size.
+    return int((archive + staging + convert_bytes * 2) * DISK_MARGIN)
+
+
+def run_preflight(
+    records: Iterable[ThesisRecord],
+    verify_hash: Optional[bool] = None,
+    workers: Optional[int] = None,
+    probe_soffice: bool = True,
+) -> PreflightReport:
+    """
+    Check ``records`` (with ``files`` prefetched) before generating their SAF.
+
+    ``verify_hash`` defaults to ``SAF_PREFLIGHT_SHA256``; hashing reads every byte, so it is
+    the slow part and is spread over ``SAF_PREFLIGHT_WORKERS`` threads. Without
+    ``probe_soffice`` the last probe of a worker is reported instead of running soffice.
+    """
+    started = time.monotonic()
+    if verify_hash is None:
+        verify_hash = bool(getattr(settings, "SAF_PREFLIGHT_SHA256", False))
+    workers = max(1, int(workers or getattr(settings, "SAF_PREFLIGHT_WORKERS", 8) or 1))
+    report = PreflightReport()
+
+    checks: List[_FileCheck] = []
+    package_bytes = 0
+    convert_bytes = 0
+    # record_id -> (bytes that go into its item, needs a DOCX conversion): input of the time estimate.
+    packages: Dict[int, Tuple[int, bool]] = {}
+    for record in records:
+        report.records += 1
+        thesis = _pick_thesis_file(record)
+        if not thesis:
+            report.issues.append(
+                PreflightIssue("No existe tesis en PDF o DOCX.", record_id=record.id, nro=record.nro)
+            )
+        included = {f.id for f in _record_files(record, ThesisFile.TYPE_FORMULARIO)}
+        included |= {f.id for f in _record_files(record, ThesisFile.TYPE_TURNITIN)}
+        needs_convert = False
+        if thesis:
+            included.add(thesis.id)
+            if thesis.file_type == ThesisFile.TYPE_TESIS_DOCX and not thesis.converted_pdf_path:
+                if not (thesis.sha256 and get_cached_docx_pdf(Path(thesis.file.path), thesis.sha256)):
+                    convert_bytes += thesis.size_bytes
+                    needs_convert = True
+        record_bytes = 0
+        for f in record.files.all():
+            if not f.file:
+                continue
+            if f.id in included:
+                record_bytes += f.size_bytes
+            checks.append(
+                _FileCheck(
+                    record_id=record.id,
+                    nro=record.nro,
+                    path=Path(f.file.path),
+                    name=f"{f.original_name} ({f.get_file_type_display()})",
+                    size_bytes=f.size_bytes,
+                    sha256=f.sha256,
+                    included=f.id in included,
+                )
+            )
+        package_bytes += record_bytes
+        packages[record.id] = (record_bytes, needs_convert)
+    report.files = len(checks)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="saf-preflight") as pool:
+        soffice_future = pool.submit(_check_soffice) if convert_bytes and probe_soffice else None
+        results = pool.map(lambda c: _check_file(c, verify_hash), checks)
+        for check, (problem, hashed) in zip(checks, results):
+            report.hashed += int(hashed)
+            if problem:
+                # Files outside the package (older versions, other types) only warn.
+                level = LEVEL_ERROR if check.included else LEVEL_WARNING
+                report.issues.append(PreflightIssue(problem, level=level, record_id=check.record_id, nro=check.nro))
+        if soffice_future is not None:
+            problem, report.soffice = soffice_future.result()
+            if problem:
+                report.issues.append(PreflightIssue(problem))
+    if convert_bytes and not probe_soffice:
+        issue, report.soffice = _last_soffice_probe()
+        if issue:
+            report.issues.append(issue)
+
+    saf_root = Path(settings.SAF_OUTPUT_ROOT)
+    report.estimated_bytes = _estimate_output_bytes(package_bytes, convert_bytes, report.records)
+    report.free_bytes = _free_bytes(saf_root)
+    report.estimate = estimate_generation(packages, report.estimated_bytes)
+    if report.free_bytes is not None and report.estimated_bytes > report.free_bytes:
+        report.issues.append(
+            PreflightIssue(
+                f"Espacio insuficiente en {saf_root}: se estiman {report.estimated_bytes / 1048576:.1f} MB "
+                f"y hay {report.free_bytes / 1048576:.1f} MB libres."
+            )
+        )
+    report.issues.sort(key=lambda i: (i.nro is not None, i.nro or 0))
+    report.seconds = time.monotonic() - started
+    return report
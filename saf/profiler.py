@@ -0,0 +1,118 @@
+"""
+Opt-in sampling profiler for SAF jobs (``SafJob.profile``).
+
+While a profiled job runs, a daemon thread samples the stack of the job thread and of the
+pool threads it starts (``saf-*``) every ``interval`` seconds and counts identical stacks.
+The result is written in the collapsed-stack format (``frame;frame;frame count``) that
+``flamegraph.pl``, speedscope or inferno read directly. ``tracemalloc`` runs for the same
+span; its peak and the top allocation sites go to a text report. Both cover the whole
+process, so profile with ``saf_worker --concurrency 1`` to see one job alone.
+
+Nothing here is imported or started for jobs without the switch. The module is Django-free.
+"""
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+THREAD_PREFIXES = ("saf-",)
+# Other jobs of a ``saf_worker --concurrency N`` process, and the sampler itself.
+SKIP_PREFIXES = ("saf-job", "saf-profiler")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler(threading.Thread):
+    """Counts collapsed stacks of ``target`` (a thread ident) and of threads named ``THREAD_PREFIXES*``."""
+
+    def __init__(self, target: int, interval: float = 0.01):
+        super().__init__(name="saf-profiler", daemon=True)
+        self.target = target
+        self.interval = max(0.001, interval)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def _threads(self) -> dict:
+        names = {self.target: "job"}
+        for t in threading.enumerate():
+            if t.ident and t.name.startswith(THREAD_PREFIXES) and not t.name.startswith(SKIP_PREFIXES):
+                names[t.ident] = t.name.rsplit("_", 1)[0]
+        return names
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = self._threads()
+            frames = sys._current_frames()
+            self.samples += 1
+            for ident, name in names.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[f"{name};{_collapse(frame)}"] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+def memory_report(snapshot: tracemalloc.Snapshot, peak: int, current: int, seconds: float, top: int = 30) -> str:
+    lines = [
+        f"Duracion: {seconds:.1f} s",
+        f"Pico de memoria (tracemalloc): {peak / 1048576:.1f} MB",
+        f"Memoria trazada al terminar: {current / 1048576:.1f} MB",
+        "",
+        f"Top {top} sitios de asignacion (memoria viva al terminar):",
+    ]
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    for stat in snapshot.statistics("traceback")[:top]:
+        # Allocation site first, then up to three callers.
+        sites = " <- ".join(f"{Path(f.filename).name}:{f.lineno}" for f in list(stat.traceback)[:4])
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} bloque(s)  {sites}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profile_run(folded_path: Path, memory_path: Path, interval: float = 0.01, frames: int = 8) -> Iterator[StackSampler]:
+    """Profile the calling thread (and its ``saf-*`` pools) until the block exits, then write both files."""
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(frames)
+    tracemalloc.reset_peak()
+    sampler = StackSampler(threading.get_ident(), interval)
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        folded_path.parent.mkdir(parents=True, exist_ok=True)
+        folded_path.write_text(sampler.folded(), encoding="utf-8")
+        memory_path.write_text(
+            f"Muestras de pila: {sampler.samples} cada {sampler.interval * 1000:.0f} ms\n"
+            + memory_report(snapshot, peak, current, seconds),
+            encoding="utf-8",
+        )
+
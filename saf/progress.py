@@ -0,0 +1,128 @@
+"""
+Generation progress for SAF batches.
+
+Progress lives in the Django cache (updated on every item, read by the progress view) and
+is also appended to the batch event log (``saf.events``) together with per-item stage
+changes for the SSE endpoint. The log is shared between ``saf_worker`` and the web process,
+so ``get_progress`` falls back to its last progress event when the cache is not shared.
+
+Item/record results are buffered and written with ``bulk_update`` when ``max_buffer`` items
+are pending (one chunk of the generation) and once at the end. The number of DB round trips
+of a generation depends on neither its duration nor, within a chunk, the number of items;
+live progress never waits for a flush since it comes from the cache and the event log.
+With an estimate (``saf.estimate``) the published data also carries ``estimate`` and a live
+``eta_seconds``.
+"""
+from typing import List, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from registry.models import ThesisRecord
+from saf.events import bus
+from saf.models import SafBatch, SafBatchItem
+
+PROGRESS_TTL = 6 * 60 * 60
+ITEM_FIELDS = ["item_folder_name", "result", "detail", "fingerprint", "timings"]
+
+
+def progress_key(batch_id: int) -> str:
+    return f"saf:progress:{batch_id}"
+
+
+def get_progress(batch_id: int) -> Optional[dict]:
+    progress = cache.get(progress_key(batch_id))
+    if progress is None:
+        event = bus.last(batch_id, "progress")
+        progress = {k: v for k, v in event.items() if k != "type"} if event else None
+    return progress
+
+
+def set_progress(batch_id: int, data: dict):
+    cache.set(progress_key(batch_id), data, PROGRESS_TTL)
+
+
+def clear_progress(batch_id: int):
+    """A new generation was queued: drop the previous run's snapshot and event log."""
+    cache.delete(progress_key(batch_id))
+    bus.clear(batch_id)
+
+
+def fail_progress(batch_id: int, message: str):
+    """The job ended without finishing the batch: tell the open streams instead of leaving them waiting."""
+    data = get_progress(batch_id) or {"total": 0, "done": 0, "percent": 0, "zip_ready": False}
+    data = {**data, "status": SafBatch.STATUS_FAILED, "message": message}
+    data.pop("eta_seconds", None)
+    cache.delete(progress_key(batch_id))
+    bus.publish(batch_id, {"type": "progress", **data})
+
+
+class BatchProgress:
+    def __init__(self, batch: SafBatch, total: int, max_buffer: int = 0):
+        self.batch = batch
+        self.total = total
+        self.done = 0
+        self.max_buffer = max_buffer
+        self._items: List[SafBatchItem] = []
+        self._records: List[ThesisRecord] = []
+        self.estimate: Optional[dict] = None
+        self.eta = None
+        self.publish("Iniciando generación SAF...")
+
+    def set_estimate(self, estimate):
+        """Start the live ETA from a ``saf.estimate.GenerationEstimate``."""
+        from saf.estimate import EtaTracker
+
+        self.estimate = estimate.as_dict()
+        self.eta = EtaTracker(dict(estimate.costs), estimate.finish_seconds, estimate.throughput.item_seconds)
+
+    def publish(self, message: str, status: str = SafBatch.STATUS_RUNNING, zip_ready: bool = False):
+        percent = int((self.done * 100) / self.total) if self.total else 0
+        data = {
+            "status": status,
+            "total": self.total,
+            "done": self.done,
+            "percent": percent,
+            "zip_ready": zip_ready,
+            "message": message,
+        }
+        if self.estimate is not None:
+            data["estimate"] = self.estimate
+            data["eta_seconds"] = 0 if status != SafBatch.STATUS_RUNNING else round(self.eta.eta_seconds(), 1)
+        set_progress(self.batch.id, data)
+        bus.publish(self.batch.id, {"type": "progress", **data})
+
+    def stage(self, nro: int, stage: str):
+        """Called from item workers: no DB access, only the event log."""
+        bus.publish(self.batch.id, {"type": "item", "nro": nro, "result": SafBatchItem.RESULT_PENDING, "stage": stage})
+
+    def item_done(self, item: SafBatchItem, record: Optional[ThesisRecord], message: str, stage: str = "listo"):
+        """Queue ``item`` (and ``record`` status) for the next flush and publish the new counters."""
+        self.done += 1
+        self._items.append(item)
+        if self.eta is not None:
+            self.eta.item_done(item.record_id, reused=stage == "reutilizado")
+        bus.publish(self.batch.id, {"type": "item", "nro": item.record.nro, "result": item.result, "stage": stage})
+        if record is not None:
+            record.updated_at = timezone.now()
+            self._records.append(record)
+        self.publish(message)
+        if self.max_buffer and len(self._items) >= self.max_buffer:
+            self.flush(message)
+
+    def flush(self, message: str = ""):
+        with transaction.atomic():
+            if self._items:
+                SafBatchItem.objects.bulk_update(self._items, ITEM_FIELDS)
+            if self._records:
+                ThesisRecord.objects.bulk_update(self._records, ["status", "updated_at"])
+            if message:
+                self.batch.log_text = message
+                self.batch.save(update_fields=["log_text", "updated_at"])
+        self._items = []
+        self._records = []
+
+    def finish(self):
+        """Write everything still buffered; the caller saves the final batch state."""
+        self.flush()
@@ -0,0 +1,108 @@
+"""
+Process-wide limits for CPU- and disk-heavy SAF work.
+
+Every batch that runs in a process (``saf_worker --concurrency N``, exports, ingest) asks
+the same ``ResourceScheduler`` for a slot before converting a DOCX (``convert``), writing
+members into an archive (``compress``) or copying files to disk (``copy``). Each resource
+has a global limit (0 = unlimited), so several generations share the CPU instead of each
+starting its own soffice and deflate threads.
+
+Waiting work is queued per owner (the batch a thread is working for, see ``owner``) and
+freed slots are handed out round-robin between owners: a large group does not hold back a
+small one queued after it. The module is Django-free.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Hashable, Iterator, Optional
+
+RESOURCES = ("convert", "compress", "copy")
+BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+
+
+def lower_process_priority(nice: int) -> bool:
+    """Lower the priority of the current process (``saf_worker``) so the web server stays responsive."""
+    if nice <= 0:
+        return False
+    try:
+        if os.name == "nt":
+            import ctypes
+
+            kernel32 = ctypes.windll.kernel32
+            return bool(kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS))
+        os.nice(nice)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class _Resource:
+    def __init__(self, limit: int):
+        self.limit = max(0, int(limit or 0))
+        self.running = 0
+        self.served = 0
+        self.waiting: "OrderedDict[Hashable, Deque[threading.Event]]" = OrderedDict()
+
+    def waiters(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+
+class ResourceScheduler:
+    def __init__(self, limits: Dict[str, int]):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._resources = {name: _Resource(limits.get(name, 0)) for name in set(RESOURCES) | set(limits)}
+
+    @contextmanager
+    def owner(self, key: Optional[Hashable]) -> Iterator[None]:
+        """Attribute the slots taken by this thread to ``key`` (e.g. a batch id) for fair ordering."""
+        previous = getattr(self._local, "owner", None)
+        self._local.owner = key
+        try:
+            yield
+        finally:
+            self._local.owner = previous
+
+    def acquire(self, name: str):
+        resource = self._resources[name]
+        with self._lock:
+            if not resource.limit or (resource.running < resource.limit and not resource.waiting):
+                resource.running += 1
+                resource.served += 1
+                return
+            event = threading.Event()
+            resource.waiting.setdefault(getattr(self._local, "owner", None), deque()).append(event)
+        # The releasing thread hands its slot over (``running`` stays the same).
+        event.wait()
+
+    def release(self, name: str):
+        resource = self._resources[name]
+        with self._lock:
+            if not resource.waiting:
+                resource.running -= 1
+                return
+            # Round-robin: the owner served now goes to the back of the line.
+            owner, queue = next(iter(resource.waiting.items()))
+            event = queue.popleft()
+            if queue:
+                resource.waiting.move_to_end(owner)
+            else:
+                del resource.waiting[owner]
+            resource.served += 1
+        event.set()
+
+    @contextmanager
+    def slot(self, name: str) -> Iterator[None]:
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                name: {"limit": r.limit, "running": r.running, "waiting": r.waiters(), "served": r.served}
+                for name, r in sorted(self._resources.items())
+            }
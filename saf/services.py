@@ -1,42 +1,71 @@
+import atexit
 import csv
+import hashlib
+import io
+import multiprocessing
+import os
 import re
 import shutil
-import subprocess
-import unicodedata
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple
-from zipfile import ZIP_DEFLATED, ZipFile
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+from zipfile import BadZipFile, ZipFile
 
 from django.conf import settings
 from django.utils import timezone
 
 from appconfig.models import LicenseVersion
-from registry.models import ThesisFile, ThesisRecord
+from registry.models import ThesisFile, ThesisRecord, thesis_file_converted_upload_to
+from registry.services import compute_sha256
+from saf.archive import (
+    ZipArchiveWriter,
+    archive_format_of,
+    archive_member_names,
+    archive_suffix,
+    copy_zip_members,
+    open_archive,
+    rewrite_archive_members,
+    zip_member_sizes,
+)
+from saf.conversion import ConversionPool, ProcessLimits
+from saf.conversion_cache import ConversionCache
+from saf.crosswalk import (
+    CAREER_FIELDS,
+    Crosswalk,
+    MetadataEntry,
+    RenderCache,
+    RenderedMetadata,
+    compile_crosswalk,
+    metadata_filename,
+    norm_text,
+    render_metadata_files,
+)
+from saf.estimate import estimate_generation
+from saf.manifest import (
+    MANIFEST_NAME,
+    ManifestEntry,
+    build_delta_zip,
+    item_prefix,
+    read_manifest,
+    render_manifest,
+    zip_manifest,
+)
 from saf.models import SafBatch, SafBatchItem
+from saf.progress import ITEM_FIELDS, BatchProgress
+from saf.scheduler import ResourceScheduler
+from saf.timing import TIMING_HEADER, StageTimer, timing_columns
+from saf.validator import validate_saf
+from saf.writers import SafDirectoryWriter, SafMember, SafMultiWriter, member_size, place_file
+from saf.zipstream import ZipLayout
 
 SOFFICE_FALLBACK_PATHS = [
     r"C:\Program Files\LibreOffice\program\soffice.exe",
     r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
 ]
-DEFAULT_METADATA_LANGUAGE = "es"
-LANGUAGE_EXCLUDED_QUALIFIERS = {"dni", "uri", "date"}
-FORCED_LANGUAGE_FIELDS = {
-    ("dc", "rights", "uri"),
-    ("renati", "advisor", "orcid"),
-    ("renati", "type", ""),
-    ("renati", "level", ""),
-    ("dc", "subject", "ocde"),
-}
-URI_VALUE_PREFIXES = ("http://", "https://", "hdl:")
-MetadataEntry = Tuple[str, str, str, str, str]
-
-
-def norm_text(s: str) -> str:
-    s = (s or "").strip().upper()
-    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-    s = re.sub(r"\s+", " ", s)
-    return s
 
 
 def resolve_soffice_binary() -> Optional[str]:
@@ -58,156 +87,224 @@ def resolve_soffice_binary() -> Optional[str]:
     return None
 
 
+_conversion_pool: Optional[ConversionPool] = None
+_conversion_pool_lock = threading.Lock()
+_scheduler: Optional[ResourceScheduler] = None
+
+
+def get_scheduler() -> ResourceScheduler:
+    """Process-wide limits on conversions, archive writes and copies, shared by every batch (saf.scheduler)."""
+    global _scheduler
+    with _conversion_pool_lock:
+        if _scheduler is None:
+            _scheduler = ResourceScheduler(
+                {
+                    "convert": int(getattr(settings, "SAF_MAX_CONVERSIONS", 0) or 0),
+                    "compress": int(getattr(settings, "SAF_MAX_COMPRESSIONS", 0) or 0),
+                    "copy": int(getattr(settings, "SAF_MAX_COPIES", 0) or 0),
+                }
+            )
+        return _scheduler
+
+
+def soffice_limits() -> ProcessLimits:
+    cpus = str(getattr(settings, "SOFFICE_CPU_AFFINITY", "") or "")
+    return ProcessLimits(
+        nice=int(getattr(settings, "SOFFICE_NICE", 0) or 0),
+        ionice=str(getattr(settings, "SOFFICE_IONICE", "") or ""),
+        cpus=tuple(int(c) for c in cpus.replace(" ", "").split(",") if c),
+        memory_mb=int(getattr(settings, "SOFFICE_MEMORY_MB", 0) or 0),
+    )
+
+
+def get_conversion_pool() -> Optional[ConversionPool]:
+    """Process-wide pool of warm soffice workers (None when LibreOffice is not installed)."""
+    global _conversion_pool
+    with _conversion_pool_lock:
+        if _conversion_pool is None:
+            soffice = resolve_soffice_binary()
+            if not soffice:
+                return None
+            _conversion_pool = ConversionPool(
+                soffice,
+                size=getattr(settings, "SAF_CONVERSION_WORKERS", 1),
+                profile_root=Path(settings.SOFFICE_PROFILE_ROOT),
+                timeout=getattr(settings, "SOFFICE_TIMEOUT", 180),
+                resident=getattr(settings, "SOFFICE_RESIDENT", True),
+                limits=soffice_limits(),
+            )
+            atexit.register(_conversion_pool.shutdown)
+        return _conversion_pool
+
+
 def convert_docx_to_pdf(docx_path: Path, out_pdf_path: Path) -> Tuple[bool, str]:
-    soffice = resolve_soffice_binary()
-    if not soffice:
+    pool = get_conversion_pool()
+    if not pool:
         return False, "No se encontró soffice para convertir DOCX."
-    cmd = [
-        soffice,
-        "--headless",
-        "--nologo",
-        "--nofirststartwizard",
-        "--convert-to",
-        "pdf",
-        "--outdir",
-        str(out_pdf_path.parent),
-        str(docx_path),
-    ]
+    with get_scheduler().slot("convert"):
+        return pool.convert(docx_path, out_pdf_path)
+
+
+_conversion_cache: Optional[ConversionCache] = None
+
+
+def get_conversion_cache() -> ConversionCache:
+    global _conversion_cache
+    with _conversion_pool_lock:
+        if _conversion_cache is None:
+            max_mb = int(getattr(settings, "SAF_CONVERSION_CACHE_MAX_MB", 0) or 0)
+            _conversion_cache = ConversionCache(Path(settings.SAF_CONVERSION_CACHE_ROOT), max_bytes=max_mb * 1024 * 1024)
+        return _conversion_cache
+
+
+_archive_executor: Optional[ProcessPoolExecutor] = None
+_metadata_render_cache = RenderCache()
+
+
+def get_archive_executor() -> Optional[ProcessPoolExecutor]:
+    """Process pool for archive compression (None when SAF_ARCHIVE_WORKERS <= 1)."""
+    global _archive_executor
+    workers = int(getattr(settings, "SAF_ARCHIVE_WORKERS", 1) or 1)
+    if workers <= 1:
+        return None
+    with _conversion_pool_lock:
+        if _archive_executor is None:
+            # spawn: the web process is multi-threaded, forking it is not safe (and Windows has no fork).
+            _archive_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_archive_executor.shutdown, wait=False, cancel_futures=True)
+        return _archive_executor
+
+
+def open_batch_archive(path: Path, update: bool = False):
+    return open_archive(
+        path,
+        fmt=getattr(settings, "SAF_ARCHIVE_FORMAT", "zip"),
+        policy=getattr(settings, "SAF_ARCHIVE_COMPRESSION", "auto"),
+        level=int(getattr(settings, "SAF_ARCHIVE_LEVEL", 6)),
+        executor=get_archive_executor(),
+        update=update,
+    )
+
+
+def download_mode() -> str:
+    return getattr(settings, "SAF_DOWNLOAD_MODE", "file")
+
+
+def batch_archive_path(batch: SafBatch) -> Path:
+    fmt = "zip" if download_mode() == "stream" else getattr(settings, "SAF_ARCHIVE_FORMAT", "zip")
+    suffix = archive_suffix(fmt)
+    return Path(settings.SAF_OUTPUT_ROOT) / f"{batch.batch_code}{suffix}"
+
+
+def get_cached_docx_pdf(docx_path: Path, source_sha256: str = "") -> Optional[Path]:
+    """Path of the cached PDF for these DOCX bytes, without converting."""
+    pool = get_conversion_pool()
+    if not pool:
+        return None
+    sha = source_sha256 or compute_sha256(str(docx_path))
+    return get_conversion_cache().get(sha, pool.version)
+
+
+def convert_docx_to_pdf_cached(docx_path: Path, out_pdf_path: Path, source_sha256: str = "") -> Tuple[bool, str, bool]:
+    """
+    DOCX -> PDF through the content-addressed cache (source sha256 + converter version).
+    Returns (ok, message, cache_hit); on a hit LibreOffice is not invoked at all.
+    """
+    pool = get_conversion_pool()
+    if not pool:
+        return False, "No se encontró soffice para convertir DOCX.", False
+    sha = source_sha256 or compute_sha256(str(docx_path))
+    if get_conversion_cache().fetch(sha, pool.version, out_pdf_path):
+        return True, "OK", True
+    with get_scheduler().slot("convert"):
+        ok, msg = pool.convert(docx_path, out_pdf_path)
+    if ok:
+        get_conversion_cache().put(sha, pool.version, out_pdf_path)
+    return ok, msg, False
+
+
+def convert_thesis_file(file_id: int) -> Tuple[bool, str]:
+    """Convert an uploaded thesis DOCX and keep the derived PDF linked to its ThesisFile."""
+    obj = ThesisFile.objects.filter(pk=file_id, file_type=ThesisFile.TYPE_TESIS_DOCX).first()
+    if not obj or not obj.file:
+        return False, "Archivo DOCX no encontrado."
+    ThesisFile.objects.filter(pk=obj.pk).update(conversion_status=ThesisFile.CONVERSION_RUNNING, conversion_detail="")
+
+    rel_name = thesis_file_converted_upload_to(obj, "tesis.pdf")
+    out_path = Path(settings.MEDIA_ROOT) / rel_name
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=180)
-        if proc.returncode != 0:
-            return False, proc.stderr.strip() or proc.stdout.strip() or "Error de LibreOffice"
-        generated = out_pdf_path.parent / f"{docx_path.stem}.pdf"
-        if not generated.exists():
-            return False, "LibreOffice no generó PDF."
-        if generated != out_pdf_path:
-            if out_pdf_path.exists():
-                out_pdf_path.unlink()
-            generated.rename(out_pdf_path)
-        return True, "OK"
-    except subprocess.TimeoutExpired:
-        return False, "Timeout en conversión DOCX->PDF"
+        ok, msg, cache_hit = convert_docx_to_pdf_cached(Path(obj.file.path), out_path, obj.sha256)
     except Exception as exc:  # noqa: BLE001
-        return False, str(exc)
-
-
-def infer_metadata_language(schema: str, element: str, qualifier: str, value: str) -> str:
-    schema_norm = (schema or "").strip().lower()
-    qualifier_norm = (qualifier or "").strip().lower()
-    element_norm = (element or "").strip().lower()
-    value_norm = (value or "").strip().lower()
-    if not value_norm:
-        return ""
-    if (schema_norm, element_norm, qualifier_norm) in FORCED_LANGUAGE_FIELDS:
-        return DEFAULT_METADATA_LANGUAGE
-    if element_norm == "date":
-        return ""
-    if qualifier_norm in LANGUAGE_EXCLUDED_QUALIFIERS:
-        return ""
-    if value_norm.startswith(URI_VALUE_PREFIXES):
-        return ""
-    return DEFAULT_METADATA_LANGUAGE
-
-
-def make_metadata_entry(
-    schema: str,
-    element: str,
-    qualifier: str,
-    value: str,
-    language: Optional[str] = None,
-) -> MetadataEntry:
-    val = ("" if value is None else str(value)).strip()
-    lang = infer_metadata_language(schema, element, qualifier, val) if language is None else (language or "").strip()
-    return (schema, element, qualifier, lang, val)
-
-
-def normalize_integer_like(value: str) -> str:
-    text = ("" if value is None else str(value)).strip()
-    if re.fullmatch(r"\d+\.0+", text):
-        return text.split(".", 1)[0]
-    return text
-
-
-def split_subjects(text: str) -> List[str]:
-    raw = (text or "").strip()
-    if not raw:
-        return []
-    if ";" in raw or "|" in raw or "\n" in raw:
-        parts = re.split(r"[;\|\n]+", raw)
-    elif "," in raw:
-        parts = raw.split(",")
+        ok, msg, cache_hit = False, str(exc), False
+
+    if ok:
+        updates = {
+            "converted_pdf": rel_name,
+            "conversion_status": ThesisFile.CONVERSION_OK,
+            "conversion_detail": "PDF desde cache" if cache_hit else "",
+            "converted_at": timezone.now(),
+        }
     else:
-        parts = [raw]
-    out: List[str] = []
-    seen = set()
-    for p in parts:
-        term = p.strip(" \t\r\n,;.")
-        if not term:
-            continue
-        key = norm_text(term)
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(term)
-    return out
-
-
-def escape_xml(s: str) -> str:
-    return (
-        s.replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace('"', "&quot;")
-        .replace("'", "&apos;")
-    )
+        updates = {"conversion_status": ThesisFile.CONVERSION_ERROR, "conversion_detail": msg}
+    # Queryset update: the file may have been replaced/deleted while converting.
+    if not ThesisFile.objects.filter(pk=obj.pk).update(**updates) and out_path.exists():
+        out_path.unlink()
+    return ok, msg
+
+
+def render_dublin_core_xml(metadata: List[MetadataEntry]) -> str:
+    return render_metadata_files(metadata)["dublin_core.xml"]
+
+
+def render_metadata_schema_xml(schema: str, metadata: List[MetadataEntry]) -> Optional[str]:
+    return render_metadata_files(metadata).get(metadata_filename(schema)) if schema != "dc" else None
+
+
+def render_contents_file(lines: List[str]) -> str:
+    return "\n".join(lines) + "\n"
 
 
 def write_dublin_core_xml(out_path: Path, metadata: List[MetadataEntry]):
-    dc_items = [(s, e, q, l, v) for s, e, q, l, v in metadata if s == "dc"]
-    lines = ['<?xml version="1.0" encoding="UTF-8"?>', "<dublin_core>"]
-    for _, element, qualifier, language, value in dc_items:
-        value = (value or "").strip()
-        if not value:
-            continue
-        q_attr = f' qualifier="{qualifier}"' if qualifier else ""
-        l_attr = f' language="{language}"' if language else ""
-        lines.append(f'  <dcvalue element="{element}"{q_attr}{l_attr}>{escape_xml(value)}</dcvalue>')
-    lines.append("</dublin_core>")
-    out_path.write_text("\n".join(lines), encoding="utf-8")
+    out_path.write_text(render_dublin_core_xml(metadata), encoding="utf-8")
 
 
 def write_metadata_schema_xml(out_dir: Path, schema: str, metadata: List[MetadataEntry]):
-    items = [(s, e, q, l, v) for s, e, q, l, v in metadata if s == schema]
-    if not items:
+    text = render_metadata_schema_xml(schema, metadata)
+    if text is None:
         return
-    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<dublin_core schema="{schema}">']
-    for _, element, qualifier, language, value in items:
-        value = (value or "").strip()
-        if not value:
-            continue
-        q_attr = f' qualifier="{qualifier}"' if qualifier else ""
-        l_attr = f' language="{language}"' if language else ""
-        lines.append(f'  <dcvalue element="{element}"{q_attr}{l_attr}>{escape_xml(value)}</dcvalue>')
-    lines.append("</dublin_core>")
-    (out_dir / f"metadata_{schema}.xml").write_text("\n".join(lines), encoding="utf-8")
+    (out_dir / f"metadata_{schema}.xml").write_text(text, encoding="utf-8")
 
 
 def write_contents_file(out_path: Path, lines: List[str]):
-    out_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    out_path.write_text(render_contents_file(lines), encoding="utf-8")
 
 
 def zip_directory(src: Path, zip_path: Path):
-    with ZipFile(zip_path, "w", ZIP_DEFLATED) as zf:
-        for file_path in src.rglob("*"):
+    archive = open_batch_archive(zip_path)
+    try:
+        for file_path in sorted(src.rglob("*")):
             if file_path.is_file():
-                zf.write(file_path, file_path.relative_to(src))
+                archive.write_members([(file_path.relative_to(src).as_posix(), file_path)])
+    finally:
+        archive.close()
+
+
+def _record_files(record: ThesisRecord, file_type: str) -> List[ThesisFile]:
+    # Uses the prefetched cache when available so worker threads never hit the DB.
+    return [f for f in record.files.all() if f.file_type == file_type]
 
 
 def _pick_thesis_file(record: ThesisRecord) -> Optional[ThesisFile]:
-    pdf = record.files.filter(file_type=ThesisFile.TYPE_TESIS_PDF).order_by("-created_at").first()
-    if pdf:
-        return pdf
-    return record.files.filter(file_type=ThesisFile.TYPE_TESIS_DOCX).order_by("-created_at").first()
+    for file_type in (ThesisFile.TYPE_TESIS_PDF, ThesisFile.TYPE_TESIS_DOCX):
+        candidates = _record_files(record, file_type)
+        if candidates:
+            return max(candidates, key=lambda f: f.created_at)
+    return None
+
+
+# Items that already have a DSpace handle go to "<CAREER>_replace/" (imported with -r and its map
+# file); "<CAREER>/" only holds new items (imported with -a).
+REPLACE_SUFFIX = "_replace"
 
 
 def _career_folder_name(record: ThesisRecord) -> str:
@@ -215,222 +312,1104 @@ def _career_folder_name(record: ThesisRecord) -> str:
     return re.sub(r"\s+", "_", norm_text(base))
 
 
-def generate_saf_batch(batch: SafBatch) -> Tuple[bool, str]:
+def _item_career_folder(record: ThesisRecord) -> str:
+    folder = _career_folder_name(record)
+    return f"{folder}{REPLACE_SUFFIX}" if (record.dspace_handle or "").strip() else folder
+
+
+def record_crosswalk_values(record: ThesisRecord) -> Dict[str, str]:
+    return {
+        "title": record.titulo,
+        "author1": record.autor1_nombre,
+        "author1_dni": record.autor1_dni,
+        "author2": record.autor2_nombre,
+        "author2_dni": record.autor2_dni,
+        "advisor": record.asesor_nombre,
+        "advisor_dni": record.asesor_dni,
+        "advisor_orcid": record.asesor_orcid,
+        "juror1": record.jurado1,
+        "juror2": record.jurado2,
+        "juror3": record.jurado3,
+        "abstract": record.resumen,
+        "keywords": record.keywords_raw,
+    }
+
+
+def compile_batch_crosswalk(current_year: str) -> Crosswalk:
+    # Rendered items outlive the batch (worker process): a regeneration re-renders only edited records.
+    return compile_crosswalk({"year": current_year}, cache=_metadata_render_cache)
+
+
+def render_record_metadata(record: ThesisRecord, crosswalk: Crosswalk) -> RenderedMetadata:
+    career = record.career
+    return crosswalk.render(
+        record_crosswalk_values(record),
+        career={name: getattr(career, name) for name in CAREER_FIELDS} if career else None,
+        career_key=(career.pk, career.updated_at) if career else None,
+        # Every edit of a record goes through save() (auto_now), so updated_at versions its values.
+        cache_key=(record.pk, record.updated_at) if record.pk else None,
+    )
+
+
+def build_record_metadata(record: ThesisRecord, current_year: str) -> List[MetadataEntry]:
+    return render_record_metadata(record, compile_batch_crosswalk(current_year)).entries
+
+
+@dataclass
+class SafItemJob:
+    """Snapshot of one batch item, built on the main thread and executed by a worker."""
+
+    index: int
+    item: SafBatchItem
+    nro: int
+    item_folder: str
+    career_folder: str = ""
+    work_dir: Optional[Path] = None
+    thesis_path: Optional[Path] = None
+    thesis_sha256: str = ""
+    thesis_is_docx: bool = False
+    thesis_from_docx: bool = False
+    attachments: List[Tuple[Path, str]] = field(default_factory=list)
+    metadata: List[MetadataEntry] = field(default_factory=list)
+    metadata_files: Dict[str, bytes] = field(default_factory=dict)
+    license_source: Union[Path, bytes] = b""
+    members: List[SafMember] = field(default_factory=list)
+    source_keys: List[str] = field(default_factory=list)
+    career_handle: str = ""
+    fingerprint: str = ""
+    reused: bool = False
+    ok: bool = False
+    detail: str = ""
+    timer: StageTimer = field(default_factory=StageTimer)
+
+    @property
+    def arc_prefix(self) -> str:
+        return f"{self.career_folder}/{self.item_folder}/"
+
+
+def _plan_item_job(
+    index: int,
+    item: SafBatchItem,
+    work_root: Path,
+    license_source: Union[Path, bytes],
+    crosswalk: Crosswalk,
+    check_status: bool = True,
+) -> SafItemJob:
+    record = item.record
+    job = SafItemJob(index=index, item=item, nro=record.nro, item_folder=f"item_{record.nro:03d}")
+    start = time.perf_counter()
+    try:
+        if check_status and record.status not in [ThesisRecord.STATUS_APROBADO, ThesisRecord.STATUS_POR_PUBLICAR]:
+            raise ValueError("Registro no está aprobado para SAF.")
+
+        thesis_src = _pick_thesis_file(record)
+        if not thesis_src:
+            raise ValueError("No existe tesis en PDF o DOCX.")
+
+        job.career_folder = _item_career_folder(record)
+        job.work_dir = work_root / job.item_folder
+        job.thesis_path = Path(thesis_src.file.path)
+        job.thesis_sha256 = thesis_src.sha256
+        job.thesis_is_docx = thesis_src.file_type == ThesisFile.TYPE_TESIS_DOCX
+        derived_pdf = thesis_src.converted_pdf_path if job.thesis_is_docx else None
+        if derived_pdf:
+            # Converted at upload time: generation only copies it.
+            job.thesis_path = derived_pdf
+            job.thesis_is_docx = False
+            job.thesis_from_docx = True
+        if not job.thesis_path.exists():
+            raise ValueError(f"No existe archivo de tesis: {thesis_src.original_name}")
+        job.source_keys.append(_source_key(job.thesis_path, "" if derived_pdf else thesis_src.sha256))
+
+        forms = sorted(_record_files(record, ThesisFile.TYPE_FORMULARIO), key=lambda f: (f.original_name, f.id))
+        for idx, f in enumerate(forms, start=1):
+            job.attachments.append((Path(f.file.path), f"formulario_{idx}.pdf"))
+            job.source_keys.append(_source_key(Path(f.file.path), f.sha256))
+
+        turns = sorted(_record_files(record, ThesisFile.TYPE_TURNITIN), key=lambda f: (f.original_name, f.id))
+        for idx, f in enumerate(turns, start=1):
+            dst_name = "turnitin.pdf" if len(turns) == 1 else f"turnitin_{idx}.pdf"
+            job.attachments.append((Path(f.file.path), dst_name))
+            job.source_keys.append(_source_key(Path(f.file.path), f.sha256))
+
+        job.license_source = license_source
+        job.career_handle = (record.career.handle or "").strip() if record.career else ""
+        with job.timer.measure("xml"):
+            rendered = render_record_metadata(record, crosswalk)
+        job.metadata = rendered.entries
+        job.metadata_files = rendered.files
+    except Exception as exc:  # noqa: BLE001
+        job.detail = str(exc)
+    # Everything else in planning is reading the prefetched rows and checking source paths.
+    xml_seconds = job.timer.stages.get("xml", {}).get("s", 0.0)
+    job.timer.add("db", time.perf_counter() - start - xml_seconds)
+    return job
+
+
+def _source_key(path: Path, sha256: str = "") -> str:
+    if sha256:
+        return sha256
+    try:
+        st = path.stat()
+    except OSError:
+        return f"{path}:missing"
+    return f"{path}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def item_fingerprint(job: SafItemJob, license_key: str) -> str:
+    """Hash of metadata, source files, license and career config: equal hash => identical item output."""
+    h = hashlib.sha256()
+    parts = [job.arc_prefix, license_key, job.career_handle, f"{job.thesis_is_docx}:{job.thesis_from_docx}"]
+    parts += job.source_keys
+    parts += [name for _, name in job.attachments]
+    parts += ["\t".join(entry) for entry in job.metadata]
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _license_key(license_obj: LicenseVersion) -> str:
+    text_sha = hashlib.sha256((license_obj.text_content or "").encode("utf-8")).hexdigest()
+    return f"{license_obj.pk}:{license_obj.version}:{text_sha}"
+
+
+def _stage_thesis(job: SafItemJob) -> str:
+    arcname = job.arc_prefix + "tesis.pdf"
+    if not job.thesis_is_docx:
+        job.members.append((arcname, job.thesis_path))
+        return "OK (PDF de DOCX pre-convertido)" if job.thesis_from_docx else "OK (PDF copiado)"
+    # The cache entry is linked into the work folder: a prune from another conversion cannot
+    # remove it before the writer reads the member.
+    out_pdf = job.work_dir / "tesis.pdf"
+    sha = job.thesis_sha256 or compute_sha256(str(job.thesis_path))
+    pool = get_conversion_pool()
+    if pool and get_conversion_cache().fetch(sha, pool.version, out_pdf):
+        job.members.append((arcname, out_pdf))
+        return "OK (DOCX desde cache)"
+    # DOCX conversion is CPU heavy: the conversion pool bounds it separately from the item workers.
+    start = time.perf_counter()
+    ok, msg, cache_hit = convert_docx_to_pdf_cached(job.thesis_path, out_pdf, sha)
+    job.timer.add("convert", time.perf_counter() - start, member_size(out_pdf) if ok else 0)
+    if not ok:
+        raise ValueError(f"Fallo DOCX->PDF: {msg}")
+    job.members.append((arcname, out_pdf))
+    return "OK (DOCX desde cache)" if cache_hit else "OK (DOCX convertido)"
+
+
+def _stage_attachments(job: SafItemJob):
+    for src, dst_name in job.attachments:
+        if not src.exists():
+            raise FileNotFoundError(f"No existe adjunto: {src.name}")
+        job.members.append((job.arc_prefix + dst_name, src))
+    # One license file per batch, linked (or cloned) into every item when staging.
+    job.members.append((job.arc_prefix + "license.txt", job.license_source))
+
+
+def _stage_metadata(job: SafItemJob):
+    start = time.perf_counter()
+    for name, data in job.metadata_files.items():
+        job.members.append((job.arc_prefix + name, data))
+
+    contents = [
+        "license.txt\tbundle:LICENSE",
+        "tesis.pdf\tbundle:ORIGINAL\tprimary:true",
+    ]
+    for _, name in job.attachments:
+        contents.append(f"{name}\tbundle:ORIGINAL")
+    job.members.append((job.arc_prefix + "contents", render_contents_file(contents).encode("utf-8")))
+    xml_bytes = sum(len(data) for data in job.metadata_files.values()) + len(job.members[-1][1])
+    job.timer.add("xml", time.perf_counter() - start, xml_bytes)
+
+
+def _run_item_job(job: SafItemJob, writer, on_stage=None) -> SafItemJob:
+    # Runs outside the main thread in parallel mode: filesystem work only, no ORM access.
+    if job.detail or job.reused:
+        return job
+    on_stage = on_stage or (lambda nro, stage: None)
+    # Global slots (conversion, archive, copy) taken by this thread are queued under its batch.
+    scheduler = get_scheduler()
+    try:
+        with scheduler.owner(job.item.batch_id):
+            on_stage(job.nro, "tesis")
+            thesis_status = _stage_thesis(job)
+            on_stage(job.nro, "adjuntos")
+            _stage_attachments(job)
+            on_stage(job.nro, "metadatos")
+            _stage_metadata(job)
+            on_stage(job.nro, "empaquetando")
+            # All members are known before anything is written, so failed items leave no partial output.
+            writer.write_members(job.members, replace_prefix=job.arc_prefix, timer=job.timer)
+        job.ok = True
+        job.detail = f"{thesis_status} | adjuntos={len(job.attachments)}"
+    except Exception as exc:  # noqa: BLE001
+        job.ok = False
+        job.detail = str(exc)
+    finally:
+        job.members = []
+    return job
+
+
+def _iter_finished_jobs(jobs: List[SafItemJob], workers: int, writer, on_stage=None) -> Iterator[SafItemJob]:
+    if workers <= 1:
+        for job in jobs:
+            yield _run_item_job(job, writer, on_stage)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="saf-item") as pool:
+        futures = [pool.submit(_run_item_job, job, writer, on_stage) for job in jobs]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+def _mark_reusable(job: SafItemJob, license_key: str, archive, existing_names: Set[str], staging_root: Optional[Path]):
+    """Fingerprint ``job`` and mark it reused when the item already written (or staged) matches."""
+    if job.detail:
+        return
+    job.fingerprint = item_fingerprint(job, license_key)
+    item = job.item
+    if item.result != SafBatchItem.RESULT_OK or item.fingerprint != job.fingerprint:
+        return
+    if archive is not None and job.arc_prefix + "tesis.pdf" not in existing_names:
+        return
+    if staging_root is not None and not (staging_root / job.arc_prefix / "tesis.pdf").exists():
+        return
+    job.reused = True
+    job.ok = True
+    job.detail = item.detail
+
+
+def _is_stale_member(name: str, live_items: Set[str], live_careers: Set[str]) -> bool:
+    parts = name.split("/")
+    if len(parts) >= 3:
+        return f"{parts[0]}/{parts[1]}/" not in live_items
+    if len(parts) == 2:
+        return parts[0] not in live_careers
+    return name.endswith(".bat") and not live_careers
+
+
+def _generation_workers(workers: Optional[int]) -> int:
+    if workers is None:
+        workers = getattr(settings, "SAF_GENERATION_WORKERS", 1)
+    return max(1, int(workers or 1))
+
+
+def _generation_chunk_size() -> int:
+    return max(1, int(getattr(settings, "SAF_GENERATION_CHUNK_SIZE", 500)))
+
+
+def _batch_item_ids(batch: SafBatch) -> List[int]:
+    return list(batch.items.order_by("record__nro", "id").values_list("id", flat=True))
+
+
+def _load_item_chunk(item_ids: List[int]) -> List[SafBatchItem]:
+    return list(
+        SafBatchItem.objects.filter(pk__in=item_ids)
+        .select_related("record__career")
+        .prefetch_related("record__files")
+        .order_by("record__nro", "id")
+    )
+
+
+def _iter_batch_items(batch: SafBatch) -> Iterator[SafBatchItem]:
+    item_ids = _batch_item_ids(batch)
+    chunk_size = _generation_chunk_size()
+    for start in range(0, len(item_ids), chunk_size):
+        yield from _load_item_chunk(item_ids[start:start + chunk_size])
+
+
+def batch_log_path(batch: SafBatch) -> Path:
+    return Path(settings.SAF_OUTPUT_ROOT) / f"{batch.batch_code}_generacion.log"
+
+
+class GenerationLog:
+    """
+    Append-only generation log (one file per batch, one section per run). ``text()`` keeps
+    only the first ``max_lines`` lines for ``SafBatch.log_text``.
+    """
+
+    def __init__(self, path: Path, max_lines: int):
+        self.path = path
+        self.max_lines = max(0, max_lines)
+        self.head: List[str] = []
+        self.count = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._file.write(f"=== Generación {timezone.localtime():%Y-%m-%d %H:%M:%S} ===\n")
+
+    def write(self, line: str):
+        self.count += 1
+        if len(self.head) < self.max_lines:
+            self.head.append(line)
+        self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+    def text(self) -> str:
+        lines = list(self.head)
+        if self.count > len(self.head):
+            lines.append(f"... {self.count - len(self.head)} línea(s) más en el log completo ({self.path.name}).")
+        return "\n".join(lines)
+
+
+def render_report_csv(rows: List[List[str]]) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["NRO", "STATUS", "DETAIL"] + TIMING_HEADER)
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8-sig")
+
+
+def generate_saf_batch(batch: SafBatch, workers: Optional[int] = None) -> Tuple[bool, str]:
+    """
+    Build the SAF package (items, report, scripts) for a batch. Regeneration is incremental:
+    items whose fingerprint matches the last OK run are reused, the rest are rebuilt.
+    """
     license_obj = LicenseVersion.objects.filter(is_active=True).first()
     if not license_obj:
         return False, "No hay licencia activa en configuración."
 
-    output_root = Path(settings.SAF_OUTPUT_ROOT) / batch.batch_code
-    if output_root.exists():
+    workers = _generation_workers(workers)
+    keep_staging = bool(getattr(settings, "SAF_KEEP_STAGING", False))
+    streaming = download_mode() == "stream"
+    # Bulk re-export parts rebuild published records as they are (status and handle untouched).
+    reexport = bool(batch.export_code)
+
+    chunk_size = _generation_chunk_size()
+    item_ids = _batch_item_ids(batch)
+    total_items = len(item_ids)
+    batch.status = SafBatch.STATUS_RUNNING
+    batch.log_text = "Iniciando generación SAF..."
+    batch.save(update_fields=["status", "log_text", "updated_at"])
+    progress = BatchProgress(batch, total_items, max_buffer=chunk_size)
+    # Batch stages run on this thread; item stages are summed from each job's own timer.
+    timer = StageTimer()
+    item_timer = StageTimer()
+
+    # First stage: every file, soffice and disk space are checked before any output is written.
+    preflight = None
+    preflight_errors: Dict[int, str] = {}
+    if getattr(settings, "SAF_PREFLIGHT", True):
+        from saf.preflight import run_preflight
+
+        progress.publish(f"Verificando archivos de {total_items} registro(s)...")
+        with timer.measure("preflight"):
+            preflight = run_preflight(item.record for item in _iter_batch_items(batch))
+        if preflight.blocking:
+            batch.status = SafBatch.STATUS_FAILED
+            batch.log_text = preflight.summary()
+            batch.save(update_fields=["status", "log_text", "updated_at"])
+            progress.publish(batch.log_text, status=batch.status)
+            return False, "La verificación previa encontró problemas; no se generó el SAF."
+        preflight_errors = preflight.record_errors()
+        progress.set_estimate(preflight.estimate)
+    else:
+        # No file sizes without the preflight: every item weighs the same in the ETA.
+        record_ids = SafBatchItem.objects.filter(pk__in=item_ids).values_list("record_id", flat=True)
+        progress.set_estimate(estimate_generation({rid: (0, False) for rid in record_ids}, 0, workers))
+
+    saf_root = Path(settings.SAF_OUTPUT_ROOT)
+    output_root = saf_root / batch.batch_code
+    work_root = saf_root / ".work" / batch.batch_code
+    if work_root.exists():
+        shutil.rmtree(work_root)
+    if output_root.exists() and not keep_staging:
         shutil.rmtree(output_root)
-    output_root.mkdir(parents=True, exist_ok=True)
+    saf_root.mkdir(parents=True, exist_ok=True)
+    zip_path = batch_archive_path(batch)
 
-    report_rows: List[List[str]] = []
-    log_lines = []
     has_errors = False
     current_year = str(datetime.now().year)
 
-    batch.status = SafBatch.STATUS_RUNNING
-    batch.log_text = "Iniciando generación SAF..."
-    batch.save(update_fields=["status", "log_text", "updated_at"])
+    # Regeneration updates a copy of the previous ZIP (moved over it on close); a damaged one is rebuilt from scratch.
+    archive = None
+    existing_names: Set[str] = set()
+    if not streaming:
+        try:
+            archive = open_batch_archive(zip_path, update=True)
+        except (BadZipFile, OSError):
+            zip_path.unlink(missing_ok=True)
+            archive = open_batch_archive(zip_path)
+        if isinstance(archive, ZipArchiveWriter):
+            existing_names = set(archive.names())
+    # In stream mode the download layout is stored at the end (save_batch_stream_layout).
+    writers = [archive] if archive else []
+    if keep_staging:
+        writers.append(SafDirectoryWriter(output_root, getattr(settings, "SAF_STAGING_LINK_MODE", "auto")))
+    writer = SafMultiWriter(writers, get_scheduler())
+
+    work_root.mkdir(parents=True, exist_ok=True)
+    license_path = work_root / "license.txt"
+    license_path.write_bytes((license_obj.text_content or "").encode("utf-8"))
+    license_key = _license_key(license_obj)
+    crosswalk = compile_batch_crosswalk(current_year)
 
     # Mapea carpetas de carrera -> handle para generar scripts de importación.
     career_targets = {}
+    # Only the folder of each OK item outlives its chunk (stale member cleanup).
+    live_items: Set[str] = set()
+    # Items left as they were in the ZIP: the manifest keeps their previous SHA-256.
+    reused_items: Set[str] = set()
+    item_handles: Dict[str, str] = {}
+    report_tmp = work_root / "reporte_validacion.csv"
+    if keep_staging:
+        report_path = output_root / "reporte_validacion.csv"
+    else:
+        report_path = saf_root / f"{batch.batch_code}_reporte_validacion.csv"
+
+    log = GenerationLog(batch_log_path(batch), int(getattr(settings, "SAF_LOG_TEXT_MAX_LINES", 300)))
+    if preflight is not None:
+        # Item errors show up in the item lines below; only the totals and warnings go here.
+        log.write(preflight.summary().splitlines()[0])
+        for issue in preflight.issues:
+            if issue.level != "error":
+                log.write(issue.as_text())
+    done = 0
+    generated_at = None
+    try:
+        with open(report_tmp, "w", encoding="utf-8-sig", newline="") as report_file:
+            report = csv.writer(report_file)
+            report.writerow(["NRO", "STATUS", "DETAIL"] + TIMING_HEADER)
+            # Items are loaded, processed and released one chunk at a time (own prefetch per chunk).
+            for start in range(0, total_items, chunk_size):
+                with timer.measure("load"):
+                    chunk = _load_item_chunk(item_ids[start:start + chunk_size])
+                items_start = time.perf_counter()
+                save_seconds = 0.0
+                jobs = [
+                    _plan_item_job(start + idx, item, work_root, license_path, crosswalk, check_status=not reexport)
+                    for idx, item in enumerate(chunk, start=1)
+                ]
+                for job in jobs:
+                    if not job.detail and job.item.record_id in preflight_errors:
+                        job.detail = preflight_errors[job.item.record_id]
+                    _mark_reusable(job, license_key, archive, existing_names, output_root if keep_staging else None)
+
+                for job in _iter_finished_jobs(jobs, workers, writer, progress.stage):
+                    done += 1
+                    item = job.item
+                    record = item.record
+                    item.item_folder_name = job.item_folder
+                    item.result = SafBatchItem.RESULT_OK if job.ok else SafBatchItem.RESULT_ERROR
+                    item.detail = job.detail
+                    item.fingerprint = job.fingerprint if job.ok else ""
+                    item.timings = job.timer.as_dict()
+                    item_timer.merge(item.timings)
+                    status_changed = None
+                    if job.ok:
+                        # Reused items may come from speculative staging, still APROBADO.
+                        if not reexport and record.status != ThesisRecord.STATUS_POR_PUBLICAR:
+                            record.status = ThesisRecord.STATUS_POR_PUBLICAR
+                            status_changed = record
+                        if job.career_handle:
+                            career_targets[job.career_folder] = job.career_handle
+                    else:
+                        has_errors = True
+
+                    # Progress goes to the cache for UI polling; DB writes are batched by the tracker.
+                    save_start = time.perf_counter()
+                    progress.item_done(
+                        item,
+                        status_changed,
+                        f"Procesando {done}/{total_items} (registro {job.nro:03d})...",
+                        stage="reutilizado" if job.reused else ("listo" if job.ok else "error"),
+                    )
+                    save_seconds += time.perf_counter() - save_start
+                timer.add("save", save_seconds)
+                timer.add("items", time.perf_counter() - items_start - save_seconds)
+
+                report_start = time.perf_counter()
+                for job in jobs:
+                    cells = timing_columns(job.item.timings)
+                    if job.ok:
+                        live_items.add(job.arc_prefix)
+                        if job.reused:
+                            reused_items.add(job.arc_prefix)
+                        if job.item.record.dspace_handle:
+                            item_handles[job.arc_prefix] = job.item.record.dspace_handle.strip()
+                        report.writerow([f"{job.nro:03d}", "OK", job.detail] + cells)
+                        log.write(f"[OK] {job.nro:03d}" + (" (sin cambios)" if job.reused else ""))
+                    else:
+                        report.writerow([f"{job.nro:03d}", "ERROR", job.detail] + cells)
+                        log.write(f"[ERROR] {job.nro:03d} - {job.detail}")
+                timer.add("report", time.perf_counter() - report_start)
+
+        # Drop members of items that failed, left the batch or moved to another career folder.
+        with timer.measure("cleanup"):
+            writer.remove_members(lambda name: _is_stale_member(name, live_items, set(career_targets)))
+
+        with timer.measure("report", member_size(report_tmp)):
+            writer.write_members([("reporte_validacion.csv", report_tmp)])
+        _write_import_scripts(writer, timer, career_targets, item_handles)
+        if not keep_staging:
+            os.replace(report_tmp, report_path)
+        with timer.measure("close"):
+            writer.close()
+            if isinstance(archive, ZipArchiveWriter) and archive.dead_bytes * 2 > zip_path.stat().st_size:
+                # Mostly replaced members: compact so the download does not carry dead bytes.
+                rewrite_archive_members(zip_path, {})
+
+        zip_written = isinstance(archive, ZipArchiveWriter)
+        staging_root = output_root if keep_staging else None
+        # What DSpace will import: the ZIP, or the staging tree in stream mode.
+        if not _validate_package(zip_path if zip_written else staging_root, workers, progress, timer, log):
+            has_errors = True
+        if zip_written:
+            _write_package_manifest(batch, zip_path, staging_root, reused_items, progress, timer, log)
+        _write_career_parts(batch, zip_path if zip_written else None, career_targets, progress, timer, log)
+        if streaming:
+            generated_at = _save_stream_layout(batch, progress, timer, log)
+    finally:
+        writer.close()
+        log.close()
+        shutil.rmtree(work_root, ignore_errors=True)
+        with timer.measure("save"):
+            progress.finish()
+
+    batch.generated_at = generated_at or timezone.now()
+    batch.output_path = str(output_root) if keep_staging else ""
+    batch.report_path = str(report_path)
+    batch.zip_path = str(zip_path)
+    batch.log_text = log.text()
+    batch.status = SafBatch.STATUS_FAILED if has_errors else SafBatch.STATUS_DONE
+    batch.timings = {"stages": timer.as_dict(), "items": item_timer.as_dict()}
+    batch.save(
+        update_fields=["generated_at", "output_path", "report_path", "zip_path", "log_text", "status", "timings", "updated_at"]
+    )
+    progress.publish(batch.log_text, status=batch.status, zip_ready=True)
+
+    if has_errors:
+        return False, "Lote generado con errores."
+    return True, "Lote generado correctamente."
 
-    items = list(batch.items.select_related("record__career").prefetch_related("record__files").all())
-    total_items = len(items)
-    for idx, item in enumerate(items, start=1):
-        record = item.record
-        item_folder = f"item_{record.nro:03d}"
-        item.item_folder_name = item_folder
-        try:
-            # Update progress text for UI polling.
-            batch.log_text = f"Procesando {idx}/{total_items} (registro {record.nro:03d})..."
-            batch.save(update_fields=["log_text", "updated_at"])
 
-            if record.status not in [ThesisRecord.STATUS_APROBADO, ThesisRecord.STATUS_POR_PUBLICAR]:
-                raise ValueError("Registro no está aprobado para SAF.")
+def _write_import_scripts(writer, timer: StageTimer, career_targets: Dict[str, str], item_handles: Dict[str, str]):
+    """Import scripts (.bat) and DSpace map files of the package."""
+    members: List[SafMember] = []
+    if career_targets:
+        targets = sorted(career_targets.items(), key=lambda x: x[0])
+        members.extend(
+            (name, text.encode("ascii")) for name, text in _render_import_bats(targets, set(career_targets)).items()
+        )
+    members.extend(render_mapfiles(item_handles).items())
+    with timer.measure("scripts", sum(member_size(data) for _, data in members)):
+        writer.write_members(members)
+
+
+def _validate_package(source: Optional[Path], workers: int, progress: BatchProgress, timer: StageTimer, log) -> bool:
+    """Structural check of the finished package (``SAF_VALIDATE``); problems go to the log."""
+    if source is None or not getattr(settings, "SAF_VALIDATE", True):
+        return True
+    progress.publish("Validando estructura SAF...")
+    with timer.measure("validation"):
+        validation = validate_saf(source, workers=workers)
+    log.write(validation.summary())
+    for line in validation.lines():
+        log.write(line)
+    return validation.ok
+
+
+def _write_package_manifest(
+    batch: SafBatch,
+    zip_path: Path,
+    staging_root: Optional[Path],
+    reused_items: Set[str],
+    progress: BatchProgress,
+    timer: StageTimer,
+    log,
+):
+    """``manifest.csv`` of the batch ZIP (``SAF_MANIFEST``)."""
+    if not getattr(settings, "SAF_MANIFEST", True):
+        return
+    progress.publish("Calculando manifest (SHA-256)...")
+    with timer.measure("manifest"):
+        entries = write_batch_manifest(batch, zip_path, staging_root, reused_items)
+    log.write(f"Manifest: {len(entries)} archivo(s) con SHA-256.")
+
+
+def _write_career_parts(
+    batch: SafBatch,
+    zip_path: Optional[Path],
+    career_targets: Dict[str, str],
+    progress: BatchProgress,
+    timer: StageTimer,
+    log,
+):
+    """One archive per career (``SAF_SPLIT_BY_CAREER``), cut from the batch ZIP."""
+    if not getattr(settings, "SAF_SPLIT_BY_CAREER", False):
+        return
+    if zip_path is None:
+        log.write("Partes por carrera: requieren SAF_ARCHIVE_FORMAT=zip y SAF_DOWNLOAD_MODE=file.")
+        return
+    progress.publish("Armando partes por carrera...")
+    with timer.measure("parts"):
+        parts = build_career_parts(batch, zip_path, career_targets)
+    log.write(f"Partes por carrera: {len(parts)} archivo(s) en {batch_parts_dir(batch).name}.")
 
-            thesis_src = _pick_thesis_file(record)
-            if not thesis_src:
-                raise ValueError("No existe tesis en PDF o DOCX.")
 
-            career_folder = _career_folder_name(record)
-            career_dir = output_root / career_folder
-            item_dir = career_dir / item_folder
-            item_dir.mkdir(parents=True, exist_ok=True)
-            if record.career and record.career.handle:
-                career_targets[career_folder] = record.career.handle.strip()
-
-            thesis_out = item_dir / "tesis.pdf"
-            thesis_src_path = Path(thesis_src.file.path)
-            if not thesis_src_path.exists():
-                raise ValueError(f"No existe archivo de tesis: {thesis_src.original_name}")
-            if thesis_src.file_type == ThesisFile.TYPE_TESIS_PDF:
-                shutil.copy2(thesis_src_path, thesis_out)
-                thesis_status = "OK (PDF copiado)"
+def _save_stream_layout(batch: SafBatch, progress: BatchProgress, timer: StageTimer, log) -> datetime:
+    """Store the download layout of a stream-mode batch. Returns the generation time it is keyed by."""
+    # The layout reads the item results from the DB: write them first.
+    progress.finish()
+    generated_at = batch.generated_at = timezone.now()
+    progress.publish("Preparando el ZIP de descarga...")
+    with timer.measure("close"):
+        layout = save_batch_stream_layout(batch)
+    log.write(f"ZIP de descarga: {layout.size} bytes (sin escribir el archivo).")
+    return generated_at
+
+
+def batch_profile_paths(batch: SafBatch) -> Tuple[Path, Path]:
+    """Collapsed-stack samples and tracemalloc report of the last profiled job (``SafJob.profile``)."""
+    saf_root = Path(settings.SAF_OUTPUT_ROOT)
+    return saf_root / f"{batch.batch_code}_perfil.folded", saf_root / f"{batch.batch_code}_memoria.txt"
+
+
+def batch_parts_dir(batch: SafBatch) -> Path:
+    return Path(settings.SAF_OUTPUT_ROOT) / f"{batch.batch_code}_partes"
+
+
+def batch_part_paths(batch: SafBatch) -> List[Path]:
+    parts_root = batch_parts_dir(batch)
+    return sorted(parts_root.glob("*.zip")) if parts_root.is_dir() else []
+
+
+def _item_sort_key(prefix: str):
+    folder = prefix.rstrip("/").rsplit("/", 1)[-1]
+    return (len(folder), folder)
+
+
+def plan_career_parts(sizes: Dict[str, int], max_bytes: int = 0) -> List[Tuple[str, str, List[str]]]:
+    """
+    Group the item folders of a package by career and cut each career into volumes of at
+    most ``max_bytes`` (0 = one part per career; an item bigger than the limit gets its own
+    volume). Returns ``(part_folder, career_folder, item_prefixes)`` in package order.
+    """
+    careers: Dict[str, Dict[str, int]] = {}
+    for name, size in sizes.items():
+        parts = name.split("/")
+        if len(parts) < 3:
+            continue
+        items = careers.setdefault(parts[0], {})
+        prefix = f"{parts[0]}/{parts[1]}/"
+        items[prefix] = items.get(prefix, 0) + size
+
+    plan = []
+    for career in sorted(careers):
+        volumes: List[List[str]] = [[]]
+        used = 0
+        for prefix in sorted(careers[career], key=_item_sort_key):
+            size = careers[career][prefix]
+            if max_bytes and volumes[-1] and used + size > max_bytes:
+                volumes.append([])
+                used = 0
+            volumes[-1].append(prefix)
+            used += size
+        for number, prefixes in enumerate(volumes, start=1):
+            # Each volume imports on its own: its folder name also names its DSpace map file.
+            folder = career if len(volumes) == 1 else f"{career}_vol{number:02d}"
+            plan.append((folder, career, prefixes))
+    return plan
+
+
+def _zip_mapfile_handles(zip_path: Path, names) -> Dict[str, str]:
+    """Item prefix -> handle from the ``mapfiles/map_<CAREER>.map`` members of a batch ZIP."""
+    handles: Dict[str, str] = {}
+    with ZipFile(zip_path, "r") as zf:
+        for name in names:
+            if not (name.startswith("mapfiles/map_") and name.endswith(".map")):
+                continue
+            career = name[len("mapfiles/map_"):-len(".map")]
+            for line in zf.read(name).decode("utf-8").splitlines():
+                folder, _, handle = line.strip().partition(" ")
+                if folder and handle:
+                    handles[f"{career}/{folder}/"] = handle.strip()
+    return handles
+
+
+def build_career_parts(
+    batch: SafBatch, zip_path: Path, career_targets: Dict[str, str], workers: Optional[int] = None
+) -> List[Path]:
+    """
+    Cut the batch ZIP into one archive per career folder (``SAF_SPLIT_BY_CAREER``), split in
+    volumes of ``SAF_VOLUME_MAX_MB``. Members are copied raw from the batch ZIP, so the parts
+    are built concurrently without recompressing; each part carries its own ``importar.bat``.
+    """
+    parts_root = batch_parts_dir(batch)
+    shutil.rmtree(parts_root, ignore_errors=True)
+    parts_root.mkdir(parents=True, exist_ok=True)
+    max_bytes = int(float(getattr(settings, "SAF_VOLUME_MAX_MB", 0) or 0) * 1024 * 1024)
+    sizes = zip_member_sizes(zip_path)
+    by_item: Dict[str, List[str]] = {}
+    for name in sizes:
+        parts = name.split("/")
+        if len(parts) >= 3:
+            by_item.setdefault(f"{parts[0]}/{parts[1]}/", []).append(name)
+    item_handles = _zip_mapfile_handles(zip_path, sizes)
+    dspace_bin, eperson = _dspace_import_defaults()
+    policy = getattr(settings, "SAF_ARCHIVE_COMPRESSION", "auto")
+    level = int(getattr(settings, "SAF_ARCHIVE_LEVEL", 6))
+
+    scheduler = get_scheduler()
+
+    def build(part: Tuple[str, str, List[str]]) -> Path:
+        folder, career, prefixes = part
+        dst = parts_root / f"{batch.batch_code}_{folder}.zip"
+        renames = [(name, folder + name[len(career):]) for prefix in prefixes for name in by_item[prefix]]
+        extra: List[SafMember] = []
+        if career_targets.get(career):
+            bat = _render_career_bat(dspace_bin, eperson, career_targets[career])
+            extra.append((f"{folder}/importar.bat", bat.encode("ascii")))
+        part_handles = {folder + p[len(career):]: item_handles[p] for p in prefixes if p in item_handles}
+        extra.extend(render_mapfiles(part_handles).items())
+        with scheduler.owner(batch.id), scheduler.slot("copy"):
+            copy_zip_members(zip_path, dst, renames, extra, policy=policy, level=level)
+        return dst
+
+    plan = plan_career_parts(sizes, max_bytes)
+    workers = max(1, int(workers or getattr(settings, "SAF_PART_WORKERS", 4) or 1))
+    with ThreadPoolExecutor(max_workers=min(workers, max(1, len(plan))), thread_name_prefix="saf-part") as pool:
+        return list(pool.map(build, plan))
+
+
+def batch_manifest_path(batch: SafBatch) -> Path:
+    return Path(settings.SAF_OUTPUT_ROOT) / f"{batch.batch_code}_manifest.csv"
+
+
+def manifest_choices(exclude: Optional[SafBatch] = None) -> List[Path]:
+    """Manifests usable as delta base: every batch's current one plus earlier versions, newest first."""
+    saf_root = Path(settings.SAF_OUTPUT_ROOT)
+    if not saf_root.is_dir():
+        return []
+    skip = batch_manifest_path(exclude) if exclude else None
+    paths = [p for p in saf_root.glob("*_manifest*.csv") if p != skip]
+    return sorted(paths, key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def write_batch_manifest(
+    batch: SafBatch, zip_path: Path, staging_root: Optional[Path] = None, unchanged_items: Optional[Set[str]] = None
+) -> Dict[str, ManifestEntry]:
+    """
+    Write ``<batch>_manifest.csv`` and add it to the ZIP as ``manifest.csv``. Members of
+    ``unchanged_items`` (default: every item folder, when only the scripts changed) keep the
+    SHA-256 of the previous manifest, which is kept as ``<batch>_manifest_<fecha>.csv`` so
+    later deltas can be built against it.
+    """
+    manifest_path = batch_manifest_path(batch)
+    previous = read_manifest(manifest_path) if manifest_path.exists() else {}
+    if unchanged_items is None:
+        unchanged_items = {p for p in map(item_prefix, previous) if p}
+    entries = zip_manifest(zip_path, previous, unchanged=unchanged_items)
+    data = render_manifest(entries)
+    if previous and previous != entries:
+        stamp = timezone.localtime(batch.generated_at) if batch.generated_at else timezone.localtime()
+        os.replace(manifest_path, manifest_path.with_name(f"{manifest_path.stem}_{stamp:%Y%m%d_%H%M%S}.csv"))
+    manifest_path.write_bytes(data)
+    archive = ZipArchiveWriter(
+        zip_path,
+        policy=getattr(settings, "SAF_ARCHIVE_COMPRESSION", "auto"),
+        level=int(getattr(settings, "SAF_ARCHIVE_LEVEL", 6)),
+        update=True,
+    )
+    try:
+        archive.write_members([(MANIFEST_NAME, data)])
+    finally:
+        archive.close()
+    if staging_root is not None:
+        (staging_root / MANIFEST_NAME).write_bytes(data)
+    return entries
+
+
+def batch_deltas_dir(batch: SafBatch) -> Path:
+    return Path(settings.SAF_OUTPUT_ROOT) / f"{batch.batch_code}_deltas"
+
+
+def batch_delta_paths(batch: SafBatch) -> List[Path]:
+    deltas_root = batch_deltas_dir(batch)
+    return sorted(deltas_root.glob("*.zip")) if deltas_root.is_dir() else []
+
+
+def build_batch_delta(batch: SafBatch, base_name: str) -> Tuple[bool, str]:
+    """Delta package of the batch ZIP against the manifest ``base_name`` (see ``manifest_choices``)."""
+    base = next((p for p in manifest_choices(exclude=batch) if p.name == base_name), None)
+    if base is None:
+        return False, "No existe el manifest base seleccionado."
+    manifest_path = batch_manifest_path(batch)
+    zip_path = Path(batch.zip_path) if batch.zip_path else None
+    if not zip_path or not zip_path.exists() or archive_format_of(zip_path) != "zip" or not manifest_path.exists():
+        return False, "El lote no tiene ZIP con manifest; genera el SAF nuevamente."
+    dst = batch_deltas_dir(batch) / f"{batch.batch_code}_delta_{base.stem}.zip"
+    changed, removed = build_delta_zip(
+        zip_path,
+        dst,
+        read_manifest(manifest_path),
+        read_manifest(base),
+        policy=getattr(settings, "SAF_ARCHIVE_COMPRESSION", "auto"),
+        level=int(getattr(settings, "SAF_ARCHIVE_LEVEL", 6)),
+    )
+    size_mb = dst.stat().st_size / 1048576
+    full_mb = zip_path.stat().st_size / 1048576
+    return True, (
+        f"Delta contra {base.name}: {len(changed)} item(s) nuevos o cambiados, {len(removed)} eliminados "
+        f"({size_mb:.1f} MB de {full_mb:.1f} MB)."
+    )
+
+
+def stage_batch_items(batch: SafBatch, workers: Optional[int] = None) -> Tuple[bool, str]:
+    """
+    Speculatively build the items of approved records before the group is generated.
+
+    A record's content is frozen once it is approved, so its item (thesis conversion,
+    attachments, XML, fingerprint) is written into the batch ZIP (and staging tree) exactly as
+    ``generate_saf_batch`` would write it. The batch itself is left alone: the final generation
+    finds matching fingerprints, reuses those items and only adds the report and the scripts.
+    With ``SAF_DOWNLOAD_MODE=stream`` or a tar format there is no ZIP to keep; staging then
+    only fills the conversion and metadata caches.
+    """
+    if batch.status == SafBatch.STATUS_RUNNING or (batch.status == SafBatch.STATUS_DONE and batch.zip_path):
+        return True, "Lote en generación o ya generado; no se prepara nada."
+    license_obj = LicenseVersion.objects.filter(is_active=True).first()
+    if not license_obj:
+        return False, "No hay licencia activa en configuración."
+
+    workers = _generation_workers(workers)
+    keep_staging = bool(getattr(settings, "SAF_KEEP_STAGING", False))
+    saf_root = Path(settings.SAF_OUTPUT_ROOT)
+    output_root = saf_root / batch.batch_code
+    work_root = saf_root / ".work" / f"{batch.batch_code}_staging"
+    license_key = _license_key(license_obj)
+    license_bytes = (license_obj.text_content or "").encode("utf-8")
+    crosswalk = compile_batch_crosswalk(str(datetime.now().year))
+    item_ids = list(
+        batch.items.filter(record__status=ThesisRecord.STATUS_APROBADO)
+        .order_by("record__nro", "id")
+        .values_list("id", flat=True)
+    )
+    if not item_ids:
+        return True, "Sin registros aprobados por preparar."
+
+    archive = None
+    existing_names: Set[str] = set()
+    if download_mode() != "stream" and getattr(settings, "SAF_ARCHIVE_FORMAT", "zip") == "zip":
+        saf_root.mkdir(parents=True, exist_ok=True)
+        zip_path = batch_archive_path(batch)
+        try:
+            archive = open_batch_archive(zip_path, update=True)
+        except (BadZipFile, OSError):
+            zip_path.unlink(missing_ok=True)
+            archive = open_batch_archive(zip_path)
+        existing_names = set(archive.names())
+    writers = [archive] if archive else []
+    if keep_staging:
+        writers.append(SafDirectoryWriter(output_root, getattr(settings, "SAF_STAGING_LINK_MODE", "auto")))
+    writer = SafMultiWriter(writers, get_scheduler())
+
+    chunk_size = _generation_chunk_size()
+    staged = reused = failed = 0
+    try:
+        for start in range(0, len(item_ids), chunk_size):
+            chunk = _load_item_chunk(item_ids[start:start + chunk_size])
+            # Indexes only matter for ordering; the real ones are assigned by the generation.
+            jobs = [_plan_item_job(idx, item, work_root, license_bytes, crosswalk) for idx, item in enumerate(chunk, 1)]
+            for job in jobs:
+                _mark_reusable(job, license_key, archive, existing_names, output_root if keep_staging else None)
+            done_items = []
+            for job in _iter_finished_jobs(jobs, workers, writer):
+                if job.reused:
+                    reused += 1
+                    continue
+                if not job.ok:
+                    # Left pending: the generation retries it and reports the error.
+                    failed += 1
+                    continue
+                staged += 1
+                item = job.item
+                item.item_folder_name = job.item_folder
+                item.result = SafBatchItem.RESULT_OK
+                item.detail = job.detail
+                item.fingerprint = job.fingerprint
+                item.timings = job.timer.as_dict()
+                done_items.append(item)
+            if done_items:
+                SafBatchItem.objects.bulk_update(done_items, ITEM_FIELDS)
+    finally:
+        writer.close()
+        shutil.rmtree(work_root, ignore_errors=True)
+    return True, f"Items preparados: {staged} | sin cambios: {reused} | con error: {failed}."
+
+
+def batch_stream_dir(batch: SafBatch) -> Path:
+    """Stored download layout of a stream-mode batch and the converted PDFs it pins."""
+    return Path(settings.SAF_OUTPUT_ROOT) / f"{batch.batch_code}_stream"
+
+
+def build_batch_stream_layout(batch: SafBatch) -> ZipLayout:
+    """
+    Lay out the batch ZIP from the stored sources (OK items, report, scripts) without
+    writing it to disk. Order and timestamps are fixed by the batch, so Range requests can
+    be served from any offset.
+
+    Converted PDFs are linked into ``batch_stream_dir(batch)/pdf`` (content addressed by
+    the DOCX sha256) so evicting the conversion cache never changes the download; later
+    rebuilds use those pins and never run soffice again for a pinned DOCX.
+    """
+    license_obj = LicenseVersion.objects.filter(is_active=True).first()
+    if not license_obj:
+        raise ValueError("No hay licencia activa en configuración.")
+    license_bytes = (license_obj.text_content or "").encode("utf-8")
+    stamp = timezone.localtime(batch.generated_at or batch.created_at)
+    work_root = Path(settings.SAF_OUTPUT_ROOT) / ".work" / f"{batch.batch_code}_stream"
+    pins_root = batch_stream_dir(batch) / "pdf"
+    pinned: Set[Path] = set()
+
+    members: List[SafMember] = []
+    report_rows: List[List[str]] = []
+    career_targets = {}
+    item_handles: Dict[str, str] = {}
+    crosswalk = compile_batch_crosswalk(str(stamp.year))
+    try:
+        for idx, item in enumerate(_iter_batch_items(batch), start=1):
+            report_rows.append([f"{item.record.nro:03d}", item.result, item.detail] + timing_columns(item.timings))
+            if item.result != SafBatchItem.RESULT_OK:
+                continue
+            job = _plan_item_job(idx, item, work_root, license_bytes, crosswalk, check_status=False)
+            if job.detail:
+                raise ValueError(f"Registro {job.nro:03d}: {job.detail}")
+            if job.thesis_is_docx:
+                pin = pins_root / f"{job.thesis_sha256 or compute_sha256(str(job.thesis_path))}.pdf"
+                if not pin.exists():
+                    _stage_thesis(job)
+                    # Work folder copy (linked from the cache or converted just now): keep our own link to it.
+                    pin.parent.mkdir(parents=True, exist_ok=True)
+                    place_file(Path(job.members.pop()[1]), pin)
+                job.members.append((job.arc_prefix + "tesis.pdf", pin))
+                pinned.add(pin)
             else:
-                ok, msg = convert_docx_to_pdf(thesis_src_path, thesis_out)
-                if not ok:
-                    raise ValueError(f"Fallo DOCX->PDF: {msg}")
-                thesis_status = "OK (DOCX convertido)"
-
-            # Adjuntos
-            attached = []
-            forms = list(record.files.filter(file_type=ThesisFile.TYPE_FORMULARIO).order_by("original_name", "id"))
-            for idx, f in enumerate(forms, start=1):
-                dst_name = f"formulario_{idx}.pdf"
-                shutil.copy2(f.file.path, item_dir / dst_name)
-                attached.append(dst_name)
-
-            turns = list(record.files.filter(file_type=ThesisFile.TYPE_TURNITIN).order_by("original_name", "id"))
-            for idx, f in enumerate(turns, start=1):
-                dst_name = "turnitin.pdf" if len(turns) == 1 else f"turnitin_{idx}.pdf"
-                shutil.copy2(f.file.path, item_dir / dst_name)
-                attached.append(dst_name)
-
-            # Licencia
-            license_path = item_dir / "license.txt"
-            license_path.write_text(license_obj.text_content or "", encoding="utf-8")
-
-            md: List[MetadataEntry] = []
-            add = lambda s, e, q, v, lang=None: md.append(make_metadata_entry(s, e, q, v, lang))
-            add("dc", "title", "", record.titulo)
-            add("dc", "date", "issued", current_year)
-            add("dc", "language", "iso", "spa")
-            add("dc", "format", "", "application/pdf")
-            add("dc", "type", "", "info:eu-repo/semantics/bachelorThesis")
-            add("dc", "rights", "", "info:eu-repo/semantics/openAccess")
-
-            for i in [1, 2]:
-                author = getattr(record, f"autor{i}_nombre", "").strip()
-                dni = normalize_integer_like(getattr(record, f"autor{i}_dni", ""))
-                if author:
-                    add("dc", "contributor", "author", author)
-                if dni:
-                    add("renati", "author", "dni", dni)
-
-            if record.asesor_nombre.strip():
-                add("dc", "contributor", "advisor", record.asesor_nombre.strip())
-            if record.asesor_dni.strip():
-                add("renati", "advisor", "dni", normalize_integer_like(record.asesor_dni.strip()))
-            if record.asesor_orcid.strip():
-                add("renati", "advisor", "orcid", record.asesor_orcid.strip())
-
-            for field_name in ["jurado1", "jurado2", "jurado3"]:
-                value = getattr(record, field_name, "").strip()
-                if value:
-                    add("renati", "juror", "", value)
-
-            if record.resumen.strip():
-                add("dc", "description", "abstract", record.resumen.strip())
-
-            for sub in split_subjects(record.keywords_raw):
-                add("dc", "subject", "", sub)
-
-            add("renati", "type", "", "https://purl.org/pe-repo/renati/type#tesis")
-            add("dc", "type", "version", "info:eu-repo/semantics/publishedVersion")
-            add("dc", "publisher", "", "Universidad Autónoma de Ica")
-            add("dc", "publisher", "country", "PE")
-            add("dc", "rights", "uri", "https://creativecommons.org/licenses/by/4.0")
-
-            if record.career:
-                if record.career.thesis_degree_name:
-                    add("thesis", "degree", "name", record.career.thesis_degree_name)
-                if record.career.thesis_degree_discipline:
-                    add("thesis", "degree", "discipline", record.career.thesis_degree_discipline)
-                if record.career.thesis_degree_grantor:
-                    add("thesis", "degree", "grantor", record.career.thesis_degree_grantor)
-                if record.career.renati_level:
-                    add("renati", "level", "", record.career.renati_level)
-                if record.career.renati_discipline:
-                    add("renati", "discipline", "", record.career.renati_discipline)
-                if record.career.ocde_url:
-                    add("dc", "subject", "ocde", record.career.ocde_url)
-
-            write_dublin_core_xml(item_dir / "dublin_core.xml", md)
-            for schema in sorted(set(s for s, _, _, _, _ in md if s != "dc")):
-                write_metadata_schema_xml(item_dir, schema, md)
-
-            contents = [
-                "license.txt\tbundle:LICENSE",
-                "tesis.pdf\tbundle:ORIGINAL\tprimary:true",
-            ]
-            for name in attached:
-                contents.append(f"{name}\tbundle:ORIGINAL")
-            write_contents_file(item_dir / "contents", contents)
-
-            item.result = SafBatchItem.RESULT_OK
-            item.detail = f"{thesis_status} | adjuntos={len(attached)}"
-            item.save(update_fields=["item_folder_name", "result", "detail"])
-
-            record.status = ThesisRecord.STATUS_POR_PUBLICAR
-            record.save(update_fields=["status", "updated_at"])
-            report_rows.append([f"{record.nro:03d}", "OK", item.detail])
-            log_lines.append(f"[OK] {record.nro:03d}")
-        except Exception as exc:  # noqa: BLE001
-            has_errors = True
-            item.result = SafBatchItem.RESULT_ERROR
-            item.detail = str(exc)
-            item.save(update_fields=["item_folder_name", "result", "detail"])
-            report_rows.append([f"{record.nro:03d}", "ERROR", str(exc)])
-            log_lines.append(f"[ERROR] {record.nro:03d} - {exc}")
-
-    report_path = output_root / "reporte_validacion.csv"
-    with report_path.open("w", encoding="utf-8-sig", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["NRO", "STATUS", "DETAIL"])
-        writer.writerows(report_rows)
-
-    # Scripts .bat para importar a DSpace (incluidos en el ZIP).
+                _stage_thesis(job)
+            _stage_attachments(job)
+            _stage_metadata(job)
+            members.extend(job.members)
+            record = item.record
+            if record.career and record.career.handle:
+                career_targets[job.career_folder] = record.career.handle.strip()
+            if record.dspace_handle:
+                item_handles[job.arc_prefix] = record.dspace_handle.strip()
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    members.append(("reporte_validacion.csv", render_report_csv(report_rows)))
     if career_targets:
         targets = sorted(career_targets.items(), key=lambda x: x[0])
-        _generate_import_bats(output_root, targets)
+        members.extend(
+            (name, text.encode("ascii")) for name, text in _render_import_bats(targets, set(career_targets)).items()
+        )
+    members.extend(render_mapfiles(item_handles).items())
+    layout = ZipLayout(members, date_time=stamp)
+    if pins_root.is_dir():
+        for stale in set(pins_root.iterdir()) - pinned:
+            stale.unlink(missing_ok=True)
+    return layout
 
-    zip_path = output_root.parent / f"{batch.batch_code}.zip"
-    if zip_path.exists():
-        zip_path.unlink()
-    zip_directory(output_root, zip_path)
 
-    batch.generated_at = timezone.now()
-    batch.output_path = str(output_root)
-    batch.report_path = str(report_path)
-    batch.zip_path = str(zip_path)
-    batch.log_text = "\n".join(log_lines)
-    batch.status = SafBatch.STATUS_FAILED if has_errors else SafBatch.STATUS_DONE
-    batch.save(update_fields=["generated_at", "output_path", "report_path", "zip_path", "log_text", "status", "updated_at"])
+def stream_layout_path(batch: SafBatch) -> Path:
+    return batch_stream_dir(batch) / "layout.json"
 
-    if has_errors:
-        return False, "Lote generado con errores."
-    return True, "Lote generado correctamente."
+
+def save_batch_stream_layout(batch: SafBatch) -> ZipLayout:
+    """Lay out the download once (at generation) so every request serves the same bytes."""
+    layout = build_batch_stream_layout(batch)
+    layout.save(stream_layout_path(batch))
+    return layout
+
+
+def load_batch_stream_layout(batch: SafBatch) -> ZipLayout:
+    """Stored layout of a stream-mode batch; batches generated before it was stored get it now, once."""
+    path = stream_layout_path(batch)
+    if path.exists():
+        return ZipLayout.load(path)
+    return save_batch_stream_layout(batch)
 
 
 def generate_batch_scripts_only(batch: SafBatch) -> Tuple[bool, str]:
     """
-    Generate/refresh only the helper scripts (.bat/.ps1) inside an existing SAF folder
+    Generate/refresh only the helper scripts (.bat/.ps1) of an existing SAF package
     and update the ZIP, without re-generating items or changing record statuses.
+    Works on the staging folder when it was kept, otherwise directly on the ZIP.
     """
     output_root = Path(batch.output_path) if batch.output_path else (Path(settings.SAF_OUTPUT_ROOT) / batch.batch_code)
-    if not output_root.exists() or not output_root.is_dir():
+    zip_path = Path(batch.zip_path) if batch.zip_path else batch_archive_path(batch)
+    has_staging = output_root.exists() and output_root.is_dir()
+    if not has_staging and not zip_path.exists() and download_mode() == "stream":
+        try:
+            save_batch_stream_layout(batch)
+        except (ValueError, OSError) as exc:
+            return False, f"No se pudo actualizar el ZIP de descarga: {exc}"
+        return True, "Scripts actualizados en el ZIP de descarga."
+    if not has_staging and not zip_path.exists():
         return False, "No se encontró la carpeta de salida del lote."
 
-    # Rebuild targets from batch items (career folder name -> handle).
+    # Rebuild targets from batch items (career folder name -> handle). Items stay in the folder
+    # they were generated in: one whose handle was registered later moves to "<CAREER>_replace/"
+    # on the next full generation.
+    member_dirs = None
+    if not has_staging:
+        member_dirs = {name.rsplit("/", 1)[0] + "/" for name in archive_member_names(zip_path) if "/" in name}
     targets = {}
+    item_handles: Dict[str, str] = {}
     items = batch.items.select_related("record__career").all()
     for it in items:
         rec = it.record
         if not rec.career or not rec.career.handle:
             continue
-        targets[_career_folder_name(rec)] = rec.career.handle.strip()
-
-    if targets:
+        career_folder = _career_folder_name(rec)
+        replace_prefix = f"{career_folder}{REPLACE_SUFFIX}/{it.item_folder_name or f'item_{rec.nro:03d}'}/"
+        if member_dirs is None:
+            in_replace = (output_root / replace_prefix).is_dir()
+        else:
+            in_replace = replace_prefix in member_dirs
+        if it.result == SafBatchItem.RESULT_OK and in_replace:
+            targets[career_folder + REPLACE_SUFFIX] = rec.career.handle.strip()
+            if rec.dspace_handle:
+                item_handles[replace_prefix] = rec.dspace_handle.strip()
+        else:
+            targets[career_folder] = rec.career.handle.strip()
+    mapfiles = render_mapfiles(item_handles)
+
+    if has_staging and targets:
         _generate_import_bats(output_root, sorted(targets.items(), key=lambda x: x[0]))
-
-    # Refresh ZIP to include the scripts.
-    zip_path = Path(batch.zip_path) if batch.zip_path else (output_root.parent / f"{batch.batch_code}.zip")
-    if zip_path.exists():
-        zip_path.unlink()
-    zip_directory(output_root, zip_path)
+        for rel, data in mapfiles.items():
+            (output_root / rel).parent.mkdir(parents=True, exist_ok=True)
+            (output_root / rel).write_bytes(data)
+    if not zip_path.exists():
+        zip_directory(output_root, zip_path)
+    elif targets:
+        # Only the script members change: update them in the ZIP instead of rebuilding it.
+        career_folders = {name.split("/", 1)[0] for name in archive_member_names(zip_path) if "/" in name}
+        scripts = _render_import_bats(sorted(targets.items(), key=lambda x: x[0]), career_folders)
+        replacements = {name: text.encode("ascii") for name, text in scripts.items()}
+        replacements.update(mapfiles)
+        if archive_format_of(zip_path) == "zip":
+            archive = ZipArchiveWriter(
+                zip_path,
+                policy=getattr(settings, "SAF_ARCHIVE_COMPRESSION", "auto"),
+                level=int(getattr(settings, "SAF_ARCHIVE_LEVEL", 6)),
+                update=True,
+            )
+            try:
+                archive.write_members(replacements.items())
+            finally:
+                archive.close()
+        else:
+            rewrite_archive_members(
+                zip_path,
+                replacements,
+                policy=getattr(settings, "SAF_ARCHIVE_COMPRESSION", "auto"),
+                level=int(getattr(settings, "SAF_ARCHIVE_LEVEL", 6)),
+                executor=get_archive_executor(),
+            )
+    if batch_manifest_path(batch).exists() and archive_format_of(zip_path) == "zip":
+        # The scripts changed: keep manifest.csv in line with the ZIP.
+        write_batch_manifest(batch, zip_path, output_root if has_staging else None)
     batch.zip_path = str(zip_path)
     batch.save(update_fields=["zip_path", "updated_at"])
     return True, "Scripts actualizados y ZIP regenerado."
@@ -567,21 +1546,43 @@ def _render_career_bat(dspace_bin: str, eperson: str, handle: str) -> str:
     return _bat_lines(lines)
 
 
-def _generate_import_bats(output_root: Path, targets: List[Tuple[str, str]]):
+def render_mapfiles(item_handles: Dict[str, str]) -> Dict[str, bytes]:
+    """
+    ``mapfiles/map_<CAREER>_replace.map`` for items that already have a DSpace handle
+    (``item_### handle`` per line). Those items are written to ``<CAREER>_replace/`` and its
+    import scripts switch to replace mode (``-r``) because the map file exists; new items of the
+    same career stay in ``<CAREER>/`` and are still added (``-a``).
+    """
+    by_career: Dict[str, List[str]] = {}
+    for prefix in sorted(item_handles, key=_item_sort_key):
+        career, folder = prefix.rstrip("/").split("/", 1)
+        by_career.setdefault(career, []).append(f"{folder} {item_handles[prefix]}")
+    return {
+        f"mapfiles/map_{career}.map": ("\r\n".join(lines) + "\r\n").encode("utf-8")
+        for career, lines in sorted(by_career.items())
+    }
+
+
+def _dspace_import_defaults() -> Tuple[str, str]:
     # Defaults aligned with build_saf.py; can be edited by the operator on the server.
     dspace_bin = getattr(settings, "DSPACE_BIN_PATH", r"C:\dspace\bin") or r"C:\dspace\bin"
     eperson = getattr(settings, "DSPACE_IMPORT_EPERSON", "repositorio@autonomadeica.edu.pe") or "repositorio@autonomadeica.edu.pe"
+    return dspace_bin, eperson
+
+
+def _render_import_bats(targets: List[Tuple[str, str]], career_folders: Set[str]) -> Dict[str, str]:
+    """Import/export scripts keyed by their path inside the package (``/`` separated)."""
+    dspace_bin, eperson = _dspace_import_defaults()
 
-    (output_root / "importar_todo.bat").write_text(_render_importar_todo_bat(dspace_bin, eperson, targets), encoding="ascii")
+    scripts = {"importar_todo.bat": _render_importar_todo_bat(dspace_bin, eperson, targets)}
 
     for career_folder, handle in targets:
-        career_dir = output_root / career_folder
-        if not career_dir.exists() or not career_dir.is_dir():
+        if career_folder not in career_folders:
             continue
-        (career_dir / "importar.bat").write_text(_render_career_bat(dspace_bin, eperson, handle), encoding="ascii")
+        scripts[f"{career_folder}/importar.bat"] = _render_career_bat(dspace_bin, eperson, handle)
 
     # Helper to build a JSON mapping NRO -> handle/url after running DSpace import.
-    (output_root / "export_links_cmd.bat").write_text(
+    scripts["export_links_cmd.bat"] = (
         _bat_lines(
             [
                 "@echo off",
@@ -654,11 +1655,10 @@ def _generate_import_bats(output_root: Path, targets: List[Tuple[str, str]]):
                 "exit /b 0",
                 "",
             ]
-        ),
-        encoding="ascii",
+        )
     )
     # Friendly entrypoints (double-click) that won't close immediately.
-    (output_root / "export_links.bat").write_text(
+    scripts["export_links.bat"] = (
         _bat_lines(
             [
                 "@echo off",
@@ -671,10 +1671,9 @@ def _generate_import_bats(output_root: Path, targets: List[Tuple[str, str]]):
                 "exit /b %ERRORLEVEL%",
                 "",
             ]
-        ),
-        encoding="ascii",
+        )
     )
-    (output_root / "export_links_uai.bat").write_text(
+    scripts["export_links_uai.bat"] = (
         _bat_lines(
             [
                 "@echo off",
@@ -687,6 +1686,12 @@ def _generate_import_bats(output_root: Path, targets: List[Tuple[str, str]]):
                 "exit /b %ERRORLEVEL%",
                 "",
             ]
-        ),
-        encoding="ascii",
+        )
     )
+    return scripts
+
+
+def _generate_import_bats(output_root: Path, targets: List[Tuple[str, str]]):
+    career_folders = {name for name, _ in targets if (output_root / name).is_dir()}
+    for rel, text in _render_import_bats(targets, career_folders).items():
+        (output_root / rel).write_text(text, encoding="ascii")
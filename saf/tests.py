@@ -1,3 +1,1364 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from appconfig.models import CareerConfig, LicenseVersion
+from registry.models import SustentationGroup, ThesisFile, ThesisRecord
+from registry.services import compute_sha256
+from saf import archive
+from saf import manifest as manifest_module
+from saf.conversion import ConversionPool, ProcessLimits, _popen_kwargs
+from saf.conversion_cache import ConversionCache
+from saf.crosswalk import RenderCache, compile_crosswalk, norm_text
+from saf.estimate import EtaTracker, estimate_generation, learn_throughput
+from saf.events import EventLog, bus
+from saf.export import export_status
+from saf.ingest import ingest_saf
+from saf.jobs import (
+    claim_job,
+    enqueue_conversion,
+    enqueue_generation,
+    enqueue_staging,
+    heartbeat,
+    release_jobs,
+    requeue_stale_conversions,
+    run_job,
+)
+from saf.manifest import read_manifest
+from saf.models import SafBatch, SafBatchItem, SafIngestItem, SafJob
+from saf.preflight import run_preflight
+from saf.progress import BatchProgress, clear_progress, get_progress, set_progress
+from saf.scheduler import ResourceScheduler
+from saf.services import (
+    batch_profile_paths,
+    build_batch_delta,
+    convert_thesis_file,
+    generate_batch_scripts_only,
+    generate_saf_batch,
+    get_conversion_cache,
+    manifest_choices,
+)
+from saf.validator import validate_saf
+
+
+User = get_user_model()
+
+
+class SafGenerationTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.tmp / "media", SAF_OUTPUT_ROOT=self.tmp / "out")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create(username="aud", role=User.ROLE_AUDITOR)
+        LicenseVersion.objects.create(name="Lic", version="1", text_content="LICENCIA", is_active=True)
+        self.career = CareerConfig.objects.create(
+            carrera_excel="Derecho",
+            carrera_norm="DERECHO",
+            handle="20.500.14441/964",
+            renati_level="https://purl.org/pe-repo/renati/level#abogado",
+        )
+        self.group = SustentationGroup.objects.create(date="2026-03-02", name="SUSTENTACION 02.03.2026")
+
+    def make_record(self, titulo: str, with_thesis: bool = True) -> ThesisRecord:
+        record = ThesisRecord.objects.create(
+            group=self.group,
+            status=ThesisRecord.STATUS_APROBADO,
+            career=self.career,
+            titulo=titulo,
+            autor1_nombre="PEREZ, JUAN",
+            autor1_dni="12345678",
+            keywords_raw="derecho; tesis",
+        )
+        if with_thesis:
+            self.add_file(record, ThesisFile.TYPE_TESIS_PDF, "tesis.pdf", b"%PDF-1.4 " + titulo.encode())
+        self.add_file(record, ThesisFile.TYPE_FORMULARIO, "form.pdf", b"%PDF-1.4 form")
+        return record
+
+    def add_file(self, record: ThesisRecord, file_type: str, name: str, content: bytes) -> ThesisFile:
+        obj = ThesisFile(record=record, file_type=file_type, original_name=name, file=ContentFile(content, name=name))
+        obj.save()
+        return obj
+
+    def make_batch(self, code: str) -> SafBatch:
+        batch = SafBatch.objects.create(batch_code=code, created_by=self.user, group=self.group)
+        for record in self.group.records.order_by("nro"):
+            SafBatchItem.objects.create(batch=batch, record=record)
+        return batch
+
+
+def _tree(root: Path) -> dict:
+    return {p.relative_to(root).as_posix(): p.read_bytes() for p in sorted(root.rglob("*")) if p.is_file()}
+
+
+def _zip_tree(zip_path: Path) -> dict:
+    with zipfile.ZipFile(zip_path) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def _stable_tree(tree: dict) -> dict:
+    """``tree`` without what differs between runs: report timing columns and the manifest hashing them."""
+    tree = dict(tree)
+    tree.pop("manifest.csv", None)
+    if "reporte_validacion.csv" in tree:
+        rows = csv.reader(io.StringIO(tree["reporte_validacion.csv"].decode("utf-8-sig")))
+        tree["reporte_validacion.csv"] = [row[:3] for row in rows]
+    return tree
+
+
+class ParallelGenerationTests(SafGenerationTestMixin, TestCase):
+    def test_parallel_output_matches_serial(self):
+        for i in range(5):
+            self.make_record(f"Tesis {i}", with_thesis=(i != 2))
+
+        serial = self.make_batch("SERIAL")
+        ok, _ = generate_saf_batch(serial, workers=1)
+        self.assertFalse(ok)  # record without thesis
+
+        parallel = self.make_batch("PARALLEL")
+        generate_saf_batch(parallel, workers=4)
+
+        self.assertEqual(_stable_tree(_zip_tree(Path(serial.zip_path))), _stable_tree(_zip_tree(Path(parallel.zip_path))))
+        with open(parallel.report_path, encoding="utf-8-sig") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([r[0] for r in rows[1:]], [f"{r.nro:03d}" for r in self.group.records.order_by("nro")])
+        self.assertEqual(parallel.items.filter(result=SafBatchItem.RESULT_ERROR).count(), 1)
+
+
+class ZipStreamingTests(SafGenerationTestMixin, TestCase):
+    def test_zip_is_written_without_staging_and_matches_kept_staging(self):
+        self.make_record("Tesis A")
+        self.make_record("Tesis B", with_thesis=False)
+
+        direct = self.make_batch("DIRECT")
+        generate_saf_batch(direct)
+        self.assertEqual(direct.output_path, "")
+        self.assertFalse((self.tmp / "out" / "DIRECT").exists())
+        self.assertFalse((self.tmp / "out" / ".work" / "DIRECT").exists())
+        members = _zip_tree(Path(direct.zip_path))
+        self.assertIn("reporte_validacion.csv", members)
+        self.assertIn("DERECHO/importar.bat", members)
+        # The failed item leaves nothing behind in the package.
+        self.assertEqual(sorted({n.split("/")[1] for n in members if n.startswith("DERECHO/item_")}), ["item_001"])
+
+        with self.settings(SAF_KEEP_STAGING=True):
+            staged = self.make_batch("STAGED")
+            generate_saf_batch(staged)
+        self.assertEqual(_tree(Path(staged.output_path)), _zip_tree(Path(staged.zip_path)))
+        self.assertEqual(_stable_tree(members), _stable_tree(_zip_tree(Path(staged.zip_path))))
+
+    def test_staging_links_sources_and_shares_one_license_file(self):
+        first = self.make_record("Tesis A")
+        self.make_record("Tesis B")
+        with self.settings(SAF_KEEP_STAGING=True):
+            batch = self.make_batch("LINKED")
+            self.assertTrue(generate_saf_batch(batch)[0])
+
+        staged = Path(batch.output_path) / "DERECHO"
+        thesis = first.files.get(file_type=ThesisFile.TYPE_TESIS_PDF)
+        self.assertTrue(os.path.samefile(staged / "item_001" / "tesis.pdf", thesis.file.path))
+        self.assertTrue(os.path.samefile(staged / "item_001" / "license.txt", staged / "item_002" / "license.txt"))
+        self.assertEqual((staged / "item_002" / "license.txt").read_text(encoding="utf-8"), "LICENCIA")
+
+    def test_scripts_refresh_rewrites_zip_members(self):
+        self.make_record("Tesis A")
+        batch = self.make_batch("SCRIPTS")
+        self.assertTrue(generate_saf_batch(batch)[0])
+        before = _zip_tree(Path(batch.zip_path))
+
+        with self.settings(DSPACE_BIN_PATH=r"D:\dspace\bin"):
+            ok, _ = generate_batch_scripts_only(batch)
+        self.assertTrue(ok)
+        after = _zip_tree(Path(batch.zip_path))
+        self.assertEqual(set(before), set(after))
+        self.assertIn(b"D:\\dspace\\bin", after["importar_todo.bat"])
+        self.assertEqual(before["DERECHO/item_001/tesis.pdf"], after["DERECHO/item_001/tesis.pdf"])
+
+    def test_career_with_published_and_new_items_imports_both(self):
+        published = self.make_record("Tesis publicada")
+        published.dspace_handle = "20.500.14441/900"
+        published.save()
+        self.make_record("Tesis nueva")
+        batch = self.make_batch("MIXED")
+        self.assertTrue(generate_saf_batch(batch)[0])
+
+        tree = _zip_tree(Path(batch.zip_path))
+        self.assertIn("DERECHO/item_002/tesis.pdf", tree)
+        self.assertIn("DERECHO_replace/item_001/tesis.pdf", tree)
+        self.assertEqual(tree["mapfiles/map_DERECHO_replace.map"], b"item_001 20.500.14441/900\r\n")
+        # The plain folder has no map file, so its new items are still added (-a).
+        self.assertNotIn("mapfiles/map_DERECHO.map", tree)
+        self.assertIn("DERECHO/importar.bat", tree)
+        self.assertIn("DERECHO_replace/importar.bat", tree)
+        self.assertIn(b"DERECHO_replace", tree["importar_todo.bat"])
+
+        # A handle registered after the generation does not point the map at a folder the item is not in.
+        ThesisRecord.objects.filter(titulo="Tesis nueva").update(dspace_handle="20.500.14441/901")
+        self.assertTrue(generate_batch_scripts_only(batch)[0])
+        after = _zip_tree(Path(batch.zip_path))
+        self.assertEqual(after["mapfiles/map_DERECHO_replace.map"], b"item_001 20.500.14441/900\r\n")
+        self.assertNotIn("mapfiles/map_DERECHO.map", after)
+
+
+class IncrementalGenerationTests(SafGenerationTestMixin, TestCase):
+    def test_regeneration_rebuilds_only_changed_or_failed_items(self):
+        first = self.make_record("Tesis A")
+        second = self.make_record("Tesis B", with_thesis=False)
+        third = self.make_record("Tesis C")
+        batch = self.make_batch("INCR")
+        self.assertFalse(generate_saf_batch(batch)[0])
+        self.assertEqual(batch.items.exclude(fingerprint="").count(), 2)
+
+        self.add_file(second, ThesisFile.TYPE_TESIS_PDF, "tesis.pdf", b"%PDF-1.4 nueva")
+        third.titulo = "Tesis C corregida"
+        third.save()
+        self.assertTrue(generate_saf_batch(batch)[0])
+
+        self.assertIn("[OK] 001 (sin cambios)", batch.log_text)
+        self.assertNotIn("002 (sin cambios)", batch.log_text)
+        self.assertNotIn("003 (sin cambios)", batch.log_text)
+        with zipfile.ZipFile(batch.zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            names = zf.namelist()
+            self.assertEqual(len(names), len(set(names)))
+            self.assertEqual(zf.read("DERECHO/item_002/tesis.pdf"), b"%PDF-1.4 nueva")
+            self.assertIn("Tesis C corregida", zf.read("DERECHO/item_003/dublin_core.xml").decode("utf-8"))
+            self.assertNotIn(b"ERROR", zf.read("reporte_validacion.csv"))
+
+        first.files.filter(file_type=ThesisFile.TYPE_TESIS_PDF).delete()
+        self.assertFalse(generate_saf_batch(batch)[0])
+        self.assertFalse(any(n.startswith("DERECHO/item_001/") for n in _zip_tree(Path(batch.zip_path))))
+
+
+class BatchedWritesTests(SafGenerationTestMixin, TestCase):
+    def test_db_round_trips_do_not_grow_with_items(self):
+        def queries_for(code: str, count: int) -> int:
+            for i in range(count):
+                self.make_record(f"{code} {i}")
+            batch = self.make_batch(code)
+            SafBatchItem.objects.filter(batch=batch).exclude(record__titulo__startswith=code).delete()
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertTrue(generate_saf_batch(batch)[0])
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries_for("SMALL", 2), queries_for("LARGE", 12))
+        self.assertEqual(ThesisRecord.objects.exclude(status=ThesisRecord.STATUS_POR_PUBLICAR).count(), 0)
+        progress = get_progress(SafBatch.objects.get(batch_code="LARGE").id)
+        self.assertEqual((progress["done"], progress["total"], progress["status"]), (12, 12, SafBatch.STATUS_DONE))
+
+    def test_slow_items_do_not_add_flushes(self):
+        for i in range(7):
+            self.make_record(f"Lento {i}")
+        batch = self.make_batch("SLOW")
+        progress = BatchProgress(batch, 7, max_buffer=3)
+        # Each item takes a minute: only full buffers and the end are written.
+        with mock.patch("time.monotonic", side_effect=itertools.count(0, 60)), mock.patch.object(
+            progress, "flush", wraps=progress.flush
+        ) as flush:
+            for item in batch.items.select_related("record"):
+                item.result = SafBatchItem.RESULT_OK
+                progress.item_done(item, None, f"[OK] {item.record.nro:03d}")
+            progress.finish()
+        self.assertEqual(flush.call_count, 3)
+        self.assertEqual(batch.items.filter(result=SafBatchItem.RESULT_OK).count(), 7)
+
+    @override_settings(SAF_GENERATION_CHUNK_SIZE=2, SAF_LOG_TEXT_MAX_LINES=2)
+    def test_chunked_generation_streams_report_and_log(self):
+        for i in range(5):
+            self.make_record(f"Tesis {i}", with_thesis=i != 3)
+        batch = self.make_batch("CHUNKS")
+        self.assertFalse(generate_saf_batch(batch)[0])
+
+        with open(batch.report_path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([r[:2] for r in rows[1:]], [["001", "OK"], ["002", "OK"], ["003", "OK"], ["004", "ERROR"], ["005", "OK"]])
+        self.assertEqual(_zip_tree(Path(batch.zip_path))["reporte_validacion.csv"], Path(batch.report_path).read_bytes())
+        head, first = batch.log_text.splitlines()[:2]
+        self.assertTrue(head.startswith("Verificación previa: 5 registro(s), 9 archivo(s)"))
+        self.assertEqual(first, "[OK] 001")
+        self.assertIn("6 línea(s) más", batch.log_text)
+
+        self.client.force_login(self.user)
+        log = b"".join(self.client.get(reverse("saf:batches_log", args=[batch.id])).streaming_content).decode()
+        self.assertIn("[ERROR] 004 - No existe tesis en PDF o DOCX.", log)
+        self.assertEqual(log.count("[OK]"), 4)
+
+
+class StageTimingTests(SafGenerationTestMixin, TestCase):
+    def test_item_and_batch_stages_are_stored_and_reported(self):
+        self.make_record("Tesis A")
+        self.make_record("Tesis B", with_thesis=False)
+        with self.settings(SAF_KEEP_STAGING=True):
+            batch = self.make_batch("TIMINGS")
+            generate_saf_batch(batch)
+
+        ok_item = batch.items.get(result=SafBatchItem.RESULT_OK)
+        self.assertEqual(ok_item.timings["zip"]["bytes"], ok_item.timings["copy"]["bytes"])
+        self.assertGreater(ok_item.timings["zip"]["bytes"], len(b"%PDF-1.4 Tesis A"))
+        self.assertGreater(ok_item.timings["xml"]["bytes"], 0)
+        error_item = batch.items.get(result=SafBatchItem.RESULT_ERROR)
+        self.assertEqual(set(error_item.timings), {"db"})
+
+        batch.refresh_from_db()
+        for stage in ["load", "items", "report", "scripts", "close", "validation", "manifest"]:
+            self.assertIn(stage, batch.timings["stages"])
+        self.assertEqual(batch.timings["items"]["zip"]["bytes"], ok_item.timings["zip"]["bytes"])
+
+        with open(batch.report_path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0]["ZIP_BYTES"], str(ok_item.timings["zip"]["bytes"]))
+        self.assertEqual(rows[1]["CONVERT_S"], "0.000")
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("saf:batches_detail", args=[batch.id]))
+        self.assertContains(response, "Tiempos por etapa")
+        self.assertContains(response, "Escritura ZIP/tar")
+
+
+class EstimateTests(SafGenerationTestMixin, TestCase):
+    def test_throughput_is_learned_from_past_batch_timings(self):
+        mb = 1048576
+        SafBatch.objects.create(
+            batch_code="HIST",
+            created_by=self.user,
+            generated_at=timezone.now(),
+            timings={
+                "stages": {"close": {"s": 5.0, "bytes": 0, "n": 1}, "load": {"s": 9.0, "bytes": 0, "n": 1}},
+                "items": {
+                    "db": {"s": 1.0, "bytes": 0, "n": 10},
+                    "xml": {"s": 1.0, "bytes": 4000, "n": 20},
+                    "convert": {"s": 30.0, "bytes": 0, "n": 3},
+                    "zip": {"s": 2.0, "bytes": 100 * mb, "n": 10},
+                },
+            },
+        )
+        throughput = learn_throughput()
+        self.assertEqual(throughput.batches, 1)
+        self.assertAlmostEqual(throughput.item_seconds, 0.2)
+        self.assertAlmostEqual(throughput.docx_seconds, 10.0)
+        self.assertAlmostEqual(throughput.zip_mb_s, 50.0)
+        self.assertAlmostEqual(throughput.finish_s_per_mb, 0.05)
+
+        estimate = estimate_generation({1: (50 * mb, True), 2: (0, False)}, 0, workers=1, throughput=throughput)
+        self.assertAlmostEqual(estimate.items_seconds, 0.2 + 1.0 + 10.0 + 0.2)
+        self.assertAlmostEqual(estimate.finish_seconds, 2.5)
+        self.assertEqual(estimate.docx, 1)
+
+    def test_eta_follows_the_speed_of_finished_items(self):
+        tracker = EtaTracker({1: 10.0, 2: 10.0, 3: 1.0}, finish_seconds=2.0, reused_cost=0.5)
+        self.assertAlmostEqual(tracker.eta_seconds(), 23.0, places=1)
+        tracker.started -= 5.0
+        tracker.item_done(1)
+        # Twice as fast as predicted: the remaining items and the finish are halved.
+        self.assertAlmostEqual(tracker.eta_seconds(), (11.0 + 2.0) * 0.5, places=1)
+        tracker.item_done(2, reused=True)
+        self.assertAlmostEqual(tracker.total, 11.5)
+
+    def test_progress_and_preflight_carry_the_estimate(self):
+        self.make_record("Tesis A")
+        batch = self.make_batch("ESTIMATE")
+        generate_saf_batch(batch)
+        progress = get_progress(batch.id)
+        self.assertEqual(progress["estimate"]["docx"], 0)
+        self.assertEqual(progress["eta_seconds"], 0)
+
+        self.client.force_login(self.user)
+        data = self.client.get(
+            reverse("saf:groups_preflight", args=[self.group.id]), HTTP_ACCEPT="application/json"
+        ).json()
+        # The batch just generated is now part of the history.
+        self.assertEqual(data["estimate"]["throughput"]["batches"], 1)
+        self.assertIn("de generación", data["message"])
+
+
+@override_settings(SAF_PROFILE_INTERVAL_MS=1)
+class JobProfilerTests(SafGenerationTestMixin, TestCase):
+    def test_profiled_job_writes_stacks_and_memory_report(self):
+        self.make_record("Tesis A")
+        batch = self.make_batch("PROFILED")
+        self.client.force_login(self.user)
+        self.client.post(reverse("saf:batches_generate", args=[batch.id]), {"profile": "1"})
+        job = claim_job("w1")
+        self.assertTrue(job.profile)
+        self.assertTrue(run_job(job, "w1")[0])
+
+        folded, memory = batch_profile_paths(batch)
+        stacks = folded.read_text(encoding="utf-8").splitlines()
+        self.assertTrue(stacks)
+        self.assertTrue(all(line.startswith(("job;", "saf-")) and line.rsplit(" ", 1)[1].isdigit() for line in stacks))
+        self.assertIn("Pico de memoria (tracemalloc)", memory.read_text(encoding="utf-8"))
+        response = self.client.get(reverse("saf:batches_profile_download", args=[batch.id, memory.name]))
+        self.assertEqual(b"".join(response.streaming_content), memory.read_bytes())
+        self.assertContains(self.client.get(reverse("saf:batches_detail", args=[batch.id])), folded.name)
+
+    def test_jobs_without_switch_are_not_profiled(self):
+        self.make_record("Tesis A")
+        batch = self.make_batch("PLAIN")
+        enqueue_generation(batch, self.user)
+        with mock.patch("saf.profiler.profile_run") as profile_run:
+            self.assertTrue(run_job(claim_job("w1"), "w1")[0])
+        profile_run.assert_not_called()
+        self.assertFalse(any(p.exists() for p in batch_profile_paths(batch)))
+
+
+class PreflightTests(SafGenerationTestMixin, TestCase):
+    def test_reports_every_file_problem_at_once(self):
+        good = self.make_record("Buena")
+        missing = self.make_record("Sin archivo")
+        resized = self.make_record("Tamano")
+        edited = self.make_record("Editada")
+        Path(missing.files.get(file_type=ThesisFile.TYPE_TESIS_PDF).file.path).unlink()
+        Path(resized.files.get(file_type=ThesisFile.TYPE_FORMULARIO).file.path).write_bytes(b"%PDF-1.4 otro formulario")
+        thesis = edited.files.get(file_type=ThesisFile.TYPE_TESIS_PDF)
+        thesis.sha256 = compute_sha256(thesis.file.path)
+        thesis.save(update_fields=["sha256"])
+        Path(thesis.file.path).write_bytes(b"%PDF-1.4 Editado")  # same size, other bytes
+
+        records = ThesisRecord.objects.filter(group=self.group).prefetch_related("files").order_by("nro")
+        self.assertEqual(set(run_preflight(records, verify_hash=False).record_errors()), {missing.id, resized.id})
+        report = run_preflight(records, verify_hash=True)
+        self.assertEqual(set(report.record_errors()), {missing.id, resized.id, edited.id})
+        self.assertNotIn(good.id, report.record_errors())
+        self.assertEqual((report.records, report.files, report.blocking), (4, 8, []))
+
+        # The web request only stats the files; hashing (and soffice) run in a queued worker job.
+        self.client.force_login(self.user)
+        url = reverse("saf:groups_preflight", args=[self.group.id])
+        with mock.patch("saf.preflight.compute_sha256", side_effect=AssertionError("hashed in the web")), mock.patch(
+            "saf.preflight.get_conversion_pool", side_effect=AssertionError("soffice in the web")
+        ):
+            data = self.client.get(url + "?sha256=1", HTTP_ACCEPT="application/json").json()
+        self.assertFalse(data["ok"])
+        self.assertEqual(sorted(i["nro"] for i in data["issues"]), [missing.nro, resized.nro])
+        self.assertEqual(data["full_check"]["status"], SafJob.STATUS_QUEUED)
+        job = claim_job("w1")
+        self.assertEqual(job.kind, SafJob.KIND_PREFLIGHT)
+        run_job(job, "w1")
+        data = self.client.get(url, HTTP_ACCEPT="application/json").json()
+        self.assertEqual(data["full_check"]["status"], SafJob.STATUS_DONE)
+        self.assertIn("SHA-256 distinto", data["full_check"]["message"])
+        self.assertEqual(SafJob.objects.filter(kind=SafJob.KIND_PREFLIGHT).count(), 1)
+
+        batch = self.make_batch("PREFLIGHT")
+        with override_settings(SAF_PREFLIGHT_SHA256=True):
+            self.assertFalse(generate_saf_batch(batch)[0])
+        results = dict(batch.items.values_list("record_id", "result"))
+        self.assertEqual(results[good.id], SafBatchItem.RESULT_OK)
+        self.assertEqual(results[edited.id], SafBatchItem.RESULT_ERROR)
+        self.assertIn("SHA-256 distinto", batch.items.get(record=edited).detail)
+
+    def test_blocking_problems_stop_generation_before_output(self):
+        record = self.make_record("Docx", with_thesis=False)
+        self.add_file(record, ThesisFile.TYPE_TESIS_DOCX, "tesis.docx", b"PK docx")
+        batch = self.make_batch("BLOCKED")
+        with mock.patch("saf.preflight.get_conversion_pool", return_value=None), mock.patch(
+            "saf.preflight._free_bytes", return_value=10
+        ):
+            ok, msg = generate_saf_batch(batch)
+        self.assertFalse(ok)
+        self.assertEqual(batch.status, SafBatch.STATUS_FAILED)
+        self.assertIn("no se encontró LibreOffice", batch.log_text)
+        self.assertIn("Espacio insuficiente", batch.log_text)
+        self.assertFalse(Path(batch.zip_path or self.tmp / "out" / "BLOCKED.zip").exists())
+        self.assertFalse((self.tmp / "out" / ".work" / "BLOCKED").exists())
+
+
+class CareerPartsTests(SafGenerationTestMixin, TestCase):
+    @override_settings(SAF_SPLIT_BY_CAREER=True, SAF_VOLUME_MAX_MB=0.0001)
+    def test_parts_per_career_split_in_volumes(self):
+        other = CareerConfig.objects.create(carrera_excel="Medicina", carrera_norm="MEDICINA", handle="20.500.14441/970")
+        for i in range(2):
+            self.make_record(f"Derecho {i}")
+        record = self.make_record("Medicina")
+        record.career = other
+        record.save(update_fields=["career"])
+        batch = self.make_batch("PARTS")
+        self.assertTrue(generate_saf_batch(batch)[0])
+
+        full = _zip_tree(Path(batch.zip_path))
+        parts_dir = self.tmp / "out" / "PARTS_partes"
+        names = sorted(p.name for p in parts_dir.iterdir())
+        self.assertEqual(names, ["PARTS_DERECHO_vol01.zip", "PARTS_DERECHO_vol02.zip", "PARTS_MEDICINA.zip"])
+        vol2 = _zip_tree(parts_dir / "PARTS_DERECHO_vol02.zip")
+        self.assertEqual(vol2["DERECHO_vol02/item_002/tesis.pdf"], full["DERECHO/item_002/tesis.pdf"])
+        self.assertFalse(any(n.startswith("DERECHO_vol02/item_001/") for n in vol2))
+        self.assertIn(b"20.500.14441/964", vol2["DERECHO_vol02/importar.bat"])
+        medicina = _zip_tree(parts_dir / "PARTS_MEDICINA.zip")
+        self.assertIn("MEDICINA/item_003/dublin_core.xml", medicina)
+        self.assertIn(b"20.500.14441/970", medicina["MEDICINA/importar.bat"])
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("saf:batches_part_download", args=[batch.id, "PARTS_MEDICINA.zip"]))
+        self.assertEqual(b"".join(response.streaming_content), (parts_dir / "PARTS_MEDICINA.zip").read_bytes())
+        missing = self.client.get(reverse("saf:batches_part_download", args=[batch.id, "PARTS.zip"]))
+        self.assertEqual(missing.status_code, 404)
+
+
+class ManifestDeltaTests(SafGenerationTestMixin, TestCase):
+    def test_delta_contains_only_changed_items(self):
+        records = [self.make_record(f"Tesis {i}") for i in range(3)]
+        batch = self.make_batch("DELTA")
+        self.assertTrue(generate_saf_batch(batch)[0])
+        self.assertIn("Validación SAF: 3 item(s)", batch.log_text)
+        self.assertIn("0 item(s) con errores", batch.log_text)
+        tree = _zip_tree(Path(batch.zip_path))
+        manifest = read_manifest(self.tmp / "out" / "DELTA_manifest.csv")
+        self.assertEqual(manifest["DERECHO/item_001/tesis.pdf"].sha256, hashlib.sha256(tree["DERECHO/item_001/tesis.pdf"]).hexdigest())
+        self.assertEqual(set(manifest), set(tree) - {"manifest.csv"})
+
+        records[1].titulo = "Tesis 1 corregida"
+        records[1].save()
+        batch.items.filter(record=records[2]).delete()
+        with mock.patch("saf.manifest._hash_member", wraps=manifest_module._hash_member) as hashed:
+            self.assertTrue(generate_saf_batch(batch)[0])
+        hashed_names = {c.args[1] for c in hashed.call_args_list}
+        self.assertIn("DERECHO/item_002/dublin_core.xml", hashed_names)
+        self.assertFalse(any(n.startswith("DERECHO/item_001/") for n in hashed_names))
+
+        # A rewritten member is hashed again even when its size and CRC-32 did not change.
+        zip_path = Path(batch.zip_path)
+        forged = {
+            name: manifest_module.ManifestEntry(e.size, e.crc32, "0" * 64)
+            for name, e in read_manifest(self.tmp / "out" / "DELTA_manifest.csv").items()
+        }
+        with mock.patch("saf.validator.ZipFile", wraps=zipfile.ZipFile) as opened:
+            fresh = manifest_module.zip_manifest(zip_path, forged, workers=2, unchanged={"DERECHO/item_001/"})
+        self.assertLessEqual(opened.call_count, 1 + 2)
+        self.assertEqual(fresh["DERECHO/item_001/tesis.pdf"].sha256, "0" * 64)
+        self.assertEqual(fresh["DERECHO/item_002/tesis.pdf"].sha256, hashlib.sha256(_zip_tree(zip_path)["DERECHO/item_002/tesis.pdf"]).hexdigest())
+
+        bases = [p.name for p in manifest_choices(exclude=batch)]
+        self.assertEqual(len(bases), 1)
+        self.assertTrue(bases[0].startswith("DELTA_manifest_"))
+        ok, msg = build_batch_delta(batch, bases[0])
+        self.assertTrue(ok, msg)
+        self.assertIn("1 item(s) nuevos o cambiados, 1 eliminados", msg)
+        delta_zip = next((self.tmp / "out" / "DELTA_deltas").glob("*.zip"))
+        delta = _zip_tree(delta_zip)
+        self.assertIn("DERECHO/item_002/tesis.pdf", delta)
+        self.assertFalse(any(n.startswith("DERECHO/item_001/") for n in delta))
+        self.assertEqual(delta["delta_items.txt"], b"DERECHO\\item_002\r\n")
+        self.assertEqual(delta["delta_eliminar.txt"], b"DERECHO\\item_003\r\n")
+        self.assertIn(b"importar_todo.bat", delta["delta_archivos.txt"])
+        self.assertIn(b"certutil -hashfile", delta["aplicar_delta.bat"])
+        self.assertEqual(delta["manifest.csv"], (self.tmp / "out" / "DELTA_manifest.csv").read_bytes())
+
+        self.assertFalse(build_batch_delta(batch, "../DELTA_manifest.csv")[0])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("saf:batches_delta_download", args=[batch.id, delta_zip.name]))
+        self.assertEqual(b"".join(response.streaming_content), delta_zip.read_bytes())
+
+
+class StreamingDownloadTests(SafGenerationTestMixin, TestCase):
+    def _body(self, response) -> bytes:
+        return b"".join(response.streaming_content)
+
+    def test_stream_mode_serves_ranges_from_sources(self):
+        self.make_record("Tesis A")
+        self.make_record("Tesis B", with_thesis=False)
+        with self.settings(SAF_DOWNLOAD_MODE="stream"):
+            batch = self.make_batch("STREAM")
+            generate_saf_batch(batch)
+            self.assertFalse(Path(batch.zip_path).exists())
+
+            self.client.force_login(self.user)
+            url = reverse("saf:batches_download", args=[batch.id])
+            full = self.client.get(url)
+            body = self._body(full)
+            self.assertEqual(int(full["Content-Length"]), len(body))
+            self.assertEqual(full["Accept-Ranges"], "bytes")
+
+            part = self.client.get(url, HTTP_RANGE="bytes=100-", HTTP_IF_RANGE=full["ETag"])
+            self.assertEqual(part.status_code, 206)
+            self.assertEqual(part["Content-Range"], f"bytes 100-{len(body) - 1}/{len(body)}")
+            self.assertEqual(body[:100] + self._body(part), body)
+            self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=100-", HTTP_IF_RANGE='"otro"').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_RANGE=f"bytes={len(body)}-").status_code, 416)
+            self.assertEqual(self._body(self.client.get(url)), body)
+
+        zip_path = self.tmp / "stream.zip"
+        zip_path.write_bytes(body)
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            names = zf.namelist()
+            self.assertIn("DERECHO/item_001/tesis.pdf", names)
+            self.assertFalse(any(n.startswith("DERECHO/item_002/") for n in names))
+            self.assertIn(b"ERROR", zf.read("reporte_validacion.csv"))
+
+
+class ProgressEventsTests(SafGenerationTestMixin, TestCase):
+    def test_sse_stream_sends_item_deltas_until_done(self):
+        record = self.make_record("Tesis A")
+        batch = self.make_batch("SSE")
+        batch.status = SafBatch.STATUS_RUNNING
+        batch.save(update_fields=["status"])
+        set_progress(batch.id, {"status": SafBatch.STATUS_RUNNING, "total": 1, "done": 0, "percent": 0, "message": ""})
+
+        def publish():
+            time.sleep(0.3)
+            bus.publish(batch.id, {"type": "item", "nro": record.nro, "result": SafBatchItem.RESULT_PENDING, "stage": "tesis"})
+            bus.publish(batch.id, {"type": "item", "nro": record.nro, "result": SafBatchItem.RESULT_OK, "stage": "listo"})
+            bus.publish(batch.id, {"type": "progress", "status": SafBatch.STATUS_DONE, "total": 1, "done": 1, "percent": 100})
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("saf:groups_events", args=[self.group.id]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        worker = threading.Thread(target=publish)
+        worker.start()
+        body = b"".join(response.streaming_content).decode()
+        worker.join()
+        self.assertIn("event: items", body)
+        self.assertIn(f'"nro": {record.nro}, "result": "OK", "stage": "listo"', body)
+        self.assertIn('"status": "DONE"', body)
+
+        # A finished job ends the stream right after the snapshot.
+        set_progress(batch.id, {"status": SafBatch.STATUS_DONE, "total": 1, "done": 1, "percent": 100, "message": ""})
+        body = b"".join(self.client.get(reverse("saf:groups_events", args=[self.group.id])).streaming_content).decode()
+        self.assertEqual(body.count("event: progress"), 1)
+
+    def test_streams_over_the_cap_fall_back_to_polling(self):
+        self.make_record("Tesis A")
+        batch = self.make_batch("SSECAP")
+        set_progress(batch.id, {"status": SafBatch.STATUS_RUNNING, "total": 1, "done": 0, "percent": 0, "message": ""})
+        url = reverse("saf:groups_events", args=[self.group.id])
+        self.client.force_login(self.user)
+        with self.settings(SAF_SSE_MAX_STREAMS=1):
+            first = self.client.get(url)
+            self.assertEqual(first["Content-Type"], "text/event-stream")
+            # The first stream holds the only slot (and a server thread) until it is closed.
+            self.assertEqual(self.client.get(url).status_code, 204)
+            first.close()
+            second = self.client.get(url)
+            self.assertEqual(second.status_code, 200)
+            second.close()
+        self.assertEqual(self.client.get(reverse("saf:groups_progress", args=[self.group.id])).json()["status"], SafBatch.STATUS_RUNNING)
+
+    def test_stream_follows_worker_log_without_db_queries(self):
+        self.make_record("Tesis A")
+        batch = self.make_batch("SSELOG")
+        batch.status = SafBatch.STATUS_RUNNING
+        batch.save(update_fields=["status"])
+        # The worker process has its own log instance and the cache is not shared (LocMem).
+        clear_progress(batch.id)
+        worker_log = EventLog(Path(settings.SAF_OUTPUT_ROOT) / ".events")
+
+        def publish():
+            time.sleep(0.3)
+            worker_log.publish(batch.id, {"type": "progress", "status": SafBatch.STATUS_RUNNING, "total": 1, "done": 0, "percent": 0, "message": "a"})
+            time.sleep(0.3)
+            worker_log.publish(batch.id, {"type": "progress", "status": SafBatch.STATUS_DONE, "total": 1, "done": 1, "percent": 100, "message": "b"})
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("saf:groups_events", args=[self.group.id]))
+        worker = threading.Thread(target=publish)
+        worker.start()
+        with CaptureQueriesContext(connection) as queries:
+            body = b"".join(response.streaming_content).decode()
+        worker.join()
+        self.assertEqual(len(queries), 0)
+        self.assertIn('"message": "a"', body)
+        self.assertIn('"status": "DONE"', body)
+        self.assertEqual(get_progress(batch.id)["message"], "b")
+
+    def test_item_deltas_from_worker_generation_reach_the_stream(self):
+        records = [self.make_record(f"Tesis {i}") for i in range(3)]
+        batch = self.make_batch("SSEGEN")
+        batch.status = SafBatch.STATUS_RUNNING
+        batch.save(update_fields=["status"])
+        clear_progress(batch.id)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("saf:groups_events", args=[self.group.id]))
+
+        chunks = []
+        reader = threading.Thread(target=lambda: chunks.extend(response.streaming_content))
+        reader.start()
+        # saf_worker publishes through its own log instance; the view only shares the directory.
+        with mock.patch("saf.progress.bus", EventLog(Path(settings.SAF_OUTPUT_ROOT) / ".events")):
+            self.assertTrue(generate_saf_batch(batch)[0])
+        reader.join(10)
+        body = b"".join(chunks).decode()
+
+        self.assertFalse(reader.is_alive())
+        self.assertIn("event: items", body)
+        for record in records:
+            self.assertIn(f'"nro": {record.nro}, "result": "OK", "stage": "listo"', body)
+        self.assertIn('"status": "DONE"', body)
+
+
+class JobQueueMixin(SafGenerationTestMixin):
+    def setUp(self):
+        super().setUp()
+        self.group.status = SustentationGroup.STATUS_APROBADO
+        self.group.save(update_fields=["status"])
+        self.make_record("Tesis A")
+        self.client.force_login(self.user)
+
+    def _enqueue(self):
+        url = reverse("saf:groups_generate", args=[self.group.id])
+        return self.client.post(url, HTTP_ACCEPT="application/json").json()
+
+
+class JobQueueTests(JobQueueMixin, TestCase):
+    def test_expired_lease_is_reclaimed_until_max_attempts(self):
+        with mock.patch("saf.services.generate_saf_batch") as generate:
+            self.assertTrue(self._enqueue()["ok"])
+            self.assertTrue(self._enqueue()["ok"])
+            generate.assert_not_called()
+        job = claim_job("w1")
+        self.assertEqual(job.batch.status, SafBatch.STATUS_RUNNING)
+        self.assertIsNone(claim_job("w2"))
+        self.assertEqual(heartbeat("w1", [job.id]), 1)
+        self.assertEqual(heartbeat("w2", [job.id]), 0)
+
+        release_jobs("w1", [job.id])
+        self.assertEqual(claim_job("w2").attempts, 1)
+        with self.settings(SAF_JOB_MAX_ATTEMPTS=2):
+            for worker in ("w3", "w4"):
+                SafJob.objects.filter(pk=job.id).update(lease_expires_at=timezone.now() - timezone.timedelta(seconds=1))
+                claimed = claim_job(worker)
+            self.assertIsNone(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker_id, job.attempts), (SafJob.STATUS_FAILED, "w3", 2))
+        self.assertEqual(job.batch.status, SafBatch.STATUS_FAILED)
+
+    def test_batch_lock_blocks_second_job_when_busy_check_is_stale(self):
+        with mock.patch("saf.services.generate_saf_batch"):
+            self.assertTrue(self._enqueue()["ok"])
+        first = claim_job("w1")
+        SafJob.objects.filter(pk=first.pk).update(lease_expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        SafJob.objects.create(kind=SafJob.KIND_STAGE, batch=first.batch)
+        self.assertEqual(claim_job("w2").id, first.id)
+        # A claimer whose busy check ran before w2 committed still sees the live job under the batch lock.
+        with mock.patch("saf.jobs.Exists", lambda qs: Q(pk__isnull=True)):
+            self.assertIsNone(claim_job("w3"))
+        self.assertEqual(SafJob.objects.filter(status=SafJob.STATUS_RUNNING).count(), 1)
+
+
+    def test_approved_items_are_staged_and_reused_by_generation(self):
+        first = ThesisRecord.objects.get(titulo="Tesis A")
+        second = self.make_record("Tesis B")
+        stage = enqueue_staging(first, self.user)
+        self.assertEqual(enqueue_staging(second, self.user), stage)
+        self.assertEqual(claim_job("w1").id, stage.id)
+        # Jobs of the same batch wait while the staging writes its archive.
+        SafJob.objects.create(kind=SafJob.KIND_GENERATE, batch=stage.batch)
+        self.assertIsNone(claim_job("w2"))
+
+        ok, msg = run_job(stage, "w1")
+        self.assertTrue(ok)
+        self.assertIn("Items preparados: 2", msg)
+        batch = SafBatch.objects.get(pk=stage.batch_id)
+        self.assertEqual(batch.status, SafBatch.STATUS_CREATED)
+        self.assertEqual(set(batch.items.values_list("result", flat=True)), {SafBatchItem.RESULT_OK})
+        self.assertFalse(ThesisRecord.objects.filter(status=ThesisRecord.STATUS_POR_PUBLICAR).exists())
+
+        with mock.patch("saf.services._stage_thesis", side_effect=AssertionError("item rebuilt")):
+            self.assertTrue(generate_saf_batch(batch)[0])
+        self.assertEqual(batch.log_text.count("(sin cambios)"), 2)
+        self.assertEqual(ThesisRecord.objects.filter(status=ThesisRecord.STATUS_POR_PUBLICAR).count(), 2)
+        names = _zip_tree(Path(batch.zip_path))
+        self.assertEqual(len([n for n in names if n.endswith("/tesis.pdf")]), 2)
+        self.assertIn("reporte_validacion.csv", names)
+
+
+class BulkExportTests(SafGenerationTestMixin, TestCase):
+    def test_export_keeps_handles_and_resumes_unfinished_parts(self):
+        other_group = SustentationGroup.objects.create(date="2026-05-04", name="SUSTENTACION 04.05.2026")
+        published = []
+        for i in range(3):
+            record = self.make_record(f"Tesis {i}")
+            if i == 2:
+                record.group = other_group
+            record.status = ThesisRecord.STATUS_PUBLICADO
+            record.dspace_handle = f"20.500.14441/{100 + i}"
+            record.save()
+            published.append(record)
+        self.make_record("Tesis aprobada")
+
+        out = io.StringIO()
+        call_command("saf_export", "--to", "2026-04-30", "--dry-run", stdout=out)
+        self.assertIn("Registros seleccionados: 2", out.getvalue())
+        call_command("saf_export", "--batch-size", "2", "--user", self.user.username, stdout=out)
+        code = SafBatch.objects.exclude(export_code="").values_list("export_code", flat=True).first()
+        parts = list(SafBatch.objects.filter(export_code=code).order_by("batch_code"))
+        self.assertEqual([p.batch_code for p in parts], [f"{code}_P001", f"{code}_P002"])
+        self.assertEqual([p.items.count() for p in parts], [2, 1])
+
+        job = claim_job("w1")
+        self.assertTrue(run_job(job, "w1")[0])
+        # The second part is interrupted (worker gone, attempts exhausted): resume queues only it.
+        second = claim_job("w2")
+        SafJob.objects.filter(pk=second.pk).update(status=SafJob.STATUS_FAILED)
+        SafBatch.objects.filter(pk=second.batch_id).update(status=SafBatch.STATUS_FAILED)
+        self.assertEqual(export_status(code).parts_done, 1)
+        call_command("saf_export", "--resume", code, stdout=out)
+        self.assertIn(f"{code}: 1 parte(s) en cola de nuevo.", out.getvalue())
+        job = claim_job("w1")
+        self.assertEqual(job.batch_id, second.batch_id)
+        self.assertTrue(run_job(job, "w1")[0])
+
+        status = export_status(code)
+        self.assertTrue(status.finished)
+        self.assertEqual((status.parts_done, status.items_ok), (2, 3))
+        self.assertIn("registro(s)/min", status.summary())
+        self.assertEqual(ThesisRecord.objects.filter(status=ThesisRecord.STATUS_PUBLICADO).count(), 3)
+        parts[0].refresh_from_db()
+        tree = _zip_tree(Path(parts[0].zip_path))
+        self.assertEqual(
+            tree["mapfiles/map_DERECHO_replace.map"],
+            f"item_{published[0].nro:03d} 20.500.14441/100\r\nitem_{published[1].nro:03d} 20.500.14441/101\r\n".encode(),
+        )
+        self.assertIn("Validación SAF: 2 item(s)", parts[0].log_text)
+
+
+class SafIngestTests(SafGenerationTestMixin, TestCase):
+    def _write_build_saf_tree(self, root: Path) -> Path:
+        # Same layout as build_saf.py: out_saf/<CARRERA>/item_###/ plus the career importar.bat.
+        crosswalk = compile_crosswalk({"year": "2019"})
+        values = {
+            "title": "Tesis historica",
+            "author1": "ROJAS, ANA",
+            "author1_dni": "11111111",
+            "author2": "LUNA, LUIS",
+            "author2_dni": "22222222",
+            "advisor": "DIAZ, CARLOS",
+            "juror1": "J1",
+            "juror2": "J2",
+            "abstract": "Resumen",
+            "keywords": "derecho; historia",
+        }
+        item = root / "out_saf" / "DERECHO" / "item_007"
+        item.mkdir(parents=True)
+        for name, data in crosswalk.render(values, career={"renati_level": "x"}).files.items():
+            (item / name).write_bytes(data)
+        (item / "tesis.pdf").write_bytes(b"%PDF-1.4 historica")
+        (item / "formulario_1.pdf").write_bytes(b"%PDF-1.4 formulario")
+        (item / "license.txt").write_text("L")
+        (item / "contents").write_text(
+            "license.txt\tbundle:LICENSE\ntesis.pdf\tbundle:ORIGINAL\tprimary:true\nformulario_1.pdf\tbundle:ORIGINAL\n"
+        )
+        (root / "out_saf" / "DERECHO" / "importar.bat").write_text('set "HANDLE=20.500.14441/964"\r\n')
+        (root / "mapfiles").mkdir()
+        (root / "mapfiles" / "map_DERECHO_20190101.map").write_text("item_007 20.500.14441/555\n")
+        return root
+
+    def test_ingests_tree_and_links_known_theses_idempotently(self):
+        existing = self.make_record("Tesis A")
+        for f in existing.files.all():
+            ThesisFile.objects.filter(pk=f.pk).update(sha256=compute_sha256(f.file.path))
+        batch = self.make_batch("INGEST")
+        self.assertTrue(generate_saf_batch(batch)[0])
+        report = ingest_saf(Path(batch.zip_path), workers=2)
+        self.assertEqual((report.items, report.created, report.linked), (1, 0, 1))
+        self.assertEqual(SafIngestItem.objects.get().record, existing)
+
+        tree = self._write_build_saf_tree(self.tmp / "legacy")
+        out = io.StringIO()
+        call_command("saf_ingest", str(tree), "--workers", "3", "--all", stdout=out)
+        self.assertIn("nuevos: 1", out.getvalue())
+        record = ThesisRecord.objects.get(titulo="Tesis historica")
+        self.assertEqual(
+            (record.autor2_nombre, record.autor2_dni, record.asesor_nombre, record.jurado2, record.keywords_raw),
+            ("LUNA, LUIS", "22222222", "DIAZ, CARLOS", "J2", "derecho; historia"),
+        )
+        self.assertEqual(record.career, self.career)
+        self.assertEqual((record.status, record.dspace_handle), (ThesisRecord.STATUS_PUBLICADO, "20.500.14441/555"))
+        self.assertEqual(record.group.name, "SAF HISTORICO 2019")
+        self.assertEqual(record.group.status, SustentationGroup.STATUS_PUBLICADO)
+        files = {f.file_type: f for f in record.files.all()}
+        self.assertEqual(set(files), {ThesisFile.TYPE_TESIS_PDF, ThesisFile.TYPE_FORMULARIO})
+        thesis = files[ThesisFile.TYPE_TESIS_PDF]
+        self.assertEqual(thesis.sha256, hashlib.sha256(b"%PDF-1.4 historica").hexdigest())
+        self.assertEqual(Path(thesis.file.path).read_bytes(), b"%PDF-1.4 historica")
+
+        again = ingest_saf(tree)
+        self.assertEqual((again.skipped, again.created), (1, 0))
+        self.assertEqual(ThesisRecord.objects.filter(titulo="Tesis historica").count(), 1)
+
+    def test_zip_ingest_reads_members_with_one_zipfile_per_thread(self):
+        tree = self._write_build_saf_tree(self.tmp / "legacy") / "out_saf"
+        item = tree / "DERECHO" / "item_007"
+        zip_path = self.tmp / "historico.zip"
+        with zipfile.ZipFile(zip_path, "w") as zf:
+            zf.write(tree / "DERECHO" / "importar.bat", "DERECHO/importar.bat")
+            for n in range(1, 61):
+                for f in item.iterdir():
+                    data = f.read_bytes() + (f" {n}".encode() if f.name == "tesis.pdf" else b"")
+                    zf.writestr(f"DERECHO/item_{n:03d}/{f.name}", data)
+
+        with mock.patch("saf.validator.ZipFile", wraps=zipfile.ZipFile) as opened:
+            report = ingest_saf(zip_path, workers=3, chunk_size=25)
+        self.assertEqual((report.items, report.created, report.failed), (60, 60, 0))
+        self.assertLessEqual(opened.call_count, 1 + 1 + 3)
+        nros = list(ThesisRecord.objects.filter(titulo="Tesis historica").order_by("nro").values_list("nro", flat=True))
+        self.assertEqual(nros, list(range(nros[0], nros[0] + 60)))
+
+
+class JobWorkerTests(JobQueueMixin, TransactionTestCase):
+    # The worker runs jobs in its own threads: they need committed rows.
+    def test_worker_runs_queued_job(self):
+        self._enqueue()
+        call_command("saf_worker", "--once", stdout=io.StringIO())
+        job = SafJob.objects.select_related("batch").get()
+        self.assertEqual((job.status, job.attempts), (SafJob.STATUS_DONE, 1))
+        self.assertEqual(job.batch.status, SafBatch.STATUS_DONE)
+        self.assertTrue(Path(job.batch.zip_path).exists())
+
+
+class CrosswalkTests(unittest.TestCase):
+    def test_norm_text_folds_accents_and_spaces(self):
+        self.assertEqual(norm_text("  Ingeniería   de\tSistemas "), "INGENIERIA DE SISTEMAS")
+        self.assertEqual(norm_text("Psicología ǅ ḉ"), "PSICOLOGIA Ǆ C")
+
+    def test_career_blocks_and_render_cache(self):
+        cache = RenderCache()
+        crosswalk = compile_crosswalk({"year": "2026"}, cache=cache)
+        career = {"thesis_degree_name": "Abogado & Co", "renati_level": "https://purl.org/level"}
+        values = {"title": "Tesis <uno>", "author1": "PEREZ", "author1_dni": "12345678.0", "keywords": "a; b; A"}
+
+        first = crosswalk.render(values, career, career_key=1, cache_key=(1, "t1"))
+        self.assertIs(crosswalk.render(values, career, career_key=1, cache_key=(1, "t1")), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(sorted(first.files), ["dublin_core.xml", "metadata_renati.xml", "metadata_thesis.xml"])
+        dc = first.files["dublin_core.xml"].decode()
+        self.assertIn('<dcvalue element="title" language="es">Tesis &lt;uno&gt;</dcvalue>', dc)
+        self.assertEqual(dc.count('element="subject"'), 2)
+        self.assertIn(">12345678<", first.files["metadata_renati.xml"].decode())
+        self.assertIn("Abogado &amp; Co", first.files["metadata_thesis.xml"].decode())
+
+        # A new updated_at renders again; the career block is reused as is.
+        second = crosswalk.render({**values, "title": "Otra"}, career, career_key=1, cache_key=(1, "t2"))
+        self.assertIsNot(second, first)
+        self.assertEqual(second.files["metadata_thesis.xml"], first.files["metadata_thesis.xml"])
+        self.assertEqual(list(crosswalk.render(values).files), ["dublin_core.xml", "metadata_renati.xml"])
+
+
+class SafValidatorTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def test_reports_structural_problems_per_item(self):
+        dc = b'<?xml version="1.0" encoding="utf-8"?><dublin_core schema="dc"><dcvalue element="title">T</dcvalue></dublin_core>'
+        good_contents = b"license.txt\tbundle:LICENSE\ntesis.pdf\tbundle:ORIGINAL\tprimary:true\n"
+        zip_path = self.tmp / "saf.zip"
+        with zipfile.ZipFile(zip_path, "w") as zf:
+            for name, data in [
+                ("DERECHO/item_001/dublin_core.xml", dc),
+                ("DERECHO/item_001/metadata_thesis.xml", b'<dublin_core schema="thesis"/>'),
+                ("DERECHO/item_001/contents", good_contents),
+                ("DERECHO/item_001/license.txt", b"L"),
+                ("DERECHO/item_001/tesis.pdf", b"%PDF"),
+                ("DERECHO/item_002/dublin_core.xml", b"<dublin_core><dcvalue>"),
+                ("DERECHO/item_002/metadata_renati.xml", b'<dublin_core schema="thesis"/>'),
+                ("DERECHO/item_002/contents", b"tesis.pdf\tbundle:ORIGNAL\tprimary:true\nform.pdf\tprimary:true\n"),
+                ("DERECHO/item_002/form.pdf", b"%PDF"),
+                ("DERECHO/item_002/notas.txt", b"x"),
+                ("DERECHO/item_2/contents", good_contents),
+                ("README.txt", b"ok"),
+            ]:
+                zf.writestr(name, data)
+
+        report = validate_saf(zip_path, workers=3)
+        self.assertFalse(report.ok)
+        self.assertEqual(report.members, 12)
+        self.assertEqual(report.items["DERECHO/item_001/"].errors, [])
+        errors = " | ".join(report.items["DERECHO/item_002/"].errors)
+        for expected in [
+            "dublin_core.xml mal formado",
+            'metadata_renati.xml: schema="thesis", se esperaba "renati"',
+            'bundle desconocido "ORIGNAL"',
+            "más de un archivo primary:true",
+            "tesis.pdf figura en contents pero no existe",
+        ]:
+            self.assertIn(expected, errors)
+        self.assertIn("notas.txt", report.items["DERECHO/item_002/"].warnings[0])
+        self.assertIn("falta dublin_core.xml", report.items["DERECHO/item_2/"].errors)
+        self.assertEqual(report.errors, ["Carpetas de item duplicadas: DERECHO/item_002, DERECHO/item_2"])
+        self.assertIn("[ERROR] DERECHO/item_002 - ", "\n".join(report.lines()))
+
+        # The same tree unpacked (build_saf.py output) gives the same per-item result.
+        with zipfile.ZipFile(zip_path) as zf:
+            zf.extractall(self.tmp / "tree")
+        unpacked = validate_saf(self.tmp / "tree")
+        self.assertEqual(
+            {p: i.errors for p, i in unpacked.items.items()}, {p: i.errors for p, i in report.items.items()}
+        )
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command("validate_saf", str(zip_path), "--all", stdout=out)
+        self.assertIn("[OK] DERECHO/item_001", out.getvalue())
+
+    def test_large_zip_is_read_with_one_zipfile_per_thread(self):
+        dc = b'<dublin_core schema="dc"><dcvalue element="title">T</dcvalue></dublin_core>'
+        zip_path = self.tmp / "big.zip"
+        with zipfile.ZipFile(zip_path, "w") as zf:
+            for n in range(1, 1501):
+                zf.writestr(f"DERECHO/item_{n:04d}/dublin_core.xml", dc)
+                zf.writestr(f"DERECHO/item_{n:04d}/contents", b"tesis.pdf\tbundle:ORIGINAL\n")
+                zf.writestr(f"DERECHO/item_{n:04d}/tesis.pdf", b"%PDF")
+
+        with mock.patch("saf.validator.ZipFile", wraps=zipfile.ZipFile) as opened:
+            report = validate_saf(zip_path, workers=4)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.members, 4500)
+        # One directory parse for the listing plus at most one per worker thread.
+        self.assertLessEqual(opened.call_count, 1 + 4)
+
+
+class ArchiveEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.pdf = self.tmp / "tesis.pdf"
+        self.pdf.write_bytes(b"%PDF-1.4 " + b"a" * 5000)
+        self.blob = self.tmp / "blob.bin"
+        self.blob.write_bytes(os.urandom(4096))
+        self.members = [
+            ("X/item_001/tesis.pdf", self.pdf),
+            ("X/item_001/dublin_core.xml", b"<dublin_core>" + b"<dcvalue/>" * 200 + b"</dublin_core>"),
+            ("X/item_001/blob.bin", self.blob),
+            ("X/item_001/notas", b"texto " * 500),
+        ]
+
+    def test_zip_policy_stores_compressed_members_and_deflates_text(self):
+        zip_path = self.tmp / "p.zip"
+        writer = archive.ZipArchiveWriter(zip_path)
+        writer.write_members(self.members)
+        writer.close()
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            methods = {i.filename.rsplit("/", 1)[-1]: i.compress_type for i in zf.infolist()}
+            self.assertEqual(zf.read("X/item_001/tesis.pdf"), self.pdf.read_bytes())
+        self.assertEqual(methods["tesis.pdf"], zipfile.ZIP_STORED)
+        self.assertEqual(methods["blob.bin"], zipfile.ZIP_STORED)
+        self.assertEqual(methods["dublin_core.xml"], zipfile.ZIP_DEFLATED)
+        self.assertEqual(methods["notas"], zipfile.ZIP_DEFLATED)
+        self.assertFalse(list(self.tmp.glob(".spool_*")))
+
+    def test_large_members_are_deflated_in_worker_processes(self):
+        big = self.tmp / "big.txt"
+        big.write_bytes(b"linea de texto\n" * 200000)
+        executor = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+        self.addCleanup(executor.shutdown)
+        zip_path = self.tmp / "p.zip"
+        writer = archive.ZipArchiveWriter(zip_path, executor=executor)
+        writer.write_members([("big.txt", big)] + self.members)
+        writer.close()
+        archive.rewrite_archive_members(zip_path, {"importar.bat": b"@echo off\r\n"})
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("big.txt"), big.read_bytes())
+            self.assertEqual(zf.namelist()[-1], "importar.bat")
+            self.assertLess(zf.getinfo("big.txt").compress_size, big.stat().st_size // 10)
+
+    def test_interrupted_update_leaves_previous_zip_intact(self):
+        zip_path = self.tmp / "p.zip"
+        writer = archive.ZipArchiveWriter(zip_path)
+        writer.write_members(self.members)
+        writer.close()
+        before = zip_path.read_bytes()
+
+        writer = archive.ZipArchiveWriter(zip_path, update=True)
+        writer.write_members([("manifest.csv", b"path,size\r\n")], replace_prefix="X/item_001/notas")
+        # A download running during the update still reads the complete previous archive.
+        self.assertEqual(zip_path.read_bytes(), before)
+        with mock.patch.object(writer, "_central_header", side_effect=OSError("worker killed")):
+            with self.assertRaises(OSError):
+                writer.close()
+        self.assertEqual(zip_path.read_bytes(), before)
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(len(zf.namelist()), 4)
+
+        # The next update starts again from the previous archive.
+        writer = archive.ZipArchiveWriter(zip_path, update=True)
+        writer.write_members([("manifest.csv", b"path,size\r\n")])
+        writer.close()
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("X/item_001/tesis.pdf"), self.pdf.read_bytes())
+            self.assertEqual(zf.namelist()[-1], "manifest.csv")
+        self.assertFalse((self.tmp / "p.zip.part").exists())
+
+    def test_tar_gz_is_compressed_in_independent_chunks(self):
+        tar_path = self.tmp / "p.tar.gz"
+        with mock.patch.object(archive, "GZIP_CHUNK_BYTES", 4096):
+            writer = archive.TarArchiveWriter(tar_path, compress=True)
+            writer.write_members(self.members)
+            writer.close()
+            archive.rewrite_archive_members(tar_path, {"X/item_001/notas": b"nuevo"})
+        with tarfile.open(tar_path, "r:gz") as tf:
+            self.assertEqual(tf.extractfile("X/item_001/tesis.pdf").read(), self.pdf.read_bytes())
+            self.assertEqual(tf.extractfile("X/item_001/notas").read(), b"nuevo")
+            self.assertEqual(len(tf.getnames()), 4)
+
+
+FAKE_SOFFICE = """#!{python}
+import pathlib, sys, time
+args = sys.argv[1:]
+if args == ["--version"]:
+    print("LibreOffice 7.6 (fake)")
+    sys.exit(0)
+profile = [a for a in args if a.startswith("-env:UserInstallation=")][0]
+src = pathlib.Path(args[-1])
+out_dir = pathlib.Path(args[args.index("--outdir") + 1])
+if src.read_bytes().startswith(b"SLOW"):
+    time.sleep(30)
+(out_dir / (src.stem + ".pdf")).write_text("%PDF " + profile)
+"""
+
+
+@unittest.skipIf(os.name == "nt", "fake soffice script needs a POSIX shebang")
+class ConversionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.soffice = self.tmp / "soffice"
+        self.soffice.write_text(FAKE_SOFFICE.format(python=sys.executable))
+        self.soffice.chmod(0o755)
+
+    def test_workers_use_isolated_profiles_and_restart_after_timeout(self):
+        pool = ConversionPool(str(self.soffice), size=2, profile_root=self.tmp / "profiles", timeout=2, resident=False)
+        self.assertIn(str(self.soffice.resolve()), pool.version)
+
+        docx = self.tmp / "a.docx"
+        docx.write_bytes(b"doc")
+        ok, _ = pool.convert(docx, self.tmp / "out" / "tesis.pdf")
+        self.assertTrue(ok)
+        self.assertIn("worker_", (self.tmp / "out" / "tesis.pdf").read_text())
+
+        slow = self.tmp / "slow.docx"
+        slow.write_bytes(b"SLOW")
+        ok, msg = pool.convert(slow, self.tmp / "out" / "slow.pdf")
+        self.assertFalse(ok)
+        self.assertIn("Timeout", msg)
+        self.assertEqual(sum(w.restarts for w in pool.workers), 1)
+
+
+    def test_limited_workers_still_convert(self):
+        limits = ProcessLimits(nice=5, ionice="idle", cpus=(0,), memory_mb=2048)
+        pool = ConversionPool(str(self.soffice), size=1, profile_root=self.tmp / "profiles", timeout=10, resident=False, limits=limits)
+        docx = self.tmp / "a.docx"
+        docx.write_bytes(b"doc")
+        ok, msg = pool.convert(docx, self.tmp / "out" / "tesis.pdf")
+        self.assertTrue(ok, msg)
+
+
+class ResourceSchedulerTests(unittest.TestCase):
+    def _queue(self, scheduler, owner, order):
+        waiting = scheduler.stats()["convert"]["waiting"]
+
+        def run():
+            with scheduler.owner(owner), scheduler.slot("convert"):
+                order.append(owner)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        # Wait until the thread is queued so the arrival order is deterministic.
+        while scheduler.stats()["convert"]["waiting"] == waiting:
+            time.sleep(0.001)
+        return thread
+
+    def test_limit_and_round_robin_between_owners(self):
+        scheduler = ResourceScheduler({"convert": 1})
+        order = []
+        scheduler.acquire("convert")
+        threads = [self._queue(scheduler, "grande", order) for _ in range(3)]
+        threads.append(self._queue(scheduler, "chico", order))
+        self.assertEqual(scheduler.stats()["convert"], {"limit": 1, "running": 1, "waiting": 4, "served": 1})
+
+        scheduler.release("convert")
+        for thread in threads:
+            thread.join(5)
+        # The small group queued last is served right after the first slot of the big one.
+        self.assertEqual(order, ["grande", "chico", "grande", "grande"])
+        self.assertEqual(scheduler.stats()["convert"]["running"], 0)
+
+    def test_unlimited_resource_never_blocks(self):
+        scheduler = ResourceScheduler({"copy": 0})
+        with scheduler.slot("copy"), scheduler.slot("copy"):
+            self.assertEqual(scheduler.stats()["copy"]["running"], 2)
+
+    @unittest.skipIf(os.name == "nt", "wrapper commands are POSIX only")
+    def test_process_limits_build_wrapper_commands(self):
+        self.assertEqual(ProcessLimits().wrap(["soffice"]), ["soffice"])
+        with self.assertRaises(ValueError):
+            ProcessLimits(ionice="realtime")
+        limits = ProcessLimits(nice=10, ionice="idle", cpus=(2, 3), memory_mb=512)
+        self.assertEqual(
+            limits.prefix(which=lambda name: f"/bin/{name}"),
+            ["/bin/nice", "-n", "10", "/bin/ionice", "-c", "3", "/bin/taskset", "-c", "2,3", "/bin/prlimit", "--as=536870912", "--"],
+        )
+        # Missing tools are skipped, the others still apply.
+        self.assertEqual(limits.prefix(which=lambda name: None if name == "taskset" else name)[:6], ["nice", "-n", "10", "ionice", "-c", "3"])
+        self.assertEqual(_popen_kwargs(limits), {"start_new_session": True})
+
+
+class ConversionCacheTests(unittest.TestCase):
+    def test_lru_eviction_keeps_recently_used_entries(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        src = root / "src.pdf"
+        src.write_bytes(b"x" * 100)
+        cache = ConversionCache(root / "cache", max_bytes=250)
+
+        cache.put("a" * 64, "v1", src)
+        cache.put("b" * 64, "v1", src)
+        old = time.time() - 60
+        os.utime(cache.path_for(cache.make_key("a" * 64, "v1")), (old, old))
+        os.utime(cache.path_for(cache.make_key("b" * 64, "v1")), (old - 60, old - 60))
+        self.assertIsNotNone(cache.get("a" * 64, "v1"))  # refreshes "a"
+        cache.put("c" * 64, "v1", src)
+
+        self.assertIsNone(cache.get("b" * 64, "v1"))
+        self.assertIsNotNone(cache.get("a" * 64, "v1"))
+        self.assertIsNone(cache.get("a" * 64, "v2"))
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_fetched_entries_survive_eviction_and_puts_under_the_limit_do_not_scan(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        src = root / "src.pdf"
+        src.write_bytes(b"x" * 100)
+        cache = ConversionCache(root / "cache", max_bytes=250)
+
+        with mock.patch.object(cache, "entries", wraps=cache.entries) as scanned:
+            cache.put("a" * 64, "v1", src)
+            cache.put("b" * 64, "v1", src)
+        self.assertEqual(scanned.call_count, 1)  # first measure only
+
+        member = root / "work" / "tesis.pdf"
+        self.assertTrue(cache.fetch("a" * 64, "v1", member))
+        self.assertFalse(cache.fetch("z" * 64, "v1", root / "work" / "otra.pdf"))
+        # Another conversion pushes the cache over its limit: "a" is evicted, the member is not.
+        cache.prune(0)
+        self.assertIsNone(cache.get("a" * 64, "v1"))
+        self.assertEqual(member.read_bytes(), b"x" * 100)
+
+
+@unittest.skipIf(os.name == "nt", "fake soffice script needs a POSIX shebang")
+class CachedDocxGenerationTests(SafGenerationTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        soffice = self.tmp / "soffice"
+        soffice.write_text(FAKE_SOFFICE.format(python=sys.executable))
+        soffice.chmod(0o755)
+        overrides = override_settings(
+            SOFFICE_PATH=str(soffice),
+            SOFFICE_RESIDENT=False,
+            SOFFICE_PROFILE_ROOT=self.tmp / "profiles",
+            SAF_CONVERSION_CACHE_ROOT=self.tmp / "cache",
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for name in ("saf.services._conversion_pool", "saf.services._conversion_cache"):
+            patcher = mock.patch(name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_retried_batch_reuses_cached_conversion(self):
+        record = self.make_record("Docx", with_thesis=False)
+        self.add_file(record, ThesisFile.TYPE_TESIS_DOCX, "tesis.docx", b"PK docx")
+
+        first = self.make_batch("FIRST")
+        self.assertTrue(generate_saf_batch(first)[0])
+        with mock.patch("saf.conversion.SofficeWorker.convert", side_effect=AssertionError("soffice called")):
+            second = self.make_batch("SECOND")
+            self.assertTrue(generate_saf_batch(second)[0])
+
+        self.assertIn("DOCX convertido", first.items.get().detail)
+        self.assertIn("DOCX desde cache", second.items.get().detail)
+
+    def test_upload_time_conversion_is_reused_by_generation(self):
+        record = self.make_record("Docx", with_thesis=False)
+        docx = self.add_file(record, ThesisFile.TYPE_TESIS_DOCX, "tesis.docx", b"PK docx")
+
+        ok, _ = convert_thesis_file(docx.pk)
+        docx.refresh_from_db()
+        self.assertTrue(ok)
+        self.assertEqual(docx.conversion_status, ThesisFile.CONVERSION_OK)
+        self.assertIsNotNone(docx.converted_pdf_path)
+
+        with mock.patch("saf.services.convert_docx_to_pdf_cached", side_effect=AssertionError("converted again")):
+            batch = self.make_batch("PRECONV")
+            self.assertTrue(generate_saf_batch(batch)[0])
+        self.assertIn("pre-convertido", batch.items.get().detail)
+
+    def test_stream_download_uses_stored_layout_after_cache_eviction(self):
+        record = self.make_record("Docx", with_thesis=False)
+        self.add_file(record, ThesisFile.TYPE_TESIS_DOCX, "tesis.docx", b"PK docx")
+        self.client.force_login(self.user)
+        with self.settings(SAF_DOWNLOAD_MODE="stream"):
+            batch = self.make_batch("STREAMDOCX")
+            self.assertTrue(generate_saf_batch(batch)[0])
+            url = reverse("saf:batches_download", args=[batch.id])
+            get_conversion_cache().clear()
+            # Downloads and resumes neither lay the batch out again nor run soffice.
+            with mock.patch("saf.services.build_batch_stream_layout", side_effect=AssertionError("laid out again")), mock.patch(
+                "saf.conversion.SofficeWorker.convert", side_effect=AssertionError("soffice called")
+            ):
+                full = self.client.get(url)
+                body = b"".join(full.streaming_content)
+                part = self.client.get(url, HTTP_RANGE="bytes=50-", HTTP_IF_RANGE=full["ETag"])
+                self.assertEqual(part.status_code, 206)
+                self.assertEqual(body[:50] + b"".join(part.streaming_content), body)
+
+        zip_path = self.tmp / "stream.zip"
+        zip_path.write_bytes(body)
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertTrue(zf.read("DERECHO/item_001/tesis.pdf").startswith(b"%PDF"))
+
+    def test_upload_conversion_is_a_worker_job_and_stale_files_are_requeued(self):
+        record = self.make_record("Docx", with_thesis=False)
+        docx = self.add_file(record, ThesisFile.TYPE_TESIS_DOCX, "tesis.docx", b"PK docx")
+        job = enqueue_conversion(docx, self.user)
+        self.assertEqual(enqueue_conversion(docx).id, job.id)
+        claimed = claim_job("w1")
+        self.assertEqual(claimed.id, job.id)
+        self.assertTrue(run_job(claimed, "w1")[0])
+        docx.refresh_from_db()
+        self.assertEqual(docx.conversion_status, ThesisFile.CONVERSION_OK)
+        self.assertIsNotNone(docx.converted_pdf_path)
+
+        # A conversion lost with its process (left RUNNING, no job) is queued again once.
+        ThesisFile.objects.filter(pk=docx.pk).update(conversion_status=ThesisFile.CONVERSION_RUNNING)
+        self.assertEqual(requeue_stale_conversions(), 1)
+        self.assertEqual(requeue_stale_conversions(), 0)
+        # A job abandoned by its workers leaves the file in error instead of pending forever.
+        retry = claim_job("w2")
+        with self.settings(SAF_JOB_MAX_ATTEMPTS=1):
+            SafJob.objects.filter(pk=retry.pk).update(lease_expires_at=timezone.now() - timezone.timedelta(seconds=1))
+            self.assertIsNone(claim_job("w3"))
+        docx.refresh_from_db()
+        self.assertEqual(docx.conversion_status, ThesisFile.CONVERSION_ERROR)
@@ -0,0 +1,96 @@
+"""
+Per-stage timings of SAF generation, stored in ``SafBatchItem.timings`` and ``SafBatch.timings``.
+
+Every stage keeps the seconds spent, the bytes it handled and how many times it ran, e.g.
+``{"db": {"s": 0.0123, "bytes": 0, "n": 1}, "zip": {"s": 0.4, "bytes": 1048576, "n": 2}}``.
+
+Item stages: ``db`` (planning from the ORM rows), ``xml`` (metadata and ``contents``),
+``convert`` (soffice DOCX->PDF), ``copy`` (staging tree) and ``zip`` (archive members).
+Batch stages are measured on the main thread (chunk loads, item pool, report, scripts,
+compaction, validation, manifest, ...). The module is Django-free.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ITEM_STAGES = ("db", "xml", "convert", "copy", "zip")
+BATCH_STAGES = (
+    "preflight", "load", "items", "save", "cleanup", "report", "scripts", "close", "validation", "manifest", "parts"
+)
+STAGE_LABELS = {
+    "preflight": "Verificación previa",
+    "load": "Lectura de BD",
+    "items": "Ítems (total)",
+    "save": "Escritura de BD",
+    "cleanup": "Limpieza de ítems obsoletos",
+    "report": "Reporte",
+    "scripts": "Scripts y mapfiles",
+    "close": "Cierre y compactación ZIP",
+    "validation": "Validación",
+    "manifest": "Manifest",
+    "parts": "Partes por carrera",
+    "db": "BD",
+    "xml": "XML",
+    "convert": "Conversión DOCX",
+    "copy": "Copia staging",
+    "zip": "Escritura ZIP/tar",
+}
+
+
+class StageTimer:
+    """Accumulates ``seconds`` and ``bytes`` per stage. One timer per item job: not thread-safe."""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0, count: int = 1):
+        entry = self.stages.setdefault(stage, {"s": 0.0, "bytes": 0, "n": 0})
+        entry["s"] += seconds
+        entry["bytes"] += int(nbytes)
+        entry["n"] += count
+
+    @contextmanager
+    def measure(self, stage: str, nbytes: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, nbytes)
+
+    def merge(self, timings: Optional[dict]):
+        for stage, entry in (timings or {}).items():
+            self.add(stage, entry.get("s", 0.0), entry.get("bytes", 0), entry.get("n", 1))
+
+    def as_dict(self) -> dict:
+        return {stage: {"s": round(e["s"], 4), "bytes": int(e["bytes"]), "n": e["n"]} for stage, e in self.stages.items()}
+
+
+TIMING_HEADER = [f"{stage.upper()}_{unit}" for stage in ITEM_STAGES for unit in ("S", "BYTES")]
+
+
+def timing_columns(timings: Optional[dict]) -> List[str]:
+    """Report cells matching ``TIMING_HEADER`` (stages an item did not go through are 0)."""
+    cells = []
+    for stage in ITEM_STAGES:
+        entry = (timings or {}).get(stage) or {}
+        cells += [f"{entry.get('s', 0.0):.3f}", str(int(entry.get("bytes", 0)))]
+    return cells
+
+
+def timing_rows(timings: Optional[dict], order: Iterable[str] = ()) -> List[Tuple[str, str, float, int, float]]:
+    """``(stage, label, seconds, bytes, % of total)`` sorted by ``order`` and then by time."""
+    timings = timings or {}
+    total = sum(e.get("s", 0.0) for e in timings.values()) or 0.0
+    order = list(order)
+    rank = {stage: idx for idx, stage in enumerate(order)}
+    stages = sorted(timings, key=lambda s: (rank.get(s, len(order)), -timings[s].get("s", 0.0)))
+    return [
+        (
+            stage,
+            STAGE_LABELS.get(stage, stage),
+            timings[stage].get("s", 0.0),
+            int(timings[stage].get("bytes", 0)),
+            timings[stage].get("s", 0.0) * 100 / total if total else 0.0,
+        )
+        for stage in stages
+    ]
@@ -2,14 +2,21 @@ from django.urls import path
 
 from saf.views import (
     batches_create_from_group_view,
+    batches_delta_download_view,
+    batches_delta_view,
     batches_detail_view,
     batches_download_view,
     batches_generate_view,
     batches_list_view,
+    batches_log_view,
+    batches_part_download_view,
+    batches_profile_download_view,
     batches_scripts_view,
     batches_upload_links_view,
     groups_download_view,
+    groups_events_view,
     groups_generate_view,
+    groups_preflight_view,
     groups_progress_view,
     groups_upload_links_view,
 )
@@ -19,7 +26,9 @@ app_name = "saf"
 urlpatterns = [
     # SAF is managed by SustentationGroup (group acts as publication batch).
     path("groups/<int:group_id>/generate/", groups_generate_view, name="groups_generate"),
+    path("groups/<int:group_id>/preflight/", groups_preflight_view, name="groups_preflight"),
     path("groups/<int:group_id>/progress/", groups_progress_view, name="groups_progress"),
+    path("groups/<int:group_id>/events/", groups_events_view, name="groups_events"),
     path("groups/<int:group_id>/download/", groups_download_view, name="groups_download"),
     path("groups/<int:group_id>/links/", groups_upload_links_view, name="groups_upload_links"),
 
@@ -28,6 +37,11 @@ urlpatterns = [
     path("batches/<int:batch_id>/", batches_detail_view, name="batches_detail"),
     path("batches/<int:batch_id>/generate/", batches_generate_view, name="batches_generate"),
     path("batches/<int:batch_id>/download/", batches_download_view, name="batches_download"),
+    path("batches/<int:batch_id>/parts/<str:name>/", batches_part_download_view, name="batches_part_download"),
+    path("batches/<int:batch_id>/delta/", batches_delta_view, name="batches_delta"),
+    path("batches/<int:batch_id>/delta/<str:name>/", batches_delta_download_view, name="batches_delta_download"),
+    path("batches/<int:batch_id>/log/", batches_log_view, name="batches_log"),
+    path("batches/<int:batch_id>/profile/<str:name>/", batches_profile_download_view, name="batches_profile_download"),
     path("batches/<int:batch_id>/scripts/", batches_scripts_view, name="batches_scripts"),
     path("batches/<int:batch_id>/links/", batches_upload_links_view, name="batches_upload_links"),
 ]
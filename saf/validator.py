@@ -0,0 +1,302 @@
+"""
+Structural validator for SAF packages (what ``dspace import`` expects of each item).
+
+Works on a ZIP without extracting it (members are streamed from the archive) or on an
+unpacked tree such as the one written by ``build_saf.py``. Checks, per item folder
+``item_###``:
+
+* ``dublin_core.xml`` exists and is well-formed with a ``dublin_core`` root;
+* every ``metadata_<schema>.xml`` is well-formed and declares ``schema="<schema>"``;
+* ``contents`` exists, each line is ``file<TAB>bundle:NAME[<TAB>primary:true]...`` with a
+  known bundle, listed files exist in the item and at most one is primary;
+
+and, for the whole package, that no item folder is duplicated (repeated ZIP entries, or
+folders that collide on Windows such as ``item_1``/``item_001``). Members are parsed in a
+thread pool; the report is per item.
+
+Like ``saf.archive`` this module does not import Django.
+"""
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Union
+from zipfile import BadZipFile, ZipFile
+
+ITEM_RE = re.compile(r"^(?P<prefix>(?:.*/)?(?P<folder>item_(?P<number>\d+))/)(?P<file>[^/]+)$", re.IGNORECASE)
+METADATA_RE = re.compile(r"^metadata_(?P<schema>[A-Za-z0-9_-]+)\.xml$")
+KNOWN_BUNDLES = {"ORIGINAL", "LICENSE", "TEXT", "THUMBNAIL", "CC-LICENSE"}
+CONTENTS_OPTIONS = ("bundle:", "primary:", "permissions:", "description:")
+# Files DSpace reads from the item folder itself (never listed in contents).
+ITEM_CONTROL_FILES = {"dublin_core.xml", "contents", "handle", "collections"}
+
+
+@dataclass
+class ItemReport:
+    prefix: str
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ValidationReport:
+    source: str
+    members: int = 0
+    items: Dict[str, ItemReport] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def error_count(self) -> int:
+        return len(self.errors) + sum(1 for i in self.items.values() if i.errors)
+
+    @property
+    def ok(self) -> bool:
+        return self.error_count == 0
+
+    def item(self, prefix: str) -> ItemReport:
+        if prefix not in self.items:
+            self.items[prefix] = ItemReport(prefix)
+        return self.items[prefix]
+
+    def summary(self) -> str:
+        bad = sum(1 for i in self.items.values() if i.errors)
+        return (
+            f"Validación SAF: {len(self.items)} item(s), {self.members} archivo(s), "
+            f"{bad} item(s) con errores, {len(self.errors)} error(es) generales."
+        )
+
+    def lines(self, include_ok: bool = False) -> List[str]:
+        out = [f"[ERROR] {msg}" for msg in self.errors]
+        for prefix in sorted(self.items):
+            item = self.items[prefix]
+            name = prefix.rstrip("/")
+            if item.errors:
+                out.append(f"[ERROR] {name} - " + "; ".join(item.errors))
+            elif include_ok:
+                out.append(f"[OK] {name}")
+            if item.warnings:
+                out.append(f"[AVISO] {name} - " + "; ".join(item.warnings))
+        return out
+
+
+class ZipSource:
+    """
+    Members of a SAF ZIP, read in place; safe to use from several threads.
+
+    The central directory is parsed once here. Each thread reads through its own ``ZipFile``
+    (opened on first use and kept until ``close``), so threads never share a file position
+    and a member read does not parse the directory again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with ZipFile(path, "r") as zf:
+            infos = [i for i in zf.infolist() if not i.is_dir()]
+        self.names = [i.filename for i in infos]
+        # Repeated names resolve to the last entry, like ZipFile.getinfo.
+        self.infos = {i.filename: i for i in infos}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: List[ZipFile] = []
+
+    def _zipfile(self) -> ZipFile:
+        zf = getattr(self._local, "zf", None)
+        if zf is None:
+            zf = self._local.zf = ZipFile(self.path, "r")
+            with self._lock:
+                self._opened.append(zf)
+        return zf
+
+    @contextmanager
+    def open(self, name: str) -> Iterator[IO[bytes]]:
+        with self._zipfile().open(self.infos[name]) as f:
+            yield f
+
+    def read(self, name: str) -> bytes:
+        with self.open(name) as f:
+            return f.read()
+
+    def parse_xml(self, name: str) -> ET.Element:
+        with self.open(name) as f:
+            return _parse_root(f)
+
+    def close(self):
+        with self._lock:
+            opened, self._opened = self._opened, []
+        for zf in opened:
+            zf.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DirectorySource(ZipSource):
+    """Same interface over an unpacked tree (``build_saf.py`` output)."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.names = sorted(p.relative_to(path).as_posix() for p in path.rglob("*") if p.is_file())
+
+    @contextmanager
+    def open(self, name: str) -> Iterator[IO[bytes]]:
+        with open(self.path / name, "rb") as f:
+            yield f
+
+    def close(self):
+        pass
+
+
+def open_saf_source(path: Path) -> Union[ZipSource, DirectorySource]:
+    """Close the source (or use it as a context manager) when done. Raises ``BadZipFile``/``OSError`` when ``path`` is neither a folder nor a readable ZIP."""
+    path = Path(path)
+    return DirectorySource(path) if path.is_dir() else ZipSource(path)
+
+
+def group_item_files(names) -> Dict[str, List[str]]:
+    """``{item prefix: [file names]}`` of the members that sit directly in an ``item_###`` folder."""
+    items: Dict[str, List[str]] = {}
+    for name in dict.fromkeys(names):
+        match = ITEM_RE.match(name)
+        if match:
+            items.setdefault(match.group("prefix"), []).append(match.group("file"))
+    return items
+
+
+def _parse_root(fileobj) -> ET.Element:
+    # iterparse streams the member; only the root element is kept.
+    root = None
+    for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+        if event == "start" and root is None:
+            root = elem
+        elif event == "end" and elem is not root:
+            elem.clear()
+    return root
+
+
+def _check_xml(source, name: str, schema: Optional[str]) -> List[str]:
+    file_name = name.rsplit("/", 1)[-1]
+    try:
+        root = source.parse_xml(name)
+    except ET.ParseError as exc:
+        return [f"{file_name} mal formado ({exc})"]
+    if root is None or root.tag != "dublin_core":
+        return [f"{file_name}: la raíz debe ser <dublin_core>"]
+    problems = []
+    if schema and root.get("schema") != schema:
+        problems.append(f"{file_name}: schema=\"{root.get('schema', '')}\", se esperaba \"{schema}\"")
+    return problems
+
+
+def parse_contents(text: str) -> Tuple[List[str], List[str]]:
+    """``(listed files, problems)`` of a ``contents`` file."""
+    files: List[str] = []
+    problems: List[str] = []
+    primaries = 0
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        fields = line.split("\t")
+        file_name = fields[0].strip()
+        if not file_name:
+            problems.append(f"contents línea {number}: falta el nombre de archivo")
+            continue
+        if file_name in files:
+            problems.append(f"contents: {file_name} aparece más de una vez")
+        files.append(file_name)
+        for option in fields[1:]:
+            option = option.strip()
+            if not option.startswith(CONTENTS_OPTIONS):
+                problems.append(f"contents línea {number}: opción desconocida \"{option}\"")
+            elif option.startswith("bundle:") and option[len("bundle:"):] not in KNOWN_BUNDLES:
+                problems.append(f"contents línea {number}: bundle desconocido \"{option[len('bundle:'):]}\"")
+            elif option.startswith("primary:"):
+                if option != "primary:true":
+                    problems.append(f"contents línea {number}: \"{option}\" (solo se admite primary:true)")
+                primaries += 1
+    if primaries > 1:
+        problems.append("contents: más de un archivo primary:true")
+    return files, problems
+
+
+def _check_contents(source, name: str) -> Tuple[List[str], List[str]]:
+    try:
+        text = source.read(name).decode("utf-8")
+    except UnicodeDecodeError:
+        return [], ["contents no está en UTF-8"]
+    return parse_contents(text)
+
+
+def validate_saf(path: Path, workers: int = 4) -> ValidationReport:
+    """Validate the SAF package at ``path`` (ZIP file or unpacked folder)."""
+    path = Path(path)
+    report = ValidationReport(source=str(path))
+    try:
+        source = open_saf_source(path)
+    except (BadZipFile, OSError) as exc:
+        report.errors.append(f"No se pudo abrir {path.name}: {exc}")
+        return report
+    report.members = len(source.names)
+
+    for name, count in Counter(source.names).items():
+        if count > 1:
+            report.errors.append(f"{name} está repetido {count} veces en el archivo.")
+
+    item_files = group_item_files(source.names)
+    folders: Dict[Tuple[str, int], set] = {}
+    for prefix in item_files:
+        parent, _, folder = prefix.rstrip("/").rpartition("/")
+        folders.setdefault((parent.lower(), int(folder.split("_", 1)[1])), set()).add(prefix)
+    for prefixes in folders.values():
+        if len(prefixes) > 1:
+            report.errors.append("Carpetas de item duplicadas: " + ", ".join(p.rstrip("/") for p in sorted(prefixes)))
+
+    tasks = []
+    for prefix, files in item_files.items():
+        item = report.item(prefix)
+        if "dublin_core.xml" not in files:
+            item.errors.append("falta dublin_core.xml")
+        if "contents" not in files:
+            item.errors.append("falta contents")
+        for file_name in files:
+            if file_name == "dublin_core.xml":
+                tasks.append((prefix, file_name, None))
+            elif file_name == "contents":
+                tasks.append((prefix, file_name, "contents"))
+            else:
+                meta = METADATA_RE.match(file_name)
+                if meta:
+                    tasks.append((prefix, file_name, meta.group("schema")))
+
+    # Same order for a ZIP and its unpacked tree.
+    tasks.sort(key=lambda t: (t[0], t[1]))
+
+    def run(task):
+        prefix, file_name, kind = task
+        if kind == "contents":
+            return task, _check_contents(source, prefix + file_name)
+        return task, ([], _check_xml(source, prefix + file_name, kind))
+
+    with source, ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="saf-validate") as pool:
+        for (prefix, file_name, kind), (listed, problems) in pool.map(run, tasks):
+            item = report.item(prefix)
+            item.errors.extend(problems)
+            if kind != "contents":
+                continue
+            present = set(item_files[prefix])
+            for listed_name in listed:
+                if listed_name not in present:
+                    item.errors.append(f"{listed_name} figura en contents pero no existe")
+            extra = sorted(
+                f for f in present - set(listed) - ITEM_CONTROL_FILES if not METADATA_RE.match(f)
+            )
+            if extra:
+                item.warnings.append("archivos fuera de contents (no se importan): " + ", ".join(extra))
+    return report
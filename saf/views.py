@@ -1,20 +1,40 @@
 from datetime import datetime
 from pathlib import Path
 import json
+import mimetypes
 import threading
+import time
 
+from django.conf import settings
 from django.contrib import messages
-from django.db import close_old_connections, models
-from django.http import FileResponse, Http404, JsonResponse
+from django.db import models
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.http import content_disposition_header
 from django.views.decorators.http import require_POST
 
 from accounts.decorators import role_required
 from accounts.models import User
 from registry.models import AuditEvent, SustentationGroup, ThesisRecord
 from saf.forms import DspaceLinksUploadForm
-from saf.models import SafBatch, SafBatchItem
-from saf.services import generate_batch_scripts_only, generate_saf_batch
+from saf.models import SafBatch, SafBatchItem, SafJob
+from saf.events import bus
+from saf.jobs import enqueue_generation, enqueue_preflight, get_or_create_group_batch
+from saf.preflight import run_preflight
+from saf.progress import get_progress
+from saf.timing import BATCH_STAGES, ITEM_STAGES, timing_rows
+from saf.services import (
+    batch_delta_paths,
+    batch_log_path,
+    batch_part_paths,
+    batch_profile_paths,
+    build_batch_delta,
+    load_batch_stream_layout,
+    download_mode,
+    generate_batch_scripts_only,
+    manifest_choices,
+)
+from saf.zipstream import iter_file_range, parse_range_header
 
 
 @role_required(User.ROLE_AUDITOR)
@@ -54,10 +74,30 @@ def batches_list_view(request):
 def batches_detail_view(request, batch_id: int):
     batch = get_object_or_404(SafBatch.objects.select_related("created_by", "group"), pk=batch_id)
     items = batch.items.select_related("record", "record__career").all()
+    timings = batch.timings or {}
+    item_seconds = [{"item": i, "seconds": sum(e.get("s", 0.0) for e in i.timings.values())} for i in items if i.timings]
     return render(
         request,
         "saf/batch_detail.html",
-        {"batch": batch, "items": items, "links_form": DspaceLinksUploadForm()},
+        {
+            "batch": batch,
+            "items": items,
+            "links_form": DspaceLinksUploadForm(),
+            "log_available": batch_log_path(batch).exists(),
+            "parts": [{"name": p.name, "size_mb": p.stat().st_size / 1048576} for p in batch_part_paths(batch)],
+            "deltas": [{"name": p.name, "size_mb": p.stat().st_size / 1048576} for p in batch_delta_paths(batch)],
+            "profiles": [{"name": p.name, "size_kb": p.stat().st_size / 1024} for p in batch_profile_paths(batch) if p.exists()],
+            "delta_bases": [p.name for p in manifest_choices(exclude=batch)] if batch.zip_path else [],
+            "timing_tables": [
+                (title, rows)
+                for title, rows in [
+                    ("Etapa del lote", timing_rows(timings.get("stages"), BATCH_STAGES)),
+                    ("Etapa de ítems", timing_rows(timings.get("items"), ITEM_STAGES)),
+                ]
+                if rows
+            ],
+            "slowest_items": sorted(item_seconds, key=lambda row: row["seconds"], reverse=True)[:5],
+        },
     )
 
 
@@ -65,31 +105,124 @@ def batches_detail_view(request, batch_id: int):
 @require_POST
 def batches_generate_view(request, batch_id: int):
     batch = get_object_or_404(SafBatch, pk=batch_id)
-    if batch.status == SafBatch.STATUS_RUNNING:
+    if _has_active_job(batch):
         messages.warning(request, "El lote ya está en proceso. Espera a que termine.")
         return redirect("saf:batches_detail", batch_id=batch.id)
     if batch.status == SafBatch.STATUS_DONE and batch.zip_path:
         messages.warning(request, "Este lote ya fue generado. No se puede generar nuevamente.")
         return redirect("saf:batches_detail", batch_id=batch.id)
-    ok, msg = generate_saf_batch(batch)
-    if ok:
-        messages.success(request, msg)
-    else:
-        messages.warning(request, msg)
-    if batch.group_id:
-        batch.group.recompute_status(save=True)
+    enqueue_generation(batch, request.user, profile=request.POST.get("profile") == "1")
+    messages.success(request, "Generación SAF en cola. El worker la procesará en segundo plano.")
     return redirect("saf:batches_detail", batch_id=batch.id)
 
 
+@role_required(User.ROLE_AUDITOR)
+def batches_log_view(request, batch_id: int):
+    batch = get_object_or_404(SafBatch, pk=batch_id)
+    path = batch_log_path(batch)
+    if not path.exists():
+        raise Http404("El lote aún no tiene log de generación.")
+    return FileResponse(path.open("rb"), content_type="text/plain; charset=utf-8", filename=path.name)
+
+
 @role_required(User.ROLE_AUDITOR)
 def batches_download_view(request, batch_id: int):
     batch = get_object_or_404(SafBatch, pk=batch_id)
     if not batch.zip_path:
         raise Http404("El lote aún no tiene ZIP generado.")
+    return _archive_download_response(request, batch)
+
+
+def _listed_file_response(request, paths, name: str, missing: str):
+    # Only files listed for this batch (no arbitrary paths).
+    path = next((p for p in paths if p.name == name), None)
+    if path is None:
+        raise Http404(missing)
+    st = path.stat()
+    return _ranged_response(
+        request,
+        st.st_size,
+        lambda start, end: iter_file_range(path, start, end),
+        f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+        path.name,
+    )
+
+
+@role_required(User.ROLE_AUDITOR)
+def batches_part_download_view(request, batch_id: int, name: str):
+    batch = get_object_or_404(SafBatch, pk=batch_id)
+    return _listed_file_response(request, batch_part_paths(batch), name, "No existe esa parte del lote.")
+
+
+@role_required(User.ROLE_AUDITOR)
+@require_POST
+def batches_delta_view(request, batch_id: int):
+    batch = get_object_or_404(SafBatch, pk=batch_id)
+    ok, msg = build_batch_delta(batch, request.POST.get("base", ""))
+    if ok:
+        messages.success(request, msg)
+    else:
+        messages.error(request, msg)
+    return redirect("saf:batches_detail", batch_id=batch.id)
+
+
+@role_required(User.ROLE_AUDITOR)
+def batches_delta_download_view(request, batch_id: int, name: str):
+    batch = get_object_or_404(SafBatch, pk=batch_id)
+    return _listed_file_response(request, batch_delta_paths(batch), name, "No existe ese paquete delta.")
+
+
+@role_required(User.ROLE_AUDITOR)
+def batches_profile_download_view(request, batch_id: int, name: str):
+    batch = get_object_or_404(SafBatch, pk=batch_id)
+    paths = [p for p in batch_profile_paths(batch) if p.exists()]
+    return _listed_file_response(request, paths, name, "El lote no tiene ese archivo de perfil.")
+
+
+def _ranged_response(request, size: int, read_range, etag: str, filename: str):
+    # Single byte ranges only (enough for resumed downloads); If-Range guards against a changed archive.
+    byte_range = parse_range_header(request.headers.get("Range", ""), size)
+    if_range = request.headers.get("If-Range")
+    if byte_range is not None and if_range and if_range.strip() != etag:
+        byte_range = None
+    if byte_range == "unsatisfiable":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if byte_range is None:
+        response = StreamingHttpResponse(read_range(0, size - 1), content_type=content_type)
+        response["Content-Length"] = str(size)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(start, end), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def _archive_download_response(request, batch: SafBatch):
     zip_path = Path(batch.zip_path)
-    if not zip_path.exists():
+    if zip_path.exists():
+        st = zip_path.stat()
+        return _ranged_response(
+            request,
+            st.st_size,
+            lambda start, end: iter_file_range(zip_path, start, end),
+            f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+            zip_path.name,
+        )
+    if download_mode() != "stream":
         raise Http404("No se encontró el ZIP en disco.")
-    return FileResponse(open(zip_path, "rb"), as_attachment=True, filename=zip_path.name)
+    try:
+        layout = load_batch_stream_layout(batch)
+    except (ValueError, OSError) as exc:
+        raise Http404(f"No se pudo preparar el ZIP: {exc}")
+    return _ranged_response(request, layout.size, layout.iter_range, f'"{layout.etag}"', zip_path.name)
 
 
 @role_required(User.ROLE_AUDITOR)
@@ -226,13 +359,9 @@ def batches_create_from_group_view(request, group_id: int):
     return redirect("saf:batches_detail", batch_id=batch.id)
 
 
-def _get_or_create_group_batch(group: SustentationGroup, user) -> SafBatch:
-    batch = SafBatch.objects.filter(group=group).order_by("-created_at").first()
-    if batch:
-        return batch
-    # One batch per group in the new flow (code is internal; UI should not show it).
-    code = f"SAF_{group.date.strftime('%Y%m%d')}_G{group.id}"
-    return SafBatch.objects.create(batch_code=code, created_by=user, group=group)
+def _has_active_job(batch: SafBatch) -> bool:
+    # A RUNNING batch without a queued/running job was left by a dead process: allow a new run.
+    return batch.status == SafBatch.STATUS_RUNNING and batch.jobs.filter(status__in=SafJob.ACTIVE_STATUSES).exists()
 
 
 def _wants_json(request) -> bool:
@@ -270,8 +399,8 @@ def groups_generate_view(request, group_id: int):
         messages.error(request, msg)
         return redirect("registry:groups_detail", group_id=group.id)
 
-    batch = _get_or_create_group_batch(group, request.user)
-    if batch.status == SafBatch.STATUS_RUNNING:
+    batch = get_or_create_group_batch(group, request.user)
+    if _has_active_job(batch):
         msg = "El SAF ya está en proceso. Espera a que termine."
         if _wants_json(request):
             return JsonResponse({"ok": True, "message": msg, "status": batch.status, "batch_id": batch.id})
@@ -290,41 +419,54 @@ def groups_generate_view(request, group_id: int):
     if to_create:
         SafBatchItem.objects.bulk_create(to_create)
 
-    # Mark as running and start in background thread so the UI can poll progress.
-    batch.status = SafBatch.STATUS_RUNNING
-    batch.log_text = "Iniciando generación SAF..."
-    batch.save(update_fields=["status", "log_text", "updated_at"])
-
+    # The web process only enqueues; `manage.py saf_worker` runs the job (UI polls progress).
+    _, created = enqueue_generation(batch, request.user, profile=request.POST.get("profile") == "1")
     batch_id = batch.id
-    group_pk = group.id
-
-    def _run():
-        close_old_connections()
-        try:
-            b = SafBatch.objects.get(pk=batch_id)
-            generate_saf_batch(b)
-            g = SustentationGroup.objects.get(pk=group_pk)
-            g.recompute_status(save=True)
-        except Exception as exc:  # noqa: BLE001
-            try:
-                b = SafBatch.objects.get(pk=batch_id)
-                b.status = SafBatch.STATUS_FAILED
-                b.log_text = f"Error: {exc}"
-                b.save(update_fields=["status", "log_text", "updated_at"])
-            except Exception:  # noqa: BLE001
-                pass
-        finally:
-            close_old_connections()
-
-    threading.Thread(target=_run, daemon=True).start()
 
-    msg = "Generación SAF iniciada."
+    msg = "Generación SAF en cola." if created else "El SAF ya está en cola."
     if _wants_json(request):
         return JsonResponse({"ok": True, "message": msg, "status": SafBatch.STATUS_RUNNING, "batch_id": batch_id})
     messages.success(request, msg)
     return redirect("registry:groups_detail", group_id=group.id)
 
 
+@role_required(User.ROLE_AUDITOR)
+def groups_preflight_view(request, group_id: int):
+    """
+    Quick preflight of the group (files present with their size, free disk) in the web
+    thread. ``?sha256=1`` queues the full check (SHA-256 of every file, soffice probe) for
+    ``saf_worker``; the last full check is reported along.
+    """
+    group = get_object_or_404(SustentationGroup, pk=group_id)
+    records = group.records.select_related("career").prefetch_related("files").order_by("nro")
+    queued = None
+    if request.GET.get("sha256") == "1":
+        queued = enqueue_preflight(group, request.user)
+    report = run_preflight(records, verify_hash=False, probe_soffice=False)
+    batch = SafBatch.objects.filter(group=group).order_by("-created_at").first()
+    full = batch.jobs.filter(kind=SafJob.KIND_PREFLIGHT).order_by("-created_at").first() if batch else None
+    if _wants_json(request):
+        data = report.as_dict()
+        data["full_check"] = (
+            {"job_id": full.id, "status": full.status, "message": full.message, "finished_at": full.finished_at}
+            if full
+            else None
+        )
+        return JsonResponse(data)
+    lines = report.summary().splitlines()
+    if len(lines) > 21:
+        lines = lines[:21] + [f"... {len(lines) - 21} problema(s) más."]
+    if report.ok:
+        messages.success(request, " ".join(lines))
+    else:
+        messages.error(request, " ".join(lines))
+    if queued:
+        messages.info(request, "Verificación completa (SHA-256 y LibreOffice) en cola; vuelve a verificar para ver el resultado.")
+    elif full and full.status not in SafJob.ACTIVE_STATUSES:
+        messages.info(request, "Última verificación completa: " + " ".join(full.message.splitlines()[:21]))
+    return redirect("registry:groups_detail", group_id=group.id)
+
+
 @role_required(User.ROLE_AUDITOR)
 def groups_progress_view(request, group_id: int):
     group = get_object_or_404(SustentationGroup, pk=group_id)
@@ -332,21 +474,123 @@ def groups_progress_view(request, group_id: int):
     if not batch:
         return JsonResponse({"ok": False, "message": "Sin SAF para este grupo."}, status=404)
 
+    return JsonResponse({"ok": True, "batch_id": batch.id, **_batch_progress(batch)})
+
+
+def _batch_progress(batch: SafBatch) -> dict:
+    # Live progress is kept in the cache by the generator; the DB is only a fallback.
+    progress = get_progress(batch.id)
+    if progress:
+        return {**progress, "message": progress["message"].strip()}
+
     total = batch.items.count()
     done = batch.items.exclude(result=SafBatchItem.RESULT_PENDING).count()
     percent = int((done * 100) / total) if total else 0
-    return JsonResponse(
-        {
-            "ok": True,
-            "batch_id": batch.id,
-            "status": batch.status,
-            "total": total,
-            "done": done,
-            "percent": percent,
-            "zip_ready": bool(batch.zip_path),
-            "message": (batch.log_text or "").strip(),
-        }
-    )
+    return {
+        "status": batch.status,
+        "total": total,
+        "done": done,
+        "percent": percent,
+        "zip_ready": bool(batch.zip_path),
+        "message": (batch.log_text or "").strip(),
+    }
+
+
+def _sse_message(event: str, data: dict, event_id: int = 0) -> str:
+    lines = [f"id: {event_id}"] if event_id else []
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+SSE_KEEPALIVE_SECONDS = 15
+SSE_FINAL_STATUSES = {SafBatch.STATUS_DONE, SafBatch.STATUS_FAILED}
+# Each open stream holds a waitress thread: at most SAF_SSE_MAX_STREAMS per process.
+_sse_lock = threading.Lock()
+_sse_open = 0
+
+
+def _acquire_sse_slot() -> bool:
+    global _sse_open
+    limit = int(getattr(settings, "SAF_SSE_MAX_STREAMS", 2))
+    with _sse_lock:
+        if _sse_open >= limit:
+            return False
+        _sse_open += 1
+        return True
+
+
+def _release_sse_slot():
+    global _sse_open
+    with _sse_lock:
+        _sse_open -= 1
+
+
+@role_required(User.ROLE_AUDITOR)
+def groups_events_view(request, group_id: int):
+    """
+    Server-Sent Events stream of the group's SAF job: ``progress`` snapshots plus ``items``
+    deltas (only the items that changed since the previous event). Streams are capped to
+    ``SAF_SSE_MAX_SECONDS``; EventSource reconnects and resumes with ``Last-Event-ID``.
+    Past ``SAF_SSE_MAX_STREAMS`` open streams the answer is 204 and the page polls instead.
+    """
+    group = get_object_or_404(SustentationGroup, pk=group_id)
+    batch = SafBatch.objects.filter(group=group).order_by("-created_at").first()
+    if not batch:
+        return JsonResponse({"ok": False, "message": "Sin SAF para este grupo."}, status=404)
+    batch_id = batch.id
+    snapshot = _batch_progress(batch)
+    try:
+        resume_seq = int(request.headers.get("Last-Event-ID") or 0)
+    except ValueError:
+        resume_seq = 0
+    max_seconds = float(getattr(settings, "SAF_SSE_MAX_SECONDS", 120))
+    if not _acquire_sse_slot():
+        # 204 tells EventSource not to reconnect; the page falls back to the progress endpoint.
+        return HttpResponse(status=204)
+
+    def stream(snapshot: dict, seq: int):
+        try:
+            yield ""  # primed below: from then on closing the response releases the slot
+            yield "retry: 2000\n\n"
+            yield _sse_message("progress", snapshot)
+            if snapshot.get("status") in SSE_FINAL_STATUSES:
+                return
+            # Without Last-Event-ID the snapshot already covers everything published so far.
+            seq = seq or bus.last_seq(batch_id)
+            deadline = time.monotonic() + max_seconds
+            last_write = time.monotonic()
+            while time.monotonic() < deadline:
+                # The event log is shared with saf_worker: no DB queries while the stream is open.
+                events = bus.wait(batch_id, seq, timeout=1.0)
+                chunks = []
+                if events:
+                    seq = events[-1][0]
+                    changed = {}
+                    for _, ev in events:
+                        if ev["type"] == "item":
+                            changed[ev["nro"]] = {"nro": ev["nro"], "result": ev["result"], "stage": ev["stage"]}
+                        else:
+                            snapshot = {k: v for k, v in ev.items() if k != "type"}
+                    if changed:
+                        chunks.append(_sse_message("items", {"items": sorted(changed.values(), key=lambda d: d["nro"])}, seq))
+                    chunks.append(_sse_message("progress", snapshot, seq))
+                if not chunks and time.monotonic() - last_write >= SSE_KEEPALIVE_SECONDS:
+                    chunks.append(": ping\n\n")
+                if chunks:
+                    last_write = time.monotonic()
+                    yield "".join(chunks)
+                if snapshot.get("status") in SSE_FINAL_STATUSES:
+                    return
+        finally:
+            _release_sse_slot()
+
+    body = stream(snapshot, resume_seq)
+    next(body)
+    response = StreamingHttpResponse(body, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 @role_required(User.ROLE_AUDITOR)
@@ -355,10 +599,7 @@ def groups_download_view(request, group_id: int):
     batch = SafBatch.objects.filter(group=group).order_by("-created_at").first()
     if not batch or not batch.zip_path:
         raise Http404("El grupo aún no tiene ZIP generado.")
-    zip_path = Path(batch.zip_path)
-    if not zip_path.exists():
-        raise Http404("No se encontró el ZIP en disco.")
-    return FileResponse(open(zip_path, "rb"), as_attachment=True, filename=zip_path.name)
+    return _archive_download_response(request, batch)
 
 
 @role_required(User.ROLE_AUDITOR)
@@ -0,0 +1,162 @@
+"""
+Output writers for SAF packages.
+
+Items are committed as a list of members ``(arcname, source)`` where ``source`` is either a
+``Path`` to copy or the bytes to store. The archive writers in ``saf.archive`` stream
+members straight into the ZIP/tar; ``SafDirectoryWriter`` keeps the classic staging tree
+for operators who need it. Members of one item are always written together so items stay
+contiguous inside the archive.
+
+File members are placed in the staging tree without copying data when the filesystem
+allows it: hardlink first, then a reflink / ``copy_file_range`` clone, then a plain copy.
+Staged files may therefore share their inode with ``MEDIA_ROOT``; they must be treated as
+read-only (use ``link_mode="copy"`` if the staging tree is edited by hand).
+"""
+import os
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Tuple, Union
+
+SafMember = Tuple[str, Union[Path, bytes]]
+LINK_MODES = ("auto", "clone", "copy")
+FICLONE = 0x40049409  # Linux ioctl: share extents (btrfs, xfs, ...)
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
+    os.unlink(dst)
+    return False
+
+
+def _copy_file_range(src: Path, dst: Path) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                # In-kernel copy; server-side / CoW on filesystems that support it.
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if n == 0:
+                    break
+                remaining -= n
+            if remaining <= 0:
+                return True
+        except OSError:
+            pass
+    os.unlink(dst)
+    return False
+
+
+def place_file(src: Path, dst: Path, link_mode: str = "auto") -> str:
+    """Put ``src`` at ``dst`` as cheaply as possible. Returns the method used."""
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    if link_mode == "auto":
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass
+    if link_mode in ("auto", "clone"):
+        for method, func in (("reflink", _reflink), ("copy_file_range", _copy_file_range)):
+            if func(src, dst):
+                shutil.copystat(src, dst)
+                return method
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def member_size(source: Union[Path, bytes]) -> int:
+    if isinstance(source, bytes):
+        return len(source)
+    try:
+        return Path(source).stat().st_size
+    except OSError:
+        return 0
+
+
+class SafDirectoryWriter:
+    timing_stage = "copy"
+    resource = "copy"
+
+    def __init__(self, root: Path, link_mode: str = "auto"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Modo de enlace no soportado: {link_mode}")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.link_mode = link_mode
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def write_members(self, members: Iterable[SafMember], replace_prefix: str = ""):
+        if replace_prefix:
+            shutil.rmtree(self.root / replace_prefix, ignore_errors=True)
+        for arcname, source in members:
+            dst = self.root / arcname
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(source, bytes):
+                dst.write_bytes(source)
+                method = "write"
+            else:
+                method = place_file(Path(source), dst, self.link_mode)
+            with self._lock:
+                self.stats[method] += 1
+
+    def remove_members(self, predicate) -> int:
+        removed = 0
+        for path in sorted(self.root.rglob("*"), reverse=True):
+            if path.is_file() and predicate(path.relative_to(self.root).as_posix()):
+                path.unlink()
+                removed += 1
+            elif path.is_dir() and not any(path.iterdir()):
+                path.rmdir()
+        return removed
+
+    def close(self):
+        pass
+
+
+class SafMultiWriter:
+    """Fans members out to several writers (ZIP + optional staging tree)."""
+
+    def __init__(self, writers: List, scheduler=None):
+        self.writers = writers
+        # saf.scheduler.ResourceScheduler: archive writers take a "compress" slot, the staging tree a "copy" one.
+        self.scheduler = scheduler
+
+    def _write(self, w, members: List[SafMember], replace_prefix: str):
+        if self.scheduler is None:
+            w.write_members(members, replace_prefix)
+            return
+        with self.scheduler.slot(getattr(w, "resource", "compress")):
+            w.write_members(members, replace_prefix)
+
+    def write_members(self, members: Iterable[SafMember], replace_prefix: str = "", timer=None):
+        """With a ``saf.timing.StageTimer``, each writer's time is added to its ``timing_stage``."""
+        members = list(members)
+        nbytes = sum(member_size(source) for _, source in members) if timer is not None else 0
+        for w in self.writers:
+            if timer is None:
+                self._write(w, members, replace_prefix)
+                continue
+            with timer.measure(getattr(w, "timing_stage", "zip"), nbytes):
+                self._write(w, members, replace_prefix)
+
+    def remove_members(self, predicate) -> int:
+        return sum(w.remove_members(predicate) for w in self.writers if hasattr(w, "remove_members"))
+
+    def close(self):
+        for w in self.writers:
+            w.close()
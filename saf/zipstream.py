@@ -0,0 +1,256 @@
+"""
+Streaming ZIP layout for on-the-fly downloads.
+
+``ZipLayout`` lays out a ZIP of stored (uncompressed) members whose sizes and CRCs are
+known up front, so the byte offset of every header and the central directory are fixed
+before a single byte is sent. Any range ``[start, end]`` of the archive can then be
+produced straight from the sources, which is what makes HTTP Range / resumed downloads
+possible without building the archive on disk. Member order and timestamps come from the
+caller, so the same inputs always give the same bytes (and the same ETag).
+
+``save`` stores a layout once (index JSON plus one blob with every header and in-memory
+member); ``load`` serves it again without recomputing sizes or CRCs, so every Range request
+of a download sees exactly the same bytes.
+
+Like ``saf.archive`` this module does not import Django.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from saf.writers import SafMember
+
+COPY_BUFFER = 256 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+CRC_CACHE_SIZE = 8192
+
+_crc_cache: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
+_crc_cache_lock = threading.Lock()
+
+
+def file_crc32(path: Path) -> int:
+    """CRC32 of a file, memoized by (path, size, mtime) so repeated/resumed downloads do not re-read it."""
+    st = os.stat(path)
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    with _crc_cache_lock:
+        if key in _crc_cache:
+            _crc_cache.move_to_end(key)
+            return _crc_cache[key]
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    with _crc_cache_lock:
+        _crc_cache[key] = crc
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+    return crc
+
+
+def _dos_datetime(dt: datetime) -> Tuple[int, int]:
+    year = max(1980, dt.year)
+    return (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2), ((year - 1980) << 9) | (dt.month << 5) | dt.day
+
+
+@dataclass
+class _Segment:
+    offset: int
+    length: int
+    data: Optional[bytes] = None
+    path: Optional[Path] = None
+    # Where the segment starts inside ``path`` (non-zero for the blob of a loaded layout).
+    path_offset: int = 0
+
+
+class ZipLayout:
+    def __init__(self, members: Iterable[SafMember], date_time: datetime):
+        self._segments: List[_Segment] = []
+        self._dostime, self._dosdate = _dos_datetime(date_time)
+        central: List[bytes] = []
+        offset = 0
+        for arcname, source in members:
+            if isinstance(source, bytes):
+                size, crc = len(source), zlib.crc32(source)
+            else:
+                source = Path(source)
+                size, crc = source.stat().st_size, file_crc32(source)
+            header = self._local_header(arcname, crc, size)
+            self._segments.append(_Segment(offset, len(header), data=header))
+            central.append(self._central_header(arcname, crc, size, offset))
+            offset += len(header)
+            if isinstance(source, bytes):
+                self._segments.append(_Segment(offset, size, data=source))
+            else:
+                self._segments.append(_Segment(offset, size, path=source))
+            offset += size
+        directory = b"".join(central) + self._end_records(len(central), offset, sum(len(c) for c in central))
+        self._segments.append(_Segment(offset, len(directory), data=directory))
+        self.size = offset + len(directory)
+        self.etag = hashlib.sha256(directory).hexdigest()[:32]
+
+    def save(self, index_path: Path):
+        """Store the layout as ``index_path`` (JSON) plus ``<stem>_<etag>.bin``; older blobs are removed."""
+        index_path = Path(index_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        blob_path = index_path.with_name(f"{index_path.stem}_{self.etag}.bin")
+        segments = []
+        tmp_blob = blob_path.with_suffix(".tmp")
+        with open(tmp_blob, "wb") as blob:
+            for seg in self._segments:
+                if seg.data is not None:
+                    segments.append([seg.offset, seg.length, "", blob.tell()])
+                    blob.write(seg.data)
+                else:
+                    segments.append([seg.offset, seg.length, str(seg.path), seg.path_offset])
+        os.replace(tmp_blob, blob_path)
+        tmp_index = index_path.with_suffix(".tmp")
+        tmp_index.write_text(
+            json.dumps({"size": self.size, "etag": self.etag, "blob": blob_path.name, "segments": segments}),
+            encoding="utf-8",
+        )
+        os.replace(tmp_index, index_path)
+        for old in index_path.parent.glob(f"{index_path.stem}_*.bin"):
+            if old != blob_path:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass  # still open by a download (Windows); removed by the next save
+
+    @classmethod
+    def load(cls, index_path: Path) -> "ZipLayout":
+        """Layout stored by ``save``. Raises ``ValueError`` when a source file no longer matches it."""
+        index_path = Path(index_path)
+        data = json.loads(index_path.read_text(encoding="utf-8"))
+        blob_path = index_path.with_name(data["blob"])
+        layout = cls.__new__(cls)
+        layout._segments = []
+        needed = {}
+        for offset, length, path, path_offset in data["segments"]:
+            source = Path(path) if path else blob_path
+            layout._segments.append(_Segment(offset, length, path=source, path_offset=path_offset))
+            needed[source] = max(needed.get(source, 0), path_offset + length)
+        for source, size in needed.items():
+            try:
+                actual = source.stat().st_size
+            except OSError:
+                raise ValueError(f"Falta el archivo {source.name}; vuelve a generar el lote.")
+            if actual < size or (source != blob_path and actual != size):
+                raise ValueError(f"El archivo {source.name} cambió; vuelve a generar el lote.")
+        layout.size = data["size"]
+        layout.etag = data["etag"]
+        return layout
+
+    def _name(self, arcname: str) -> Tuple[bytes, int]:
+        return arcname.encode("utf-8"), 0 if arcname.isascii() else 0x800
+
+    def _local_header(self, arcname: str, crc: int, size: int) -> bytes:
+        name, flags = self._name(arcname)
+        extra, version, fsize = b"", 20, size
+        if size >= ZIP64_LIMIT:
+            extra, version, fsize = struct.pack("<HHQQ", 1, 16, size, size), 45, ZIP64_LIMIT
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, version, flags, 0, self._dostime, self._dosdate,
+            crc, fsize, fsize, len(name), len(extra),
+        ) + name + extra
+
+    def _central_header(self, arcname: str, crc: int, size: int, offset: int) -> bytes:
+        name, flags = self._name(arcname)
+        fields = []
+        fsize, foffset = size, offset
+        if size >= ZIP64_LIMIT:
+            fields += [size, size]
+            fsize = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+            foffset = ZIP64_LIMIT
+        extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields) if fields else b""
+        version = 45 if fields else 20
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, flags, 0, self._dostime, self._dosdate,
+            crc, fsize, fsize, len(name), len(extra), 0, 0, 0, 0o100644 << 16, foffset,
+        ) + name + extra
+
+    @staticmethod
+    def _end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+        out = b""
+        if count >= ZIP64_COUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            eocd64_offset = cd_offset + cd_size
+            out += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, (3 << 8) | 45, 45, 0, 0, count, count, cd_size, cd_offset)
+            out += struct.pack("<IIQI", 0x07064B50, 0, eocd64_offset, 1)
+        return out + struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0,
+        )
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield bytes ``start..end`` (inclusive) of the archive."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        for seg in self._segments:
+            seg_end = seg.offset + seg.length - 1
+            if seg_end < start or seg.length == 0:
+                continue
+            if seg.offset > end:
+                break
+            lo = max(start, seg.offset) - seg.offset
+            hi = min(end, seg_end) - seg.offset + 1
+            if seg.data is not None:
+                yield seg.data[lo:hi]
+                continue
+            with open(seg.path, "rb") as f:
+                f.seek(seg.path_offset + lo)
+                remaining = hi - lo
+                while remaining:
+                    chunk = f.read(min(COPY_BUFFER, remaining))
+                    if not chunk:
+                        raise IOError(f"Archivo modificado durante la descarga: {seg.path.name}")
+                    remaining -= len(chunk)
+                    yield chunk
+
+
+def iter_file_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(COPY_BUFFER, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def parse_range_header(header: str, size: int) -> Union[None, Tuple[int, int], str]:
+    """
+    Parse a single ``bytes=`` range. Returns ``(start, end)``, ``None`` to serve the full body
+    (no/unsupported header, multiple ranges) or ``"unsatisfiable"``.
+    """
+    header = (header or "").strip()
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    spec = header[len("bytes="):].strip()
+    first, _, last = spec.partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return "unsatisfiable"
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
@@ -157,6 +157,83 @@ LOGOUT_REDIRECT_URL = "accounts:login"
 
 SAF_OUTPUT_ROOT = _path_setting("SAF_OUTPUT_ROOT", BASE_DIR / "generated_saf")
 SOFFICE_PATH = os.getenv("SOFFICE_PATH", "")
+# Generacion SAF: 1 = serial; >1 procesa items en paralelo (las conversiones DOCX tienen su propio limite).
+SAF_GENERATION_WORKERS = int(os.getenv("SAF_GENERATION_WORKERS", "1"))
+# El SAF se escribe directo al ZIP; 1 conserva ademas la carpeta SAF_OUTPUT_ROOT/<lote> (depuracion).
+SAF_KEEP_STAGING = os.getenv("SAF_KEEP_STAGING", "0") == "1"
+# Carpeta de staging: auto = hardlink -> reflink/copy_file_range -> copia; clone = sin hardlinks; copy = siempre copia.
+SAF_STAGING_LINK_MODE = os.getenv("SAF_STAGING_LINK_MODE", "auto").strip().lower()
+# Empaquetado: zip | tar | tar.gz. Compresion por archivo: auto (PDF sin comprimir, XML/texto deflate) | deflate | store.
+SAF_ARCHIVE_FORMAT = os.getenv("SAF_ARCHIVE_FORMAT", "zip").strip().lower()
+SAF_ARCHIVE_COMPRESSION = os.getenv("SAF_ARCHIVE_COMPRESSION", "auto").strip().lower()
+SAF_ARCHIVE_LEVEL = int(os.getenv("SAF_ARCHIVE_LEVEL", "6"))
+# Descarga: file = ZIP construido en disco; stream = el ZIP se arma al descargar (sin archivo, con soporte Range).
+SAF_DOWNLOAD_MODE = os.getenv("SAF_DOWNLOAD_MODE", "file").strip().lower()
+# Manifest (ruta, tamano, CRC-32, SHA-256 de cada archivo) junto al ZIP y dentro de el; base de los paquetes delta.
+SAF_MANIFEST = os.getenv("SAF_MANIFEST", "1") == "1"
+# Partes por carrera: 1 arma ademas un ZIP por carpeta de carrera (en paralelo), en volumenes de hasta N MB (0 = sin limite).
+SAF_SPLIT_BY_CAREER = os.getenv("SAF_SPLIT_BY_CAREER", "0") == "1"
+SAF_VOLUME_MAX_MB = float(os.getenv("SAF_VOLUME_MAX_MB", "0"))
+SAF_PART_WORKERS = int(os.getenv("SAF_PART_WORKERS", "4"))
+# Procesos para comprimir en paralelo (archivos grandes y tar.gz); 1 = sin pool de procesos.
+SAF_ARCHIVE_WORKERS = int(os.getenv("SAF_ARCHIVE_WORKERS", "1"))
+SAF_CONVERSION_WORKERS = int(os.getenv("SAF_CONVERSION_WORKERS", "1"))
+# LibreOffice: un perfil aislado por worker; en modo residente cada worker mantiene un soffice caliente.
+SOFFICE_PROFILE_ROOT = _path_setting("SOFFICE_PROFILE_ROOT", BASE_DIR / "soffice_profiles")
+SOFFICE_TIMEOUT = int(os.getenv("SOFFICE_TIMEOUT", "180"))
+SOFFICE_RESIDENT = os.getenv("SOFFICE_RESIDENT", "1") == "1"
+# Prioridad y limites de cada soffice: nice, clase ionice (best-effort/idle), CPUs permitidas ("0,1") y memoria (MB; 0 = sin limite).
+SOFFICE_NICE = int(os.getenv("SOFFICE_NICE", "10"))
+SOFFICE_IONICE = os.getenv("SOFFICE_IONICE", "best-effort")
+SOFFICE_CPU_AFFINITY = os.getenv("SOFFICE_CPU_AFFINITY", "")
+SOFFICE_MEMORY_MB = int(os.getenv("SOFFICE_MEMORY_MB", "0"))
+# Limites globales por proceso (todos los lotes comparten): conversiones, escrituras de archivo y copias simultaneas. 0 = sin limite.
+SAF_MAX_CONVERSIONS = int(os.getenv("SAF_MAX_CONVERSIONS", str(SAF_CONVERSION_WORKERS)))
+SAF_MAX_COMPRESSIONS = int(os.getenv("SAF_MAX_COMPRESSIONS", str(max(1, (os.cpu_count() or 2) // 2))))
+SAF_MAX_COPIES = int(os.getenv("SAF_MAX_COPIES", "2"))
+# Cache de conversiones DOCX -> PDF (clave: sha256 del DOCX + version del conversor). 0 = sin limite.
+SAF_CONVERSION_CACHE_ROOT = _path_setting("SAF_CONVERSION_CACHE_ROOT", BASE_DIR / "conversion_cache")
+SAF_CONVERSION_CACHE_MAX_MB = int(os.getenv("SAF_CONVERSION_CACHE_MAX_MB", "2048"))
+# Lotes grandes: items cargados por bloques (sus resultados se escriben a la BD una vez por bloque); reporte y log se escriben a disco (log_text guarda solo las primeras lineas).
+SAF_GENERATION_CHUNK_SIZE = int(os.getenv("SAF_GENERATION_CHUNK_SIZE", "500"))
+SAF_LOG_TEXT_MAX_LINES = int(os.getenv("SAF_LOG_TEXT_MAX_LINES", "300"))
+# Verificacion previa (primera etapa de la generacion): archivos, soffice y espacio libre. SHA-256 relee todo (lento).
+SAF_PREFLIGHT = os.getenv("SAF_PREFLIGHT", "1") == "1"
+SAF_PREFLIGHT_SHA256 = os.getenv("SAF_PREFLIGHT_SHA256", "0") == "1"
+SAF_PREFLIGHT_WORKERS = int(os.getenv("SAF_PREFLIGHT_WORKERS", "8"))
+# Re-exportacion masiva (manage.py saf_export): registros por parte; cada parte es un lote con su trabajo en la cola.
+SAF_EXPORT_BATCH_SIZE = int(os.getenv("SAF_EXPORT_BATCH_SIZE", "500"))
+# Ingesta de paquetes SAF existentes (manage.py saf_ingest): hilos de lectura/copia.
+SAF_INGEST_WORKERS = int(os.getenv("SAF_INGEST_WORKERS", "8"))
+# Validacion estructural del SAF terminado (dublin_core, metadata_*, contents, carpetas duplicadas).
+SAF_VALIDATE = os.getenv("SAF_VALIDATE", "1") == "1"
+# Estimacion de tiempo y ETA: lotes generados recientes de los que se aprende el rendimiento.
+SAF_ESTIMATE_HISTORY = int(os.getenv("SAF_ESTIMATE_HISTORY", "20"))
+# Perfil de trabajos marcados "Perfilar": intervalo de muestreo de pilas (ms).
+SAF_PROFILE_INTERVAL_MS = float(os.getenv("SAF_PROFILE_INTERVAL_MS", "10"))
+# Duracion maxima de cada conexion SSE de progreso; el navegador se reconecta solo (Last-Event-ID).
+SAF_SSE_MAX_SECONDS = float(os.getenv("SAF_SSE_MAX_SECONDS", "120"))
+# Conexiones SSE abiertas a la vez por proceso web (cada una ocupa un hilo de waitress); el resto usa sondeo.
+SAF_SSE_MAX_STREAMS = int(os.getenv("SAF_SSE_MAX_STREAMS", "2"))
+# Cola de trabajos SAF (manage.py saf_worker): lease renovado por heartbeat; un lease vencido se reintenta.
+SAF_WORKER_CONCURRENCY = int(os.getenv("SAF_WORKER_CONCURRENCY", "1"))
+# Prioridad reducida de saf_worker para que la web siga respondiendo (0 = normal; en Windows, "debajo de lo normal").
+SAF_WORKER_NICE = int(os.getenv("SAF_WORKER_NICE", "5"))
+SAF_WORKER_POLL_SECONDS = float(os.getenv("SAF_WORKER_POLL_SECONDS", "2"))
+SAF_JOB_LEASE_SECONDS = int(os.getenv("SAF_JOB_LEASE_SECONDS", "120"))
+SAF_JOB_HEARTBEAT_SECONDS = float(os.getenv("SAF_JOB_HEARTBEAT_SECONDS", "30"))
+SAF_JOB_MAX_ATTEMPTS = int(os.getenv("SAF_JOB_MAX_ATTEMPTS", "3"))
+# Al aprobar un registro, el worker prepara su item SAF (conversion, XML, ZIP) antes de generar el grupo.
+SAF_SPECULATIVE_STAGING = os.getenv("SAF_SPECULATIVE_STAGING", "1") == "1"
+# Cache compartida por web y saf_worker (progreso en vivo). Sin valor: cache en memoria de cada proceso.
+SAF_CACHE_DIR = os.getenv("SAF_CACHE_DIR", "").strip()
+if SAF_CACHE_DIR:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": SAF_CACHE_DIR,
+        }
+    }
 THESIS_DNI_DEFAULT_LENGTH = int(os.getenv("THESIS_DNI_DEFAULT_LENGTH", "8"))
 
 # Base URL público del repositorio DSpace (opcional). Ej: https://repositorio.autonomadeica.edu.pe